@@ -1,82 +1,36 @@
 import streamlit as st
-import requests
-import os
-import mysql.connector  # type: ignore
-from dotenv import load_dotenv  # type: ignore
 import logging
 import traceback
-import hashlib
-
-logging.basicConfig(
-    filename='app.log',
-    level=logging.DEBUG,
-    format='%(asctime)s [%(levelname)s] %(message)s'
-)
-
-# Carregar variáveis do .env
-load_dotenv()
-
-# API Key TMDb
-API_KEY = os.getenv("TMDB_API_KEY")
-IMG_BASE = "https://image.tmdb.org/t/p/w500"
-
-# Conexão com o banco
-def conectar_mysql():
-    return mysql.connector.connect(
-        host=os.getenv("DB_HOST", "localhost"),
-        port=int(os.getenv("DB_PORT", "3305")),
-        user=os.getenv("DB_USER", "angeloiumatti"),
-        password=os.getenv("DB_PASSWORD", "Gfi#261022"),
-        database=os.getenv("DB_NAME", "filmes_db")
-    )
+import uuid
 
-# Função de hash de senha
-def hash_senha(senha):
-    return hashlib.sha256(senha.encode()).hexdigest()
+from classificador import servicos, tmdb, rastreamento
+from classificador.posters import obter_posters
+from classificador.filmes_salvos import normalizar_filtros
+from classificador import estatisticas
+from classificador.classificacao import rotulos
+from classificador.fila_gravacao import FilaOcupada
 
-# Função para autenticação
-def autenticar_usuario(email, senha):
-    try:
-        conn = conectar_mysql()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, senha_hash FROM usuarios WHERE email = %s", (email,))
-        resultado = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        if resultado and resultado[1] == hash_senha(senha):
-            return resultado[0]
-    except:
-        pass
-    return None
-
-# Função para registrar novo usuário
-def registrar_usuario(email, senha):
-    try:
-        conn = conectar_mysql()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO usuarios (email, senha_hash) VALUES (%s, %s)", (email, hash_senha(senha)))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True
-    except:
-        return False
+# .env e logging: uma vez por processo, não a cada rerun
+servicos.iniciar()
 
-# Função para excluir um filme
-def excluir_filme(filme_id):
-    try:
-        conn = conectar_mysql()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM filmes WHERE id = %s AND usuario_id = %s", (filme_id, usuario_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        st.error("Erro ao excluir filme.")
-        logging.error("Erro ao excluir filme:\n%s", traceback.format_exc())
+# Rastreamento do rerun: consultas, requisições e seções da página
+if "sessao_rastreamento" not in st.session_state:
+    st.session_state["sessao_rastreamento"] = uuid.uuid4().hex[:12]
+rastreamento.iniciar_rerun(st.session_state["sessao_rastreamento"])
+
+# Fecha o rerun e mostra o painel de depuração (RASTREAMENTO_PAINEL=1)
+def encerrar_rerun():
+    resumo = rastreamento.finalizar_rerun()
+    if resumo and rastreamento.painel_ativo():
+        rastreamento.mostrar_painel(resumo)
+
+# Exibe a miniatura local do pôster; se o download falhar, usa a URL original
+def mostrar_poster(poster_url, largura):
+    st.image(obter_posters().obter(poster_url, largura) or poster_url, width=largura)
 
 # Autenticação
 if "usuario_id" not in st.session_state:
+    rastreamento.secao("login")
     st.subheader("🔐 Login ou Cadastro")
     aba = st.radio("Escolha uma opção:", ["Login", "Cadastro"])
     email = st.text_input("Email")
@@ -84,7 +38,7 @@ if "usuario_id" not in st.session_state:
 
     if aba == "Login":
         if st.button("Entrar"):
-            usuario_id = autenticar_usuario(email, senha)
+            usuario_id = servicos.autenticar_usuario(email, senha)
             if usuario_id:
                 st.session_state.usuario_id = usuario_id
                 st.success("Login realizado com sucesso!")
@@ -93,83 +47,103 @@ if "usuario_id" not in st.session_state:
                 st.error("Email ou senha incorretos.")
     else:
         if st.button("Cadastrar"):
-            if registrar_usuario(email, senha):
+            if servicos.registrar_usuario(email, senha):
                 st.success("Usuário cadastrado! Faça login.")
             else:
                 st.error("Erro ao cadastrar. Tente outro email.")
+    encerrar_rerun()
     st.stop()
 
 # Usuário logado
 usuario_id = st.session_state.usuario_id
+rastreamento.secao("cabecalho")
 
-try:
-    conn = conectar_mysql()
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1")
-    conn.close()
-except Exception as e:
-    st.error(f"❌ Erro de conexão com o MySQL: {e}")
-
-def buscar_filmes(titulo):
-    url = "https://api.themoviedb.org/3/search/movie"
-    params = {
-        "api_key": API_KEY,
-        "query": titulo,
-        "language": "pt-BR"
-    }
-    resposta = requests.get(url, params=params)
-    if resposta.status_code == 200:
-        return resposta.json().get("results", [])
-    return []
-
-def classificar_filme(nota):
-    if nota <= 4:
-        return "Ruim"
-    elif 4 < nota <= 6:
-        return "Mediano"
-    elif 7 <= nota <= 9:
-        return "Bom"
-    else:
-        return "Filmão"
+# Teste de conexão: uma vez por intervalo no processo, não a cada rerun
+erro_conexao = servicos.verificar_conexao()
+if erro_conexao:
+    st.error(f"❌ Erro de conexão com o MySQL: {erro_conexao}")
 
-def salvar_filme(titulo, ano, assistido_em, poster_url, nota, classificacao):
+def salvar_filme(tmdb_id, titulo, ano, assistido_em, poster_url, nota):
     try:
-        conn = conectar_mysql()
-        cursor = conn.cursor()
-
-        sql_select = "SELECT id FROM filmes WHERE titulo = %s AND ano = %s AND usuario_id = %s"
-        cursor.execute(sql_select, (titulo, ano, usuario_id))
-        resultado = cursor.fetchone()
-
-        if resultado:
-            sql_update = """
-                UPDATE filmes
-                SET assistido_em = %s, poster_url = %s, nota = %s, classificacao = %s
-                WHERE id = %s
-            """
-            cursor.execute(sql_update, (assistido_em, poster_url, nota, classificacao, resultado[0]))
-        else:
-            sql_insert = """
-                INSERT INTO filmes (titulo, ano, assistido_em, poster_url, nota, classificacao, usuario_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql_insert, (titulo, ano, assistido_em, poster_url, nota, classificacao, usuario_id))
+        return servicos.salvar_filme(usuario_id, tmdb_id, titulo, ano, assistido_em, poster_url, nota)
+    except Exception as e:
+        st.error("❌ Erro ao salvar no banco.")
+        logging.error("Erro ao salvar filme:\n%s", traceback.format_exc())
+        return None
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+# Função para excluir um filme
+def excluir_filme(tmdb_id):
+    try:
+        servicos.excluir_filme(usuario_id, tmdb_id)
+    except Exception as e:
+        st.error("Erro ao excluir filme.")
+        logging.error("Erro ao excluir filme:\n%s", traceback.format_exc())
 
+# Edição em lote da página da lista: nota e ano assistido editáveis e uma
+# coluna para excluir. Tudo vai numa transação e num rerun só; a última
+# edição pode ser desfeita.
+def editar_em_lote(filmes):
+    if "lote_versao" not in st.session_state:
+        st.session_state["lote_versao"] = 0
+    tabela = [
+        {"tmdb_id": f["tmdb_id"], "Filme": f"{f['titulo']} ({f['ano']})", "Assistido em": f["assistido_em"],
+         "Nota": float(f["nota"]), "Excluir": False}
+        for f in filmes
+    ]
+    editada = st.data_editor(
+        tabela,
+        key=f"lote_{st.session_state['lote_versao']}",
+        hide_index=True,
+        disabled=["Filme"],
+        column_config={
+            "tmdb_id": None,
+            "Assistido em": st.column_config.NumberColumn(min_value=1900, max_value=2100, step=1, format="%d"),
+            "Nota": st.column_config.NumberColumn(min_value=0.0, max_value=10.0, step=0.5, required=True),
+            "Excluir": st.column_config.CheckboxColumn("🗑️ Excluir"),
+        },
+    )
+    edicoes = {}
+    exclusoes = []
+    for original, linha in zip(tabela, editada):
+        if linha["Excluir"]:
+            exclusoes.append(original["tmdb_id"])
+        elif (linha["Assistido em"], linha["Nota"]) != (original["Assistido em"], original["Nota"]):
+            assistido_em = int(linha["Assistido em"]) if linha["Assistido em"] is not None else None
+            edicoes[original["tmdb_id"]] = (assistido_em, linha["Nota"])
+
+    col_aplicar, col_desfazer = st.columns([1, 1])
+    with col_aplicar:
+        aplicar = st.button(f"💾 Aplicar ({len(edicoes)} editados, {len(exclusoes)} excluídos)",
+                            disabled=not (edicoes or exclusoes))
+    with col_desfazer:
+        desfazer = st.session_state.get("desfazer_lote") is not None and st.button("↩️ Desfazer última edição")
+    try:
+        if aplicar:
+            lote = servicos.editar_lote(usuario_id, edicoes, exclusoes)
+            if lote is not None:
+                st.session_state["desfazer_lote"] = lote
+        elif desfazer:
+            # Só sai da sessão se deu certo, para poder tentar de novo
+            servicos.desfazer_lote(usuario_id, st.session_state["desfazer_lote"])
+            del st.session_state["desfazer_lote"]
+    except FilaOcupada:
+        st.error("Suas últimas avaliações ainda estão sendo gravadas. Tente de novo em alguns segundos.")
+        logging.warning("Edição em lote com gravações na fila:\n%s", traceback.format_exc())
+        return
     except Exception as e:
-        erro = traceback.format_exc()
-        print("❌ Erro ao salvar filme:\n", erro)
-        st.error("❌ Erro ao salvar no banco.")
-        logging.error("Erro ao salvar filme:\n%s", erro)
+        st.error("Erro ao aplicar a edição em lote.")
+        logging.error("Erro na edição em lote:\n%s", traceback.format_exc())
+        return
+    if aplicar or desfazer:
+        # Tabela nova: as edições pendentes eram da página antiga
+        st.session_state["lote_versao"] += 1
+        st.rerun()
 
 # Interface principal após login
 st.title("🎬 Classificador de Filmes")
 
 # Botões para alternar visibilidade
-col1, col2 = st.columns([1, 1])
+col1, col2, col3 = st.columns([1, 1, 1])
 with col1:
     if "mostrar_filmes" not in st.session_state:
         st.session_state.mostrar_filmes = False
@@ -182,111 +156,161 @@ with col2:
     if st.button("📊 Ver estatísticas"):
         st.session_state.mostrar_estatisticas = not st.session_state.mostrar_estatisticas
 
+with col3:
+    if "mostrar_recomendacoes" not in st.session_state:
+        st.session_state.mostrar_recomendacoes = False
+    if st.button("✨ Recomendações"):
+        st.session_state.mostrar_recomendacoes = not st.session_state.mostrar_recomendacoes
+
 # Campo de busca de filmes
+rastreamento.secao("busca")
 st.markdown("---")
 titulo_busca = st.text_input("Digite o nome de um filme:")
 if "resultados" not in st.session_state:
     st.session_state["resultados"] = []
 
 if st.button("Buscar"):
-    st.session_state["resultados"] = buscar_filmes(titulo_busca)
+    st.session_state["resultados"] = servicos.buscar_filmes(titulo_busca)
+    # Título, última página da TMDb carregada e se ela veio cheia (há mais)
+    st.session_state["busca_atual"] = (titulo_busca, 1, len(st.session_state["resultados"]) >= 20)
+    st.session_state["inicio_resultados"] = 0
+    # Pôsteres, detalhes e a próxima página em segundo plano
+    servicos.precarregar_busca(st.session_state["sessao_rastreamento"], titulo_busca, st.session_state["resultados"])
 
 if st.session_state.get("resultados"):
+    resultados = st.session_state["resultados"]
+    inicio = st.session_state.get("inicio_resultados", 0)
     col1, col2 = st.columns(2)
-    for idx, filme in enumerate(st.session_state["resultados"][:5]):
+    # Carregado uma vez por processo; salvar/excluir mantêm o índice atualizado
+    assistidos = servicos.assistidos(usuario_id)
+
+    obter_posters().precarregar(
+        [tmdb.url_poster(f.get("poster_path")) for f in resultados[inicio:inicio + 5]], 200
+    )
+
+    for idx, filme in enumerate(resultados[inicio:inicio + 5]):
         titulo = filme.get("title")
         ano = filme.get("release_date", "")[:4]
-        poster = filme.get("poster_path")
-        poster_url = f"{IMG_BASE}{poster}" if poster else ""
+        poster_url = tmdb.url_poster(filme.get("poster_path"))
         id_filme = filme.get("id")
 
-        # Verifica se já foi assistido
-        conn = conectar_mysql()
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM filmes WHERE titulo = %s AND ano = %s AND usuario_id = %s", (titulo, ano, usuario_id))
-        assistido = cursor.fetchone()[0] > 0
-        cursor.close()
-        conn.close()
+        # Verifica se já foi assistido (pela id da TMDb)
+        assistido = assistidos.contem(id_filme)
 
         alvo = col1 if idx % 2 == 0 else col2
         with alvo.form(key=f"form_{id_filme}"):
             icone = " ✅" if assistido else ""
             st.subheader(f"{titulo} ({ano}){icone}")
+            # Só aparece quando a pré-carga já trouxe os detalhes
+            detalhes = servicos.detalhes_em_cache(id_filme)
+            if detalhes:
+                partes = [f"{detalhes['runtime']} min" if detalhes.get("runtime") else ""]
+                partes.append(", ".join(g["name"] for g in detalhes.get("genres", [])))
+                if any(partes):
+                    st.caption(" · ".join(p for p in partes if p))
             if poster_url:
-                st.image(poster_url, width=200)
+                mostrar_poster(poster_url, 200)
             nota = st.slider(f"Nota para '{titulo}'", 0.0, 10.0, 7.0, 0.5, key=f"nota_{id_filme}")
             assistido_em = st.number_input("Ano em que assistiu", min_value=1900, max_value=2100, value=2024, step=1, key=f"assistido_{id_filme}")
             submitted = st.form_submit_button("Salvar avaliação")
 
             if submitted:
-                classificacao = classificar_filme(nota)
-                salvar_filme(titulo, int(ano) if ano else None, assistido_em, poster_url, nota, classificacao)
-                st.success(f"Filme salvo com classificação: {classificacao}")
+                classificacao = salvar_filme(id_filme, titulo, int(ano) if ano else None, assistido_em, poster_url, nota)
+                if classificacao:
+                    st.success(f"Filme salvo com classificação: {classificacao}")
+
+    # Cinco resultados por vez; depois do último da página da TMDb vem a
+    # próxima, que a pré-carga normalmente já deixou no cache
+    col_anteriores, col_proximos = st.columns(2)
+    if inicio > 0 and col_anteriores.button("⬅️ Anteriores"):
+        st.session_state["inicio_resultados"] = max(0, inicio - 5)
+        st.experimental_rerun()
+    titulo_atual, pagina, ha_mais = st.session_state.get("busca_atual", ("", 1, False))
+    if (inicio + 5 < len(resultados) or ha_mais) and col_proximos.button("Próximos ➡️"):
+        if inicio + 5 >= len(resultados):
+            pagina_nova = servicos.buscar_filmes(titulo_atual, pagina=pagina + 1)
+            vistos = {f.get("id") for f in resultados}
+            novos = [f for f in pagina_nova if f.get("id") not in vistos]
+            st.session_state["busca_atual"] = (titulo_atual, pagina + 1, len(pagina_nova) >= 20)
+            resultados.extend(novos)
+            servicos.precarregar_busca(st.session_state["sessao_rastreamento"], titulo_atual, novos, pagina + 1)
+        if inicio + 5 < len(resultados):
+            st.session_state["inicio_resultados"] = inicio + 5
+            st.experimental_rerun()
+        else:
+            st.info("Não há mais resultados.")
 
 st.markdown("---")
 
+rastreamento.secao("filmes_salvos")
 if st.session_state.mostrar_filmes:
     try:
-        conn = conectar_mysql()
-        cursor = conn.cursor(dictionary=True)
-
-        cursor.execute("SELECT DISTINCT assistido_em FROM filmes WHERE usuario_id = %s ORDER BY assistido_em DESC", (usuario_id,))
-        anos = [row['assistido_em'] for row in cursor.fetchall() if row['assistido_em']]
+        # Busca na própria lista pelo índice de títulos, sem consultar o banco
+        busca = st.text_input("🔎 Buscar na sua lista", placeholder="Parte do título, sem precisar de acentos")
+        if busca.strip():
+            achados = servicos.buscar_na_biblioteca(usuario_id, busca)
+            for filme in achados:
+                st.write(f"**{filme['titulo']} ({filme['ano']})**")
+            if not achados:
+                st.caption("Nenhum filme da sua lista com esse título.")
 
-        ano_filtro = st.selectbox("Filtrar por ano assistido", ["Todos"] + anos)
-        classificacoes = st.multiselect("Filtrar por classificação", ["Ruim", "Mediano", "Bom", "Filmão"], default=["Ruim", "Mediano", "Bom", "Filmão"])
+        ano_filtro = st.selectbox("Filtrar por ano assistido", ["Todos"] + servicos.anos_assistidos(usuario_id))
+        classificacoes = st.multiselect("Filtrar por classificação", rotulos(), default=rotulos())
         nota_min = st.slider("Nota mínima", 0.0, 10.0, 0.0, 0.5)
         nota_max = st.slider("Nota máxima", 0.0, 10.0, 10.0, 0.5)
+        tamanho_pagina = st.selectbox("Filmes por página", [10, 25, 50, 100], index=1)
 
-        query = "SELECT * FROM filmes WHERE usuario_id = %s"
-        params = [usuario_id]
-
-        if ano_filtro != "Todos":
-            query += " AND assistido_em = %s"
-            params.append(ano_filtro)
-        if classificacoes:
-            placeholders = ','.join(['%s'] * len(classificacoes))
-            query += f" AND classificacao IN ({placeholders})"
-            params.extend(classificacoes)
-        query += " AND nota BETWEEN %s AND %s"
-        params.extend([nota_min, nota_max])
+        # Chaves das páginas já visitadas; voltam ao início quando o filtro muda
+        filtros = normalizar_filtros(ano_filtro, classificacoes, nota_min, nota_max)
+        if st.session_state.get("pagina_filtros") != (filtros, tamanho_pagina):
+            st.session_state["pagina_filtros"] = (filtros, tamanho_pagina)
+            st.session_state["pagina_chaves"] = [None]
+        chaves = st.session_state["pagina_chaves"]
 
-        cursor.execute(query, tuple(params))
-        filmes = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        filmes, proxima = servicos.pagina_filmes(usuario_id, filtros, tamanho_pagina, chaves[-1])
 
-        for filme in filmes:
-            cols = st.columns([1, 4])
-            with cols[0]:
-                if filme['poster_url']:
-                    st.image(filme['poster_url'], width=80)
-            with cols[1]:
-                st.write(f"**{filme['titulo']} ({filme['ano']})**")
-                st.caption(f"🎞️ Assistido em: {filme['assistido_em']} | ⭐ Nota: {filme['nota']} | 📌 {filme['classificacao']}")
+        if st.toggle("✏️ Editar em lote"):
+            editar_em_lote(filmes)
+        else:
+            obter_posters().precarregar([f['poster_url'] for f in filmes], 80)
+            for filme in filmes:
+                cols = st.columns([1, 4])
+                with cols[0]:
+                    if filme['poster_url']:
+                        mostrar_poster(filme['poster_url'], 80)
+                with cols[1]:
+                    st.write(f"**{filme['titulo']} ({filme['ano']})**")
+                    st.caption(f"🎞️ Assistido em: {filme['assistido_em']} | ⭐ Nota: {filme['nota']} | 📌 {filme['classificacao']}")
+
+        nav1, nav2, nav3 = st.columns([1, 2, 1])
+        with nav1:
+            if len(chaves) > 1 and st.button("⬅️ Anterior"):
+                chaves.pop()
+                st.rerun()
+        with nav2:
+            st.caption(f"Página {len(chaves)}")
+        with nav3:
+            if proxima is not None and st.button("Próxima ➡️"):
+                chaves.append(proxima)
+                st.rerun()
 
     except Exception as e:
         st.error("Erro ao carregar filmes salvos.")
 
+rastreamento.secao("estatisticas")
 if st.session_state.mostrar_estatisticas:
     try:
-        conn = conectar_mysql()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT COUNT(*) as total FROM filmes WHERE usuario_id = %s", (usuario_id,))
-        total = cursor.fetchone()['total']
+        # Estatísticas mantidas por salvar_filme/excluir_filme, lidas uma vez por processo
+        dados = servicos.ler_estatisticas(usuario_id)
+        total = dados["total"]
+        top_filmes = dados["top"][:estatisticas.TOP_EXIBIDOS]
 
         st.subheader(f"📊 Estatísticas Gerais")
         st.markdown(f"**🎞️ Total de filmes assistidos:** {total}")
 
-        cursor.execute("SELECT classificacao, COUNT(*) as qtd FROM filmes WHERE usuario_id = %s GROUP BY classificacao", (usuario_id,))
-        dados = cursor.fetchall()
-
-        for row in dados:
-            porcentagem = (row['qtd'] / total) * 100 if total > 0 else 0
-            st.markdown(f"- {row['classificacao']}: {porcentagem:.1f}%")
-
-        cursor.execute("SELECT titulo, ano, nota, poster_url FROM filmes WHERE usuario_id = %s ORDER BY nota DESC LIMIT 5", (usuario_id,))
-        top_filmes = cursor.fetchall()
+        for classificacao, qtd in dados["classificacoes"].items():
+            porcentagem = (qtd / total) * 100 if total > 0 else 0
+            st.markdown(f"- {classificacao}: {porcentagem:.1f}%")
 
         st.markdown("---")
         st.subheader("🏆 Top 5 mais bem avaliados")
@@ -294,23 +318,49 @@ if st.session_state.mostrar_estatisticas:
             cols = st.columns([1, 4])
             with cols[0]:
                 if filme['poster_url']:
-                    st.image(filme['poster_url'], width=80)
+                    mostrar_poster(filme['poster_url'], 80)
             with cols[1]:
                 st.write(f"**{filme['titulo']} ({filme['ano']})**")
                 st.caption(f"🎞️ Assistido em: {filme['assistido_em']} | ⭐ Nota: {filme['nota']} | 📌 {filme['classificacao']}")
-                if st.button(f"🗑️ Excluir", key=f"excluir_{filme['id']}"):
+                if st.button(f"🗑️ Excluir", key=f"excluir_{filme['tmdb_id']}"):
                     if st.confirm("Tem certeza que deseja excluir esta avaliação?"):
-                        excluir_filme(filme['id'])
+                        excluir_filme(filme['tmdb_id'])
                         st.experimental_rerun()
 
-        cursor.close()
-        conn.close()
-
     except Exception as e:
         st.error("Erro ao carregar estatísticas.")
 
+rastreamento.secao("recomendacoes")
+if st.session_state.mostrar_recomendacoes:
+    try:
+        # Vizinhos pré-calculados (python -m classificador.recomendacoes) e as notas atuais do usuário
+        recomendados = servicos.recomendacoes_usuario(usuario_id)
+        st.subheader("✨ Você pode gostar")
+        if recomendados is None:
+            st.info("Recomendações indisponíveis: o modelo ainda não foi gerado.")
+        elif not recomendados:
+            st.info("Avalie mais alguns filmes para receber recomendações.")
+        else:
+            obter_posters().precarregar([f['poster_url'] for f in recomendados], 80)
+            for filme in recomendados:
+                cols = st.columns([1, 4])
+                with cols[0]:
+                    if filme['poster_url']:
+                        mostrar_poster(filme['poster_url'], 80)
+                with cols[1]:
+                    st.write(f"**{filme['titulo']} ({filme['ano']})**")
+                    st.caption(f"🔮 Nota prevista: {filme['nota_prevista']}")
+
+    except Exception as e:
+        st.error("Erro ao carregar recomendações.")
+        logging.error("Erro ao recomendar:\n%s", traceback.format_exc())
+
 # Botão de logout
+rastreamento.secao(None)
 if st.button("🔒 Logout"):
+    servicos.sair(usuario_id)
     del st.session_state.usuario_id
     st.success("Logout realizado com sucesso!")
-    st.rerun()
\ No newline at end of file
+    st.rerun()
+
+encerrar_rerun()
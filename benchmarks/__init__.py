@@ -0,0 +1 @@
+# Benchmarks do app: python -m benchmarks.reruns
@@ -0,0 +1,511 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import urllib.request
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.reruns import RAIZ, _commit
+
+
+# Carga de sessões simultâneas: quantos usuários ao mesmo tempo um processo
+# do app aguenta antes de a latência desandar, e quanto ajuda ter mais
+# processos. Sobe P servidores `streamlit run app.py` de verdade (cada um com
+# o próprio interpretador, pool e caches) e N sessões roteirizadas que falam
+# com eles como o navegador, pelo WebSocket /_stcore/stream e as mensagens
+# protobuf do próprio Streamlit: login, busca, avaliação, lista com filtro e
+# estatísticas, com uma pausa de leitura entre as interações. As sessões são
+# distribuídas entre os processos como por um balanceador com afinidade. A
+# TMDb é a falsa (classificador.tmdb_falso, em outro processo) e o banco, um
+# SQLite temporário ou o MySQL de --banco (o nome precisa conter "bench").
+#
+#   python -m benchmarks.carga medir                          N = 1 4 16 32, P = 1 2
+#   python -m benchmarks.carga medir --sessoes 8 32 64 --processos 1 2 4 --segundos 30
+#   python -m benchmarks.carga medir --motor mysql --banco filmes_bench
+#   python -m benchmarks.carga comparar antes.json depois.json
+#
+# Para cada (P, N): interações por segundo, p50/p99 da latência vista pela
+# sessão (do clique ao fim do rerun, st.rerun() incluído) e erros; do lado
+# dos servidores (RASTREAMENTO_JSONL de cada um): reruns, duração do rerun,
+# consultas por rerun, pico de conexões em uso no pool e esperas por
+# conexão. A diferença entre a latência da sessão e a do rerun é a fila: o
+# tempo esperando o interpretador, o banco ou outro rerun da mesma sessão.
+# Grava tudo em benchmarks/resultados/carga-<commit>.json.
+
+SESSOES = [1, 4, 16, 32]
+PROCESSOS = [1, 2]
+PERCENTIS = [50, 90, 99]
+EMAIL = "carga{:04d}@exemplo.com"
+
+# ForwardMsg.script_finished: o rerun parou para recomeçar (st.rerun());
+# a interação só termina no rerun seguinte
+FIM_PARA_RERUN = 2
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _esperar_http(url, prazo, processo=None):
+    limite = time.monotonic() + prazo
+    while time.monotonic() < limite:
+        if processo is not None and processo.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resposta:
+                if resposta.status < 500:
+                    return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+# Desenha antes os pôsteres que as páginas vão pedir (um arquivo por semente;
+# a TMDb falsa guarda o PNG pela semente): desenhar conta como latência do app
+def _aquecer_tmdb(url_imagens, catalogo):
+    from benchmarks.dados import filmes_sinteticos
+
+    arquivos = [f["poster_path"].lstrip("/") for f in catalogo]
+    arquivos += [poster_url.rsplit("/", 1)[1] for *_, poster_url in filmes_sinteticos(50, url_imagens)]
+    por_semente = {sum(arquivo.encode()): arquivo for arquivo in arquivos}
+    for arquivo in por_semente.values():
+        with urllib.request.urlopen(f"{url_imagens}/{arquivo}", timeout=60) as resposta:
+            resposta.read()
+
+
+def _percentis(valores):
+    if not valores:
+        return {f"p{p}": 0.0 for p in PERCENTIS} | {"max": 0.0}
+    return {f"p{p}": float(np.percentile(valores, p)) for p in PERCENTIS} | {"max": float(max(valores))}
+
+
+# Uma aba do navegador conectada a um servidor. Guarda os widgets do último
+# rerun pelo rótulo; o servidor mantém os valores dos que não mudaram, então
+# cada interação manda só o que a pessoa mexeu.
+class Sessao:
+    def __init__(self, url):
+        self.url = url
+        self.ws = None
+        self.widgets = []  # (rótulo, id), na ordem da página
+        self.erros = []
+
+    async def conectar(self):
+        from websockets.asyncio.client import connect  # type: ignore
+
+        self.ws = await connect(self.url, subprotocols=["streamlit"], max_size=None, open_timeout=30)
+
+    async def fechar(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    def tem(self, rotulo):
+        return any(r.startswith(rotulo) for r, _ in self.widgets)
+
+    # Ids dos widgets cujo rótulo começa com `rotulo`, na ordem da página
+    def ids(self, rotulo):
+        ids = [i for r, i in self.widgets if r.startswith(rotulo)]
+        if not ids:
+            raise LookupError(f"widget '{rotulo}' não está na página")
+        return ids
+
+    def texto(self, rotulo, valor, i=0):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        return WidgetState(id=self.ids(rotulo)[i], string_value=valor)
+
+    def nota(self, rotulo, valor, i=0):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        estado = WidgetState(id=self.ids(rotulo)[i])
+        estado.double_array_value.data.append(valor)
+        return estado
+
+    def clique(self, rotulo, i=0):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        return WidgetState(id=self.ids(rotulo)[i], trigger_value=True)
+
+    # Manda os widgets alterados e espera o fim do rerun; devolve os ms
+    async def interagir(self, estados=()):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        mensagem = BackMsg()
+        mensagem.rerun_script.query_string = ""
+        mensagem.rerun_script.widget_states.widgets.extend(estados)
+        inicio = time.perf_counter()
+        await self.ws.send(mensagem.SerializeToString())
+        widgets, erros = [], []
+        while True:
+            recebida = ForwardMsg()
+            recebida.ParseFromString(await self.ws.recv())
+            tipo = recebida.WhichOneof("type")
+            if tipo == "script_finished":
+                if recebida.script_finished == FIM_PARA_RERUN:
+                    widgets, erros = [], []
+                    continue
+                break
+            if tipo != "delta" or recebida.delta.WhichOneof("type") != "new_element":
+                continue
+            elemento = recebida.delta.new_element
+            nome = elemento.WhichOneof("type")
+            conteudo = getattr(elemento, nome)
+            if nome == "exception":
+                erros.append(conteudo.message)
+            elif nome == "alert" and conteudo.format == conteudo.ERROR:
+                erros.append(conteudo.body)
+            elif getattr(conteudo, "id", "") and hasattr(conteudo, "label"):
+                widgets.append((conteudo.label, conteudo.id))
+        self.widgets = widgets
+        self.erros = erros
+        return (time.perf_counter() - inicio) * 1000
+
+
+# Roteiro de uma pessoa: entra e repete busca, avaliação, lista com filtro e
+# estatísticas até o prazo. Cada interação vira (nome, ms, ok).
+async def roteiro(url, email, consultas, pausa, prazo, semente, amostras):
+    from benchmarks.dados import SENHA
+
+    aleatorio = random.Random(semente)
+    sessao = Sessao(url)
+
+    async def passo(nome, *estados):
+        await asyncio.sleep(pausa * aleatorio.uniform(0.5, 1.5))
+        ms = await sessao.interagir(estados)
+        amostras.append((nome, ms, not sessao.erros))
+
+    try:
+        await asyncio.sleep(aleatorio.uniform(0, pausa))
+        await sessao.conectar()
+        await sessao.interagir()
+        await passo("login", sessao.texto("Email", email), sessao.texto("Senha", SENHA), sessao.clique("Entrar"))
+        if not sessao.tem("Digite o nome"):
+            raise RuntimeError(f"login de {email} falhou: {sessao.erros}")
+        while time.monotonic() < prazo:
+            await passo("buscar", sessao.texto("Digite o nome", aleatorio.choice(consultas)), sessao.clique("Buscar"))
+            if sessao.tem("Salvar avaliação"):
+                i = aleatorio.randrange(len(sessao.ids("Salvar avaliação")))
+                await passo("avaliar", sessao.nota("Nota para", aleatorio.randint(0, 20) / 2, i),
+                            sessao.clique("Salvar avaliação", i))
+            await passo("lista", sessao.clique("🎞️ Ver filmes salvos"))
+            await passo("filtrar", sessao.nota("Nota mínima", float(aleatorio.randint(0, 8))))
+            await passo("lista", sessao.clique("🎞️ Ver filmes salvos"))
+            await passo("estatisticas", sessao.clique("📊 Ver estatísticas"))
+            await passo("estatisticas", sessao.clique("📊 Ver estatísticas"))
+    except Exception as e:
+        amostras.append(("falha", 0.0, False))
+        print(f"{email}: {type(e).__name__}: {e}", file=sys.stderr)
+    finally:
+        await sessao.fechar()
+
+
+async def _rodar_sessoes(urls, emails, consultas, pausa, segundos, semente):
+    amostras = []
+    prazo = time.monotonic() + segundos
+    await asyncio.gather(*(
+        roteiro(urls[i % len(urls)], email, consultas, pausa, prazo, semente + i, amostras)
+        for i, email in enumerate(emails)
+    ))
+    return amostras
+
+
+# Um rerun em cada servidor antes de medir: imports e conexões do primeiro
+# rerun não contam
+async def _aquecer(urls):
+    for url in urls:
+        sessao = Sessao(url)
+        await sessao.conectar()
+        await sessao.interagir()
+        await sessao.fechar()
+
+
+class Servidores:
+    def __init__(self, quantidade, ambiente, pasta):
+        self.quantidade = quantidade
+        self.ambiente = ambiente
+        self.pasta = pasta
+        self.processos = []  # (porta, Popen, jsonl, stderr)
+        self._marcas = {}  # jsonl -> tamanho quando a medição começou
+
+    def __enter__(self):
+        for i in range(self.quantidade):
+            porta = _porta_livre()
+            jsonl = os.path.join(self.pasta, f"servidor-{i}.jsonl")
+            erros = open(os.path.join(self.pasta, f"servidor-{i}.err"), "w", encoding="utf-8")
+            ambiente = dict(self.ambiente, RASTREAMENTO_JSONL=jsonl,
+                            LOG_ARQUIVO=os.path.join(self.pasta, f"app-{i}.log"))
+            comando = [sys.executable, "-m", "streamlit", "run", os.path.join(RAIZ, "app.py"),
+                       "--server.port", str(porta), "--server.address", "127.0.0.1",
+                       "--server.headless", "true", "--server.fileWatcherType", "none",
+                       "--browser.gatherUsageStats", "false"]
+            processo = subprocess.Popen(comando, env=ambiente, cwd=self.pasta, stdout=subprocess.DEVNULL, stderr=erros)
+            self.processos.append((porta, processo, jsonl, erros))
+        for porta, processo, _, erros in self.processos:
+            if not _esperar_http(f"http://127.0.0.1:{porta}/_stcore/health", 60, processo):
+                self.__exit__()
+                with open(erros.name, encoding="utf-8") as f:
+                    ultima = (f.read().strip().splitlines() or ["?"])[-1]
+                sys.exit(f"servidor na porta {porta} não subiu ({ultima})")
+        return self
+
+    def urls(self):
+        return [f"ws://127.0.0.1:{porta}/_stcore/stream" for porta, _, _, _ in self.processos]
+
+    def __exit__(self, *exc):
+        for _, processo, _, _ in self.processos:
+            processo.terminate()
+        for _, processo, _, erros in self.processos:
+            try:
+                processo.wait(10)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+            erros.close()
+
+    # Daqui em diante: o que já está nos JSON (o aquecimento) não conta
+    def marcar(self):
+        for _, _, jsonl, _ in self.processos:
+            self._marcas[jsonl] = os.path.getsize(jsonl) if os.path.exists(jsonl) else 0
+
+    # Reruns, consultas e o pool de cada processo, pelos JSON de rastreamento
+    def metricas(self):
+        duracoes, consultas = [], []
+        conexoes_max = criadas = esperas = timeouts = 0
+        for _, _, jsonl, _ in self.processos:
+            pool = None
+            if not os.path.exists(jsonl):
+                continue
+            with open(jsonl, encoding="utf-8") as f:
+                f.seek(self._marcas.get(jsonl, 0))
+                for linha in f:
+                    rerun = json.loads(linha)
+                    duracoes.append(rerun["total_ms"])
+                    consultas.append(rerun["consultas"])
+                    pool = rerun.get("medidores", {}).get("pool", pool)
+            if pool:
+                conexoes_max = max(conexoes_max, pool["em_uso_max"])
+                criadas += pool["criadas"]
+                esperas += pool["esperas"]
+                timeouts += pool["timeouts"]
+        return {
+            "reruns": len(duracoes),
+            "rerun_ms": _percentis(duracoes),
+            "consultas_por_rerun": float(np.mean(consultas)) if consultas else 0.0,
+            "conexoes_em_uso_max": conexoes_max,
+            "conexoes_abertas": criadas,
+            "esperas_pool": esperas,
+            "timeouts_pool": timeouts,
+        }
+
+
+def _resumo(amostras, segundos):
+    validas = [(nome, ms) for nome, ms, ok in amostras if nome != "falha"]
+    ms = [m for _, m in validas]
+    por_interacao = {}
+    for nome in sorted({n for n, _ in validas}):
+        tempos = [m for n, m in validas if n == nome]
+        por_interacao[nome] = {"n": len(tempos), **_percentis(tempos)}
+    return {
+        "interacoes": len(validas),
+        "por_segundo": len(validas) / segundos,
+        "erros": sum(1 for _, _, ok in amostras if not ok),
+        "ms": _percentis(ms),
+        "por_interacao": por_interacao,
+    }
+
+
+def _semear(args, sessoes, url_imagens):
+    from benchmarks import dados
+
+    dados.criar_banco()
+    emails = [EMAIL.format(i) for i in range(sessoes)]
+    for i, email in enumerate(emails):
+        dados.semear_usuario(args.filmes, url_imagens, email=email, semente=i)
+    return emails
+
+
+def medir(args):
+    from benchmarks.dados import exigir_banco_descartavel
+
+    if args.motor == "mysql":
+        exigir_banco_descartavel(args.banco)
+    try:
+        import websockets  # type: ignore  # noqa: F401
+    except ImportError:
+        sys.exit("o gerador de carga precisa do pacote websockets (pip install websockets)")
+
+    pasta = tempfile.mkdtemp(prefix="carga-")
+    porta_tmdb = args.porta_tmdb or _porta_livre()
+    tmdb = subprocess.Popen([sys.executable, "-m", "classificador.tmdb_falso", "--porta", str(porta_tmdb),
+                             "--latencia", str(args.latencia_tmdb / 1000)],
+                            cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url_imagens = f"http://127.0.0.1:{porta_tmdb}/t/p/w500"
+    ambiente = dict(os.environ, DB_MOTOR=args.motor, DB_NAME=args.banco,
+                    DB_SQLITE_ARQUIVO=os.path.join(pasta, "carga.sqlite3"),
+                    TMDB_API_KEY="carga", TMDB_TAXA="0",
+                    TMDB_BASE_URL=f"http://127.0.0.1:{porta_tmdb}/3", TMDB_IMG_BASE=url_imagens,
+                    PYTHONPATH=os.pathsep.join(filter(None, [RAIZ, os.environ.get("PYTHONPATH")])))
+    commit, sujo = _commit()
+    resultado = {
+        "commit": commit,
+        "sujo": sujo,
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "motor": args.motor,
+        "segundos": args.segundos,
+        "pausa_s": args.pausa,
+        "filmes_por_usuario": args.filmes,
+        "latencia_tmdb_ms": args.latencia_tmdb,
+        "pool": int(ambiente.get("DB_POOL_TAMANHO", "5")),
+        "pontos": [],
+    }
+    try:
+        if not _esperar_http(f"http://127.0.0.1:{porta_tmdb}/3/movie/1?api_key=carga", 30, tmdb):
+            sys.exit("a TMDb falsa não subiu")
+        # O banco é semeado por este processo, com o mesmo ambiente dos servidores
+        os.environ.update({k: ambiente[k] for k in ("DB_MOTOR", "DB_NAME", "DB_SQLITE_ARQUIVO")})
+        from dotenv import load_dotenv  # type: ignore
+        load_dotenv()
+        emails = _semear(args, max(args.sessoes), url_imagens)
+        from classificador.tmdb_falso import gerar_catalogo
+        catalogo = gerar_catalogo()
+        consultas = sorted({f["title"].split()[0] for f in catalogo})
+        _aquecer_tmdb(url_imagens, catalogo)
+
+        print(f"{'proc':>4} {'sessões':>7} {'inter/s':>8} {'p50':>9} {'p99':>9} {'erros':>6} "
+              f"{'rerun p50':>10} {'consultas':>9} {'conexões':>8} {'esperas':>7}", file=sys.stderr)
+        for processos in args.processos:
+            for sessoes in args.sessoes:
+                ponto_pasta = os.path.join(pasta, f"p{processos}-n{sessoes}")
+                os.makedirs(ponto_pasta)
+                ponto_ambiente = dict(ambiente, CACHE_DIR=os.path.join(ponto_pasta, "cache"))
+                with Servidores(processos, ponto_ambiente, ponto_pasta) as servidores:
+                    asyncio.run(_aquecer(servidores.urls()))
+                    servidores.marcar()
+                    inicio = time.monotonic()
+                    amostras = asyncio.run(_rodar_sessoes(servidores.urls(), emails[:sessoes], consultas,
+                                                          args.pausa, args.segundos, args.semente))
+                    decorrido = time.monotonic() - inicio
+                    ponto = {"processos": processos, "sessoes": sessoes, **_resumo(amostras, decorrido),
+                             "servidor": servidores.metricas()}
+                resultado["pontos"].append(ponto)
+                s = ponto["servidor"]
+                print(f"{processos:>4} {sessoes:>7} {ponto['por_segundo']:>8.1f} {ponto['ms']['p50']:>6.0f} ms "
+                      f"{ponto['ms']['p99']:>6.0f} ms {ponto['erros']:>6} {s['rerun_ms']['p50']:>7.0f} ms "
+                      f"{s['consultas_por_rerun']:>9.1f} {s['conexoes_em_uso_max']:>8} {s['esperas_pool']:>7}",
+                      file=sys.stderr)
+    finally:
+        tmdb.terminate()
+        tmdb.wait(10)
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    resultado["capacidade"] = capacidade(resultado["pontos"], args.limite_p99)
+    for processos, sessoes in resultado["capacidade"].items():
+        if sessoes:
+            print(f"{processos} processo(s): até {sessoes} sessões com p99 < {args.limite_p99:.0f} ms e sem erros",
+                  file=sys.stderr)
+        else:
+            print(f"{processos} processo(s): nenhum ponto com p99 < {args.limite_p99:.0f} ms e sem erros",
+                  file=sys.stderr)
+
+    saida = args.saida or os.path.join(RAIZ, "benchmarks", "resultados", f"carga-{commit}{'-sujo' if sujo else ''}.json")
+    os.makedirs(os.path.dirname(saida), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"resultados em {saida}", file=sys.stderr)
+
+
+# Maior número de sessões medido, por quantidade de processos, em que o p99
+# ficou abaixo do limite e nenhuma interação falhou (0 se nenhum)
+def capacidade(pontos, limite_p99):
+    maiores = {}
+    for ponto in pontos:
+        chave = str(ponto["processos"])
+        maiores.setdefault(chave, 0)
+        if ponto["ms"]["p99"] < limite_p99 and not ponto["erros"]:
+            maiores[chave] = max(maiores[chave], ponto["sessoes"])
+    return maiores
+
+
+# Regressão: menos interações por segundo ou p99 pior que o limite relativo,
+# ou erros onde não havia
+def comparar(args):
+    with open(args.antes, encoding="utf-8") as f:
+        antes = json.load(f)
+    with open(args.depois, encoding="utf-8") as f:
+        depois = json.load(f)
+    print(f"{antes['commit']} -> {depois['commit']}")
+    velhos = {(p["processos"], p["sessoes"]): p for p in antes["pontos"]}
+    regressoes = []
+    for novo in depois["pontos"]:
+        chave = (novo["processos"], novo["sessoes"])
+        velho = velhos.get(chave)
+        if velho is None:
+            continue
+        vazao = novo["por_segundo"] / velho["por_segundo"] - 1 if velho["por_segundo"] else 0.0
+        p99 = novo["ms"]["p99"] / velho["ms"]["p99"] - 1 if velho["ms"]["p99"] else 0.0
+        marcas = []
+        if vazao < -args.limite:
+            marcas.append("vazão")
+        if p99 > args.limite:
+            marcas.append("p99")
+        if novo["erros"] > velho["erros"]:
+            marcas.append("erros")
+        if marcas:
+            regressoes.append((chave, marcas))
+        print(f"P={chave[0]:<2} N={chave[1]:<4} "
+              f"inter/s {velho['por_segundo']:7.1f} -> {novo['por_segundo']:7.1f} ({vazao:+.0%})  "
+              f"p99 {velho['ms']['p99']:8.0f} -> {novo['ms']['p99']:8.0f} ({p99:+.0%})  "
+              f"erros {velho['erros']} -> {novo['erros']}"
+              f"{'  REGRESSÃO ' + ','.join(marcas) if marcas else ''}")
+    if regressoes:
+        print(f"\n{len(regressoes)} regressão(ões)", file=sys.stderr)
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Carga de sessões simultâneas no app")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    med = sub.add_parser("medir")
+    med.add_argument("--sessoes", type=int, nargs="+", default=SESSOES, help="sessões simultâneas de cada ponto")
+    med.add_argument("--processos", type=int, nargs="+", default=PROCESSOS, help="servidores do app de cada ponto")
+    med.add_argument("--segundos", type=float, default=15.0, help="duração de cada ponto")
+    med.add_argument("--pausa", type=float, default=1.0, help="segundos de leitura entre as interações (média)")
+    med.add_argument("--filmes", type=int, default=200, help="filmes de cada usuário sintético")
+    med.add_argument("--motor", choices=["sqlite", "mysql"], default="sqlite")
+    med.add_argument("--banco", default=os.getenv("BENCH_DB_NAME", "filmes_bench"),
+                     help="banco MySQL descartável (criado se não existir)")
+    med.add_argument("--porta-tmdb", type=int, default=0, help="porta da TMDb falsa (padrão: uma livre)")
+    med.add_argument("--latencia-tmdb", type=float, default=0.0, help="ms de atraso por requisição à TMDb falsa")
+    med.add_argument("--limite-p99", type=float, default=1000.0, help="p99 (ms) aceitável na estimativa de capacidade")
+    med.add_argument("--semente", type=int, default=0)
+    med.add_argument("-o", "--saida", help="arquivo JSON (padrão: benchmarks/resultados/carga-<commit>.json)")
+
+    comp = sub.add_parser("comparar")
+    comp.add_argument("antes")
+    comp.add_argument("depois")
+    comp.add_argument("--limite", type=float, default=0.15, help="piora relativa tolerada na vazão e no p99")
+    args = parser.parse_args(argv)
+
+    if args.comando == "medir":
+        medir(args)
+    else:
+        comparar(args)
+
+
+if __name__ == "__main__":
+    main()
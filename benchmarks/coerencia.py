@@ -0,0 +1,389 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import threading
+import logging
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+
+# Coerência dos caches entre processos: várias réplicas do app (processos
+# com os próprios caches de leitura) gravam e leem as avaliações do mesmo
+# usuário no mesmo banco. Cada leitura pelos caches (servicos) é comparada
+# com o banco lido direto; a leitura é "defasada" se o cache mostra outra
+# coisa sem que ninguém tenha gravado enquanto ela acontecia, e
+# "persistente" se continua assim ESPERA segundos depois.
+#
+#   python -m benchmarks.coerencia                        SQLite temporário, os três modos
+#   python -m benchmarks.coerencia --motor mysql --banco filmes_bench
+#   python -m benchmarks.coerencia --processos 8 --segundos 20
+#
+# Modos: "sem conferência" (o cache só vale para o próprio processo, como
+# antes da versão por usuário), "versão" (CACHE_CONFERIR_INTERVALO=0: toda
+# leitura confere a versão no banco) e "canal" (conferência a cada 30s, as
+# réplicas avisam umas às outras pelo canal de invalidações do host). O
+# modo "versão" não pode ter leituras defasadas; no "canal", elas duram no
+# máximo o intervalo do canal e não podem ser persistentes. O MySQL usa o banco de --banco, que precisa
+# conter "bench" (o usuário do cenário é apagado e recriado).
+#
+# Antes dos modos, confere a edição em lote com a fila de gravação
+# (GRAVACAO_ASSINCRONA=1): o lote precisa ficar por cima de uma gravação do
+# mesmo filme que outro processo já reservou e está gravando, e de uma que
+# falhou e espera a próxima tentativa, e desfazê-lo precisa voltar a elas.
+# Também confere as gravações em massa: durante uma importação e uma
+# reclassificação em blocos pequenos, com avaliações salvas pelo app no meio,
+# as estatísticas lidas pelos caches precisam bater com as recalculadas do
+# banco.
+
+EMAIL = "coerencia@exemplo.com"
+SENHA = "coerencia"
+# As gravações em massa usam outro usuário e outros filmes
+EMAIL_MASSA = "coerencia-massa@exemplo.com"
+# Longe das ids da TMDb falsa e dos filmes dos outros benchmarks
+PRIMEIRA_ID = 4_000_000
+PRIMEIRA_ID_MASSA = 4_100_000
+FILMES = 60
+TAMANHO_PAGINA = 25
+# Bem mais que o intervalo do canal nos modos abaixo
+ESPERA = 0.25
+
+MODOS = {
+    "sem conferência": {"CACHE_CONFERIR_INTERVALO": "1e9", "INVALIDACAO_CANAL": "0"},
+    "versão": {"CACHE_CONFERIR_INTERVALO": "0", "INVALIDACAO_CANAL": "0"},
+    "canal": {"CACHE_CONFERIR_INTERVALO": "30", "INVALIDACAO_CANAL": "1", "INVALIDACAO_INTERVALO": "0.05"},
+}
+
+
+def _do_banco(usuario_id, filtros):
+    from classificador import filmes_salvos
+    from classificador.banco import transacao
+
+    with transacao() as cursor:
+        cursor.execute("SELECT tmdb_id FROM filmes WHERE usuario_id = %s", (usuario_id,))
+        tmdb_ids = sorted(r[0] for r in cursor.fetchall())
+    pagina, _ = filmes_salvos.buscar_pagina(usuario_id, filtros, TAMANHO_PAGINA)
+    return tmdb_ids, len(tmdb_ids), [(f["tmdb_id"], float(f["nota"])) for f in pagina]
+
+
+def _do_cache(usuario_id, filtros):
+    from classificador import servicos
+
+    indice = servicos.assistidos(usuario_id)
+    total = servicos.ler_estatisticas(usuario_id)["total"]
+    pagina, _ = servicos.pagina_filmes(usuario_id, filtros, TAMANHO_PAGINA)
+    tmdb_ids = [PRIMEIRA_ID + i for i in range(FILMES) if indice.contem(PRIMEIRA_ID + i)]
+    return tmdb_ids, total, [(f["tmdb_id"], float(f["nota"])) for f in pagina]
+
+
+# Processo filho: uma réplica. Grava e lê até o prazo e grava o JSON com as
+# contagens.
+def executar(args):
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+    logging.basicConfig(level=logging.ERROR)
+
+    from classificador import servicos, estatisticas
+    from classificador.filmes_salvos import normalizar_filtros
+    from classificador.classificacao import rotulos
+
+    servicos.iniciar()
+    usuario_id = servicos.autenticar_usuario(EMAIL, SENHA)
+    filtros = normalizar_filtros("Todos", rotulos(), 0.0, 10.0)
+    aleatorio = random.Random(args.semente)
+    contagens = {"gravacoes": 0, "leituras": 0, "defasadas": 0, "persistentes": 0, "descartadas": 0}
+    tempos = []
+    fim = time.time() + args.segundos
+    while time.time() < fim:
+        time.sleep(aleatorio.uniform(0.002, 0.02))
+        i = aleatorio.randrange(FILMES)
+        if aleatorio.random() < args.fracao_gravacoes:
+            if aleatorio.random() < 0.3:
+                servicos.excluir_filme(usuario_id, PRIMEIRA_ID + i)
+            else:
+                servicos.salvar_filme(usuario_id, PRIMEIRA_ID + i, f"Filme de coerência {i:03d}", 2000 + i % 20,
+                                      2015 + i % 10, "", aleatorio.randint(0, 20) / 2)
+            contagens["gravacoes"] += 1
+            continue
+        antes = estatisticas.versao(usuario_id)
+        banco = _do_banco(usuario_id, filtros)
+        inicio = time.perf_counter()
+        cache = _do_cache(usuario_id, filtros)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        # Alguém gravou durante a leitura: não dá para dizer quem está certo
+        if estatisticas.versao(usuario_id) != antes:
+            contagens["descartadas"] += 1
+            continue
+        contagens["leituras"] += 1
+        if cache != banco:
+            contagens["defasadas"] += 1
+            time.sleep(ESPERA)
+            cache = _do_cache(usuario_id, filtros)
+            if estatisticas.versao(usuario_id) == antes and cache != banco:
+                contagens["persistentes"] += 1
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump({"contagens": contagens, "tempos": tempos}, f)
+
+
+# Processo filho: as gravações da fila que o lote precisa esperar. Outra
+# FilaGravacao no mesmo diário faz o papel do outro processo.
+def lote():
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+    logging.basicConfig(level=logging.ERROR)
+
+    from classificador import servicos
+    from classificador.banco import transacao
+    from classificador.fila_gravacao import FilaGravacao, FilaOcupada
+
+    servicos.iniciar()
+    usuario_id = servicos.autenticar_usuario(EMAIL, SENHA)
+    tmdb_id = PRIMEIRA_ID
+    fila = servicos.obter_fila()
+    falhas = []
+
+    def salvar(nota):
+        servicos.salvar_filme(usuario_id, tmdb_id, "Filme de coerência 000", 2000, 2015, "", nota)
+
+    def nota():
+        with transacao() as cursor:
+            cursor.execute("SELECT nota FROM filmes WHERE usuario_id = %s AND tmdb_id = %s", (usuario_id, tmdb_id))
+            linha = cursor.fetchone()
+        return float(linha[0]) if linha else None
+
+    def conferir(cenario, esperada):
+        if nota() != esperada:
+            falhas.append(f"{cenario}: nota {nota()} no banco, esperada {esperada}")
+
+    liberar = threading.Event()
+
+    def gravar_depois(entradas):
+        liberar.wait(30)
+        servicos._gravar_lote(entradas)
+
+    def falhar(entradas):
+        raise RuntimeError("banco fora do ar")
+
+    salvar(2.0)
+    fila.esvaziar()
+
+    # A gravação de 3.0 está em andamento em outro processo
+    salvar(3.0)
+    outra = FilaGravacao(servicos.arquivo_fila(), gravar_depois)
+    entradas = outra._reservar()
+    gravando = threading.Thread(target=outra._gravar, args=(entradas,))
+    gravando.start()
+    resultado = {}
+    editando = threading.Thread(target=lambda: resultado.update(desfazer=servicos.editar_lote(usuario_id, {tmdb_id: (2015, 8.0)})))
+    editando.start()
+    time.sleep(0.3)
+    if not editando.is_alive():
+        falhas.append("reservada: o lote não esperou a gravação em andamento")
+    liberar.set()
+    gravando.join()
+    editando.join()
+    conferir("reservada", 8.0)
+    servicos.desfazer_lote(usuario_id, resultado["desfazer"])
+    conferir("reservada, desfeito", 3.0)
+
+    # A gravação de 4.0 falhou e só seria tentada de novo depois
+    salvar(4.0)
+    FilaGravacao(servicos.arquivo_fila(), falhar).esvaziar()
+    desfazer = servicos.editar_lote(usuario_id, {tmdb_id: (2015, 9.0)})
+    conferir("adiada", 9.0)
+    servicos.desfazer_lote(usuario_id, desfazer)
+    conferir("adiada, desfeito", 4.0)
+
+    # Reservada e presa: o lote desiste com erro, sem gravar nada
+    liberar.clear()
+    salvar(5.0)
+    gravando = threading.Thread(target=outra._gravar, args=(outra._reservar(),))
+    gravando.start()
+    try:
+        servicos.editar_lote(usuario_id, {tmdb_id: (2015, 1.0)})
+        falhas.append("presa: o lote não desistiu no prazo")
+    except FilaOcupada:
+        pass
+    liberar.set()
+    gravando.join()
+    conferir("presa", 5.0)
+
+    if falhas:
+        sys.exit("; ".join(falhas))
+
+
+# Processo filho: importação e reclassificação numa thread enquanto esta
+# salva avaliações e lê as estatísticas pelos caches. Uma leitura só conta
+# se ninguém gravou enquanto ela acontecia.
+def massa():
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+    logging.basicConfig(level=logging.ERROR)
+
+    from classificador import servicos, estatisticas, importacao, classificacao
+    from classificador.banco import transacao
+
+    servicos.iniciar()
+    usuario_id = servicos.autenticar_usuario(EMAIL_MASSA, SENHA)
+    pasta = tempfile.mkdtemp(prefix="coerencia-massa-")
+    caminho = os.path.join(pasta, "importar.csv")
+    with open(caminho, "w", encoding="utf-8", newline="") as f:
+        f.write("tmdb_id,titulo,ano,assistido_em,nota\n")
+        for i in range(FILMES * 20):
+            j = i % (FILMES * 10)
+            f.write(f"{PRIMEIRA_ID_MASSA + j},Filme de coerência {j:03d},{2000 + j % 20},{2015 + i % 10},{i * 7 % 21 / 2}\n")
+
+    def gravar():
+        importacao.importar(caminho, usuario_id, "csv", lote=25, usar_tmdb=False, recomecar=True)
+        classificacao.reclassificar(classificacao.carregar_faixas("3:Ruim,5:Mediano,8:Bom,10:Filmão"), lote=40)
+
+    # O top guardado é uma reserva que encolhe com as exclusões: vale o que o
+    # painel mostra
+    def visiveis(dados):
+        return dict(dados, top=dados["top"][:estatisticas.TOP_EXIBIDOS])
+
+    gravando = threading.Thread(target=gravar)
+    gravando.start()
+    aleatorio = random.Random(0)
+    leituras = divergentes = 0
+    while gravando.is_alive():
+        i = aleatorio.randrange(FILMES * 10)
+        servicos.salvar_filme(usuario_id, PRIMEIRA_ID_MASSA + i, f"Filme de coerência {i:03d}", 2000 + i % 20, 2015, "",
+                              aleatorio.randint(0, 20) / 2)
+        antes = estatisticas.versao(usuario_id)
+        lidas = servicos.ler_estatisticas(usuario_id)
+        with transacao() as cursor:
+            certas = estatisticas.calcular(cursor, usuario_id)
+        if estatisticas.versao(usuario_id) != antes:
+            continue
+        leituras += 1
+        divergentes += visiveis(lidas) != visiveis(certas)
+    gravando.join()
+    shutil.rmtree(pasta, ignore_errors=True)
+    with transacao() as cursor:
+        certas = estatisticas.calcular(cursor, usuario_id)
+    if visiveis(servicos.ler_estatisticas(usuario_id)) != visiveis(certas):
+        divergentes += 1
+    print(f"{leituras} leituras durante a importação e a reclassificação, {divergentes} divergentes")
+    if divergentes or not leituras:
+        sys.exit("estatísticas diferentes das do banco durante as gravações em massa")
+
+
+# Processo filho: recria o usuário do cenário e os filmes no catálogo
+def preparar():
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+    logging.basicConfig(level=logging.ERROR)
+
+    from benchmarks import dados
+    from classificador import servicos, catalogo
+    from classificador.banco import transacao
+
+    dados.criar_banco()
+    with transacao(escrita=True) as cursor:
+        cursor.execute("SELECT id FROM usuarios WHERE email IN (%s, %s)", (EMAIL, EMAIL_MASSA))
+        for (usuario_id,) in cursor.fetchall():
+            cursor.execute("DELETE FROM estatisticas_usuario WHERE usuario_id = %s", (usuario_id,))
+            cursor.execute("DELETE FROM usuarios WHERE id = %s", (usuario_id,))
+        catalogo.gravar(cursor, [(PRIMEIRA_ID + i, f"Filme de coerência {i:03d}", 2000 + i % 20, "") for i in range(FILMES)])
+    servicos.registrar_usuario(EMAIL, SENHA)
+    servicos.registrar_usuario(EMAIL_MASSA, SENHA)
+
+
+def comparar(args):
+    from benchmarks.dados import exigir_banco_descartavel
+
+    if args.motor == "mysql":
+        exigir_banco_descartavel(args.banco)
+
+    pasta = tempfile.mkdtemp(prefix="coerencia-")
+    falhas = []
+    try:
+        base = dict(os.environ, DB_MOTOR=args.motor, DB_NAME=args.banco, GRAVACAO_ASSINCRONA="0",
+                    DB_SQLITE_ARQUIVO=os.path.join(pasta, "coerencia.sqlite3"),
+                    CACHE_DIR=os.path.join(pasta, "cache"))
+        subprocess.run([sys.executable, "-m", "benchmarks.coerencia", "preparar"], env=base, check=True)
+        fila = dict(base, GRAVACAO_ASSINCRONA="1", FILA_GRAVACAO_ESPERA="1", FILA_GRAVACAO_PRAZO_LOTE="1",
+                    FILA_GRAVACAO_ARQUIVO=os.path.join(pasta, "fila.sqlite3"),
+                    # A falha simulada não interessa no log
+                    LOG_ARQUIVO=os.path.join(pasta, "lote.log"), LOG_NIVEL="CRITICAL")
+        if subprocess.run([sys.executable, "-m", "benchmarks.coerencia", "lote"], env=fila).returncode != 0:
+            falhas.append("edição em lote com gravações na fila")
+        else:
+            print("edição em lote sobre a fila de gravação: ok")
+        massa = subprocess.run([sys.executable, "-m", "benchmarks.coerencia", "massa"],
+                               env=dict(base, CACHE_CONFERIR_INTERVALO="0"), stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True)
+        if massa.returncode != 0:
+            ultima = (massa.stderr.strip().splitlines() or ["?"])[-1]
+            falhas.append(f"gravações em massa ({ultima})")
+        else:
+            print(f"gravações em massa: {massa.stdout.strip()}")
+        print(f"{'modo':16} {'gravações':>10} {'leituras':>9} {'defasadas':>10} {'persistentes':>13} "
+              f"{'leitura p50':>12} {'p95':>9}")
+        for n, (nome, variaveis) in enumerate(MODOS.items()):
+            ambiente = dict(base, **variaveis, INVALIDACAO_ARQUIVO=os.path.join(pasta, f"canal-{n}.sqlite3"))
+            processos = []
+            for i in range(args.processos):
+                saida = os.path.join(pasta, f"replica-{i}.json")
+                comando = [sys.executable, "-m", "benchmarks.coerencia", "executar", "--saida", saida,
+                           "--segundos", str(args.segundos), "--semente", str(i),
+                           "--fracao-gravacoes", str(args.fracao_gravacoes)]
+                processos.append((saida, subprocess.Popen(comando, env=ambiente, stderr=subprocess.PIPE, text=True)))
+            totais = {"gravacoes": 0, "leituras": 0, "defasadas": 0, "persistentes": 0, "descartadas": 0}
+            tempos = []
+            for saida, processo in processos:
+                _, erros = processo.communicate()
+                if processo.returncode != 0:
+                    ultima = (erros.strip().splitlines() or ["?"])[-1]
+                    sys.exit(f"{nome}: réplica falhou ({ultima})")
+                with open(saida, encoding="utf-8") as f:
+                    resultado = json.load(f)
+                for chave, valor in resultado["contagens"].items():
+                    totais[chave] += valor
+                tempos.extend(resultado["tempos"])
+            p50, p95 = np.percentile(tempos, [50, 95]) if tempos else (0.0, 0.0)
+            print(f"{nome:16} {totais['gravacoes']:>10} {totais['leituras']:>9} {totais['defasadas']:>10} "
+                  f"{totais['persistentes']:>13} {p50:9.2f} ms {p95:6.2f} ms")
+            if nome == "versão" and totais["defasadas"]:
+                falhas.append("leituras defasadas com a conferência a cada leitura")
+            if nome == "canal" and totais["persistentes"]:
+                falhas.append("leituras ainda defasadas depois do intervalo do canal")
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+    if falhas:
+        sys.exit("; ".join(falhas))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coerência dos caches entre processos do app")
+    parser.add_argument("comando", nargs="?", default="comparar", choices=["comparar", "executar", "preparar", "lote", "massa"])
+    parser.add_argument("--motor", choices=["sqlite", "mysql"], default="sqlite")
+    parser.add_argument("--banco", default=os.getenv("BENCH_DB_NAME", "filmes_bench"),
+                        help="banco MySQL descartável (criado se não existir)")
+    parser.add_argument("--processos", type=int, default=4, help="réplicas simultâneas")
+    parser.add_argument("--segundos", type=float, default=5.0, help="duração de cada modo")
+    parser.add_argument("--fracao-gravacoes", type=float, default=0.2, help="fração das operações que gravam")
+    parser.add_argument("--semente", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--saida", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.comando == "executar":
+        executar(args)
+    elif args.comando == "preparar":
+        preparar()
+    elif args.comando == "lote":
+        lote()
+    elif args.comando == "massa":
+        massa()
+    else:
+        comparar(args)
+
+
+if __name__ == "__main__":
+    main()
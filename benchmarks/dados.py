@@ -0,0 +1,92 @@
+import sys
+import hashlib
+
+import numpy as np
+import mysql.connector  # type: ignore
+
+from classificador.banco import parametros_mysql, transacao, motor
+from classificador import estatisticas, migracoes, catalogo
+from classificador.classificacao import classificar_lote
+from classificador.filmes_salvos import SQL_SALVAR
+
+
+# Usuários sintéticos dos benchmarks: um por tamanho de biblioteca, com
+# email bench<quantidade>@exemplo.com e a mesma senha para todos
+SENHA = "bench"
+
+# Ids dos filmes sintéticos no catálogo, longe das da TMDb falsa (1 a 5000):
+# o cenário de salvar acrescenta filmes novos
+PRIMEIRA_ID = 1_000_000
+
+
+def email_sintetico(quantidade):
+    return f"bench{quantidade}@exemplo.com"
+
+
+# Os benchmarks apagam e recriam os próprios dados: no MySQL, só num banco
+# com "bench" no nome
+def exigir_banco_descartavel(nome):
+    if "bench" not in nome:
+        sys.exit(f"recusando usar o banco '{nome}': o nome precisa conter 'bench' (os dados são recriados)")
+
+
+# No SQLite o arquivo e o esquema são criados na primeira conexão
+def criar_banco():
+    if motor() == "sqlite":
+        migracoes.migrar()
+        return
+    params = parametros_mysql()
+    nome = params.pop("database")
+    conn = mysql.connector.connect(**params)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{nome}` CHARACTER SET utf8mb4")
+        cursor.close()
+    finally:
+        conn.close()
+    migracoes.migrar()
+
+
+# Filmes sintéticos do catálogo, compartilhados pelos usuários sintéticos
+def filmes_sinteticos(quantidade, url_imagens):
+    for i in range(quantidade):
+        yield (PRIMEIRA_ID + i, f"Filme sintético {i:06d}", 1950 + i % 75, f"{url_imagens}/sintetico{i % 50}.jpg")
+
+
+# Avaliações determinísticas: os mesmos filmes e notas a cada execução
+def avaliacoes(quantidade, usuario_id, semente=0):
+    notas = np.round(np.random.default_rng(semente).uniform(0, 10, quantidade) * 2) / 2
+    classes = classificar_lote(notas)
+    for i in range(quantidade):
+        yield (usuario_id, PRIMEIRA_ID + i, 2000 + i % 25, float(notas[i]), classes[i])
+
+
+# Cria (ou recria, se estiver incompleto) o usuário com `quantidade` filmes.
+# Os benchmarks de salvar acrescentam alguns filmes; por isso basta ter ao menos
+# a quantidade pedida. Outro `email` (e `semente`, para outras notas) dá mais
+# de um usuário do mesmo tamanho.
+def semear_usuario(quantidade, url_imagens, lote=5000, email=None, semente=0):
+    email = email or email_sintetico(quantidade)
+    with transacao(escrita=True) as cursor:
+        cursor.execute("SELECT id FROM usuarios WHERE email = %s", (email,))
+        linha = cursor.fetchone()
+        if linha:
+            cursor.execute("SELECT COUNT(*) FROM filmes WHERE usuario_id = %s", (linha[0],))
+            if cursor.fetchone()[0] >= quantidade:
+                return linha[0]
+            cursor.execute("DELETE FROM estatisticas_usuario WHERE usuario_id = %s", (linha[0],))
+            cursor.execute("DELETE FROM usuarios WHERE id = %s", (linha[0],))
+        cursor.execute("INSERT INTO usuarios (email, senha_hash) VALUES (%s, %s)",
+                       (email, hashlib.sha256(SENHA.encode()).hexdigest()))
+        usuario_id = cursor.lastrowid
+
+    filmes = list(filmes_sinteticos(quantidade, url_imagens))
+    linhas = list(avaliacoes(quantidade, usuario_id, semente))
+    for i in range(0, len(linhas), lote):
+        with transacao() as cursor:
+            catalogo.gravar(cursor, filmes[i:i + lote])
+            cursor.executemany(SQL_SALVAR[cursor.motor], linhas[i:i + lote])
+        print(f"{email}: {min(i + lote, quantidade)}/{quantidade} avaliações", file=sys.stderr)
+    with transacao(escrita=True) as cursor:
+        estatisticas.reconstruir(cursor, usuario_id)
+    return usuario_id
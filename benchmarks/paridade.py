@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+
+import numpy as np
+
+
+# Paridade entre os bancos (DB_MOTOR): roda os mesmos cenários do app, pela
+# camada de serviços, no MySQL e no SQLite embutido, compara o que cada um
+# devolveu e mostra as latências lado a lado.
+#
+#   python -m benchmarks.paridade                         os dois bancos
+#   python -m benchmarks.paridade --motores sqlite        só o SQLite (sem servidor)
+#   python -m benchmarks.paridade --filmes 5000 --repeticoes 20
+#
+# Cada banco roda num processo próprio (o pool e os caches são do processo).
+# O MySQL usa as variáveis DB_* com o banco de --banco, que precisa conter
+# "bench" (o usuário dos cenários é apagado e recriado); o SQLite, um arquivo
+# temporário novo. Cenários: cadastro (inclusive o e-mail repetido com outra
+# caixa), login, salvar, atualizar e excluir avaliações, e as leituras do app
+# (assistidos, anos, lista paginada com filtros e estatísticas) depois de
+# cada etapa, lidas direto do banco, sem os caches do processo.
+
+MOTORES = ["mysql", "sqlite"]
+PERCENTIS = [50, 95, 99]
+EMAIL = "paridade@exemplo.com"
+SENHA = "paridade"
+
+# Longe das ids da TMDb falsa e dos filmes dos outros benchmarks
+PRIMEIRA_ID = 3_000_000
+TAMANHO_PAGINA = 25
+FILTROS = [
+    ("Todos", [], 0.0, 10.0),
+    (2015, [], 0.0, 10.0),
+    ("Todos", ["Bom", "Filmão"], 0.0, 10.0),
+    ("Todos", [], 4.5, 8.0),
+    (2020, ["Ruim"], 0.0, 6.0),
+]
+
+
+# Filmes e notas determinísticos: (tmdb_id, titulo, ano, assistido_em, poster_url, nota)
+def filmes(quantidade):
+    for i in range(quantidade):
+        assistido_em = None if i % 17 == 0 else 2010 + i % 15
+        yield (PRIMEIRA_ID + i, f"Filme de paridade {i:05d}", 1950 + i % 75, assistido_em,
+               f"http://imagens.exemplo/{i % 40}.jpg", (i * 7 % 21) / 2)
+
+
+def _linha(filme):
+    return [filme["tmdb_id"], filme["titulo"], filme["ano"], filme["assistido_em"],
+            float(filme["nota"]), filme["classificacao"], filme["poster_url"]]
+
+
+# As ids das avaliações dependem do banco; o top é comparado sem elas e só
+# no que o painel mostra (a reserva diminui com as exclusões)
+def _estatisticas(dados):
+    from classificador.estatisticas import TOP_EXIBIDOS
+
+    dados = dict(dados)
+    dados["top"] = [{k: v for k, v in item.items() if k != "id"} for item in dados["top"][:TOP_EXIBIDOS]]
+    return dados
+
+
+class Cenarios:
+    def __init__(self, repeticoes):
+        self.repeticoes = repeticoes
+        self.tempos = defaultdict(list)
+        self.resultados = {}
+
+    def medir(self, nome, funcao, *args):
+        inicio = time.perf_counter()
+        resultado = funcao(*args)
+        self.tempos[nome].append((time.perf_counter() - inicio) * 1000)
+        return resultado
+
+    def lista(self, usuario_id, filtros):
+        from classificador import filmes_salvos
+
+        linhas = []
+        apos = None
+        while True:
+            pagina, apos = self.medir("lista_pagina", filmes_salvos.buscar_pagina, usuario_id, filtros, TAMANHO_PAGINA, apos)
+            linhas.extend(_linha(f) for f in pagina)
+            if apos is None:
+                return linhas
+
+    # As leituras do app, repetidas para a latência; o resultado é o da
+    # última repetição
+    def leituras(self, etapa, usuario_id, tmdb_ids):
+        from classificador import estatisticas, filmes_salvos
+        from classificador.banco import transacao
+        from classificador.assistidos import carregar_assistidos
+
+        for _ in range(self.repeticoes):
+            indice = self.medir("assistidos", carregar_assistidos, usuario_id)
+            anos = self.medir("anos", filmes_salvos.buscar_anos, usuario_id)
+            listas = [self.lista(usuario_id, filmes_salvos.normalizar_filtros(*f)) for f in FILTROS]
+            materializadas = self.medir("estatisticas", estatisticas.ler, usuario_id)
+        with transacao() as cursor:
+            recalculadas = estatisticas.calcular(cursor, usuario_id)
+        self.resultados[f"{etapa}/assistidos"] = [len(indice), [t for t in tmdb_ids if indice.contem(t)]]
+        self.resultados[f"{etapa}/anos"] = anos
+        for filtros, linhas in zip(FILTROS, listas):
+            self.resultados[f"{etapa}/lista {filtros}"] = linhas
+        self.resultados[f"{etapa}/estatisticas"] = _estatisticas(materializadas)
+        # As estatísticas mantidas a cada gravação batem com as calculadas do zero
+        self.resultados[f"{etapa}/estatisticas_recalculadas"] = _estatisticas(recalculadas)
+
+    def rodar(self, quantidade):
+        from classificador import servicos
+        from classificador.banco import transacao
+
+        with transacao(escrita=True) as cursor:
+            cursor.execute("SELECT id FROM usuarios WHERE email = %s", (EMAIL,))
+            for (usuario_id,) in cursor.fetchall():
+                cursor.execute("DELETE FROM estatisticas_usuario WHERE usuario_id = %s", (usuario_id,))
+                cursor.execute("DELETE FROM usuarios WHERE id = %s", (usuario_id,))
+
+        self.resultados["cadastro"] = [
+            self.medir("cadastro", servicos.registrar_usuario, EMAIL, SENHA),
+            servicos.registrar_usuario(EMAIL, SENHA),
+            servicos.registrar_usuario(EMAIL.upper(), SENHA),
+        ]
+        for _ in range(self.repeticoes):
+            usuario_id = self.medir("login", servicos.autenticar_usuario, EMAIL, SENHA)
+        self.resultados["login"] = [
+            usuario_id is not None,
+            servicos.autenticar_usuario(EMAIL, "errada"),
+            servicos.autenticar_usuario(EMAIL.upper(), SENHA) == usuario_id,
+        ]
+
+        lista = list(filmes(quantidade))
+        ids = [f[0] for f in lista]
+        self.resultados["salvar"] = [
+            self.medir("salvar", servicos.salvar_filme, usuario_id, tmdb_id, titulo, ano, assistido_em, poster_url, nota)
+            for tmdb_id, titulo, ano, assistido_em, poster_url, nota in lista
+        ]
+        self.leituras("salvos", usuario_id, ids)
+
+        self.resultados["atualizar"] = [
+            self.medir("atualizar", servicos.salvar_filme, usuario_id, tmdb_id, titulo, ano, assistido_em, poster_url, 10.0 - nota)
+            for tmdb_id, titulo, ano, assistido_em, poster_url, nota in lista[::5]
+        ]
+        self.leituras("atualizados", usuario_id, ids)
+
+        for tmdb_id, *_ in lista[::10]:
+            self.medir("excluir", servicos.excluir_filme, usuario_id, tmdb_id)
+        # Excluir de novo não faz nada
+        servicos.excluir_filme(usuario_id, lista[0][0])
+        self.leituras("excluidos", usuario_id, ids)
+
+
+# Processo filho: roda os cenários no banco de DB_MOTOR e grava o JSON
+def executar(args):
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+    # Os erros esperados (cadastro repetido) não poluem a saída
+    logging.basicConfig(level=logging.ERROR)
+
+    from benchmarks import dados
+
+    dados.criar_banco()
+    cenarios = Cenarios(args.repeticoes)
+    cenarios.rodar(args.filmes)
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump({"resultados": cenarios.resultados, "tempos": cenarios.tempos}, f, ensure_ascii=False)
+
+
+def _percentis(amostras):
+    return {f"p{p}": float(np.percentile(amostras, p)) for p in PERCENTIS}
+
+
+def comparar(args):
+    from benchmarks.dados import exigir_banco_descartavel
+
+    if "mysql" in args.motores:
+        exigir_banco_descartavel(args.banco)
+
+    pasta = tempfile.mkdtemp(prefix="paridade-")
+    saidas = {}
+    try:
+        for motor in args.motores:
+            saida = os.path.join(pasta, f"{motor}.json")
+            ambiente = dict(os.environ, DB_MOTOR=motor, DB_NAME=args.banco, GRAVACAO_ASSINCRONA="0",
+                            DB_SQLITE_ARQUIVO=os.path.join(pasta, "paridade.sqlite3"),
+                            CACHE_DIR=os.path.join(pasta, "cache"))
+            comando = [sys.executable, "-m", "benchmarks.paridade", "executar", "--saida", saida,
+                       "--filmes", str(args.filmes), "--repeticoes", str(args.repeticoes)]
+            inicio = time.perf_counter()
+            processo = subprocess.run(comando, env=ambiente, capture_output=True, text=True)
+            if processo.returncode != 0:
+                ultima = (processo.stderr.strip().splitlines() or ["?"])[-1]
+                print(f"{motor}: falhou ({ultima})", file=sys.stderr)
+                continue
+            print(f"{motor}: cenários em {time.perf_counter() - inicio:.1f}s", file=sys.stderr)
+            with open(saida, encoding="utf-8") as f:
+                saidas[motor] = json.load(f)
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    if not saidas:
+        sys.exit("nenhum banco rodou os cenários")
+
+    motores = list(saidas)
+    operacoes = sorted({op for s in saidas.values() for op in s["tempos"]})
+    print(f"{'operação':14} {'n':>6} " + " ".join(f"{m + ' ' + p:>14}" for m in motores for p in ("p50", "p95")))
+    for op in operacoes:
+        percentis = [_percentis(saidas[m]["tempos"][op]) for m in motores]
+        n = len(saidas[motores[0]]["tempos"][op])
+        print(f"{op:14} {n:>6} " + " ".join(f"{p['p50']:11.3f} ms {p['p95']:11.3f} ms" for p in percentis))
+
+    if len(motores) < 2:
+        print("\nsó um banco rodou: sem comparação de resultados", file=sys.stderr)
+        return
+    a, b = (saidas[m]["resultados"] for m in motores)
+    divergentes = sorted(k for k in a.keys() | b.keys() if a.get(k) != b.get(k))
+    for chave in divergentes:
+        print(f"DIVERGE {chave}:\n  {motores[0]}: {json.dumps(a.get(chave), ensure_ascii=False)[:300]}"
+              f"\n  {motores[1]}: {json.dumps(b.get(chave), ensure_ascii=False)[:300]}")
+    if divergentes:
+        print(f"\n{len(divergentes)} de {len(a)} resultados divergem", file=sys.stderr)
+        sys.exit(1)
+    print(f"\n{len(a)} resultados iguais nos dois bancos", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Paridade e latência entre MySQL e SQLite")
+    parser.add_argument("comando", nargs="?", default="comparar", choices=["comparar", "executar"])
+    parser.add_argument("--motores", nargs="+", choices=MOTORES, default=MOTORES)
+    parser.add_argument("--banco", default=os.getenv("BENCH_DB_NAME", "filmes_bench"),
+                        help="banco MySQL descartável (criado se não existir)")
+    parser.add_argument("--filmes", type=int, default=1000, help="avaliações salvas pelo usuário dos cenários")
+    parser.add_argument("--repeticoes", type=int, default=5, help="repetições de cada leitura")
+    parser.add_argument("--saida", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.comando == "executar":
+        executar(args)
+    else:
+        comparar(args)
+
+
+if __name__ == "__main__":
+    main()
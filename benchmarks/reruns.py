@@ -0,0 +1,313 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+# Mede o custo de um rerun do app.py rodando o script de verdade pelo AppTest
+# do Streamlit, contra a TMDb falsa (classificador.tmdb_falso) e um banco
+# MySQL local descartável semeado com usuários de 10, 1.000 e 100.000 filmes.
+#
+#   python -m benchmarks.reruns medir                       grava benchmarks/resultados/<commit>.json
+#   python -m benchmarks.reruns comparar antes.json depois.json
+#
+# Para cada cenário guarda os percentis da latência do rerun e quantas idas
+# ao banco (consultas executadas pelo pool) e à TMDb (requisições recebidas
+# pelo servidor falso, pôsteres incluídos) cada rerun fez.
+
+TAMANHOS = [10, 1000, 100000]
+CENARIOS = ["login", "rerun", "busca", "busca_repetida", "salvar", "filtrar", "estatisticas"]
+PERCENTIS = [50, 90, 95, 99]
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        sujo = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=RAIZ,
+                                   capture_output=True, text=True).stdout.strip())
+        return commit, sujo
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido", True
+
+
+def _resumo(amostras):
+    ms = np.array([a[0] for a in amostras])
+    consultas = np.array([a[1] for a in amostras])
+    http = np.array([a[2] for a in amostras])
+    return {
+        "n": len(amostras),
+        "ms": {"media": float(ms.mean()), "max": float(ms.max()),
+               **{f"p{p}": float(np.percentile(ms, p)) for p in PERCENTIS}},
+        "consultas_db": {"media": float(consultas.mean()), "max": int(consultas.max())},
+        "http": {"media": float(http.mean()), "max": int(http.max())},
+    }
+
+
+def _widget(lista, rotulo):
+    for w in lista:
+        if w.label.startswith(rotulo):
+            return w
+    raise LookupError(f"widget '{rotulo}' não encontrado")
+
+
+class Bancada:
+    def __init__(self, servidor, iteracoes, app):
+        from classificador.banco import metricas_pool
+
+        self.servidor = servidor
+        self.iteracoes = iteracoes
+        self.app = app
+        self._consultas = lambda: metricas_pool()["consultas"]
+
+    def _app(self):
+        from streamlit.testing.v1 import AppTest
+
+        return AppTest.from_file(self.app, default_timeout=300)
+
+    # Roda o script uma vez e devolve (ms, consultas ao banco, requisições HTTP)
+    def medir(self, at):
+        consultas = self._consultas()
+        http = self.servidor.requisicoes
+        inicio = time.perf_counter()
+        at.run()
+        ms = (time.perf_counter() - inicio) * 1000
+        if at.exception:
+            raise RuntimeError(f"o app falhou durante o benchmark: {at.exception[0].message}")
+        return ms, self._consultas() - consultas, self.servidor.requisicoes - http
+
+    def sessao(self, usuario_id):
+        at = self._app()
+        at.session_state["usuario_id"] = usuario_id
+        at.run()
+        return at
+
+    # Títulos do catálogo falso, diferentes para cada tamanho de usuário, para
+    # que as buscas cheguem frias ao cache
+    def consultas_busca(self, deslocamento):
+        catalogo = self.servidor.catalogo
+        return [catalogo[(deslocamento + i * 37) % len(catalogo)]["title"] for i in range(self.iteracoes)]
+
+    # Gera antes os pôsteres que as buscas vão pedir: o servidor falso roda no
+    # mesmo processo e desenhar o PNG contaria como latência do app
+    def aquecer_servidor(self, consultas):
+        for consulta in consultas:
+            for filme in self.servidor.buscar(consulta, 1)["results"][:5]:
+                self.servidor.poster(filme["poster_path"].lstrip("/"))
+        for i in range(50):
+            self.servidor.poster(f"sintetico{i}.jpg")
+
+    def login(self, email, senha):
+        amostras = []
+        for _ in range(self.iteracoes):
+            at = self._app()
+            at.run()
+            _widget(at.text_input, "Email").input(email)
+            _widget(at.text_input, "Senha").input(senha)
+            _widget(at.button, "Entrar").click()
+            amostras.append(self.medir(at))
+            if "usuario_id" not in at.session_state:
+                raise RuntimeError(f"login de {email} falhou")
+        return amostras
+
+    def rerun(self, usuario_id):
+        at = self.sessao(usuario_id)
+        return [self.medir(at) for _ in range(self.iteracoes)]
+
+    def busca(self, usuario_id, consultas):
+        at = self.sessao(usuario_id)
+        amostras = []
+        for consulta in consultas:
+            _widget(at.text_input, "Digite o nome").input(consulta)
+            _widget(at.button, "Buscar").click()
+            amostras.append(self.medir(at))
+        return amostras
+
+    def busca_repetida(self, usuario_id, consulta):
+        at = self.sessao(usuario_id)
+        _widget(at.text_input, "Digite o nome").input(consulta)
+        _widget(at.button, "Buscar").click()
+        at.run()
+        amostras = []
+        for _ in range(self.iteracoes):
+            _widget(at.button, "Buscar").click()
+            amostras.append(self.medir(at))
+        return amostras
+
+    # Avalia em rodízio os cinco primeiros resultados: os cinco primeiros
+    # salvamentos inserem, os demais atualizam
+    def salvar(self, usuario_id, consulta):
+        at = self.sessao(usuario_id)
+        _widget(at.text_input, "Digite o nome").input(consulta)
+        _widget(at.button, "Buscar").click()
+        at.run()
+        botoes = [b for b in at.button if b.label == "Salvar avaliação"]
+        if not botoes:
+            raise RuntimeError(f"a busca '{consulta}' não trouxe resultados")
+        amostras = []
+        for i in range(self.iteracoes):
+            indice = i % len(botoes)
+            at.slider[indice].set_value(float(i % 21) / 2)
+            [b for b in at.button if b.label == "Salvar avaliação"][indice].click()
+            amostras.append(self.medir(at))
+        return amostras
+
+    def filtrar(self, usuario_id):
+        at = self.sessao(usuario_id)
+        _widget(at.button, "🎞️ Ver filmes salvos").click()
+        at.run()
+        amostras = []
+        for i in range(self.iteracoes):
+            _widget(at.slider, "Nota mínima").set_value(float((i + 1) % 5) * 2)
+            amostras.append(self.medir(at))
+        return amostras
+
+    def estatisticas(self, usuario_id):
+        at = self.sessao(usuario_id)
+        amostras = []
+        for _ in range(self.iteracoes):
+            _widget(at.button, "📊 Ver estatísticas").click()
+            amostras.append(self.medir(at))
+            _widget(at.button, "📊 Ver estatísticas").click()
+            at.run()
+        return amostras
+
+
+def medir(args):
+    from benchmarks.dados import exigir_banco_descartavel
+
+    exigir_banco_descartavel(args.banco)
+
+    # Tudo é lido do ambiente na primeira chamada; o .env do app não sobrescreve
+    cache = tempfile.mkdtemp(prefix="bench-cache-")
+    os.environ["DB_NAME"] = args.banco
+    os.environ["CACHE_DIR"] = cache
+    os.environ["TMDB_API_KEY"] = "bench"
+    os.environ["TMDB_TAXA"] = "0"
+
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+
+    from classificador.tmdb_falso import ServidorTMDbFalso
+    from benchmarks import dados
+
+    servidor = ServidorTMDbFalso(args.porta_tmdb, latencia=args.latencia_tmdb / 1000).iniciar()
+    os.environ["TMDB_BASE_URL"] = servidor.url
+    os.environ["TMDB_IMG_BASE"] = servidor.url_imagens
+    commit, sujo = _commit()
+    resultado = {
+        "commit": commit,
+        "sujo": sujo,
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "iteracoes": args.iteracoes,
+        "latencia_tmdb_ms": args.latencia_tmdb,
+        "tamanhos": {},
+    }
+    try:
+        dados.criar_banco()
+        bancada = Bancada(servidor, args.iteracoes, os.path.join(RAIZ, "app.py"))
+        for n, tamanho in enumerate(args.tamanhos):
+            usuario_id = dados.semear_usuario(tamanho, servidor.url_imagens)
+            consultas = bancada.consultas_busca(n * 1000)
+            bancada.aquecer_servidor(consultas)
+            execucoes = {
+                "login": lambda: bancada.login(dados.email_sintetico(tamanho), dados.SENHA),
+                "rerun": lambda: bancada.rerun(usuario_id),
+                "busca": lambda: bancada.busca(usuario_id, consultas),
+                "busca_repetida": lambda: bancada.busca_repetida(usuario_id, consultas[0]),
+                "salvar": lambda: bancada.salvar(usuario_id, consultas[0]),
+                "filtrar": lambda: bancada.filtrar(usuario_id),
+                "estatisticas": lambda: bancada.estatisticas(usuario_id),
+            }
+            resultado["tamanhos"][str(tamanho)] = {}
+            for cenario in args.cenarios:
+                resumo = _resumo(execucoes[cenario]())
+                resultado["tamanhos"][str(tamanho)][cenario] = resumo
+                print(f"{tamanho:>7} {cenario:15} p50 {resumo['ms']['p50']:8.1f} ms  p95 {resumo['ms']['p95']:8.1f} ms  "
+                      f"db {resumo['consultas_db']['media']:5.1f}  http {resumo['http']['media']:5.1f}", file=sys.stderr)
+    finally:
+        servidor.parar()
+        shutil.rmtree(cache, ignore_errors=True)
+
+    saida = args.saida or os.path.join(RAIZ, "benchmarks", "resultados", f"{commit}{'-sujo' if sujo else ''}.json")
+    os.makedirs(os.path.dirname(saida), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"resultados em {saida}", file=sys.stderr)
+
+
+# Regressão: p95 pior que o limite relativo ou mais idas ao banco/TMDb por
+# rerun (as contagens são determinísticas, qualquer aumento conta)
+def comparar(args):
+    with open(args.antes, encoding="utf-8") as f:
+        antes = json.load(f)
+    with open(args.depois, encoding="utf-8") as f:
+        depois = json.load(f)
+    print(f"{antes['commit']} -> {depois['commit']}")
+    regressoes = []
+    for tamanho, cenarios in depois["tamanhos"].items():
+        for cenario, novo in cenarios.items():
+            velho = antes["tamanhos"].get(tamanho, {}).get(cenario)
+            if velho is None:
+                continue
+            variacao = novo["ms"]["p95"] / velho["ms"]["p95"] - 1 if velho["ms"]["p95"] else 0.0
+            marcas = []
+            if variacao > args.limite:
+                marcas.append("p95")
+            if novo["consultas_db"]["media"] > velho["consultas_db"]["media"]:
+                marcas.append("db")
+            if novo["http"]["media"] > velho["http"]["media"]:
+                marcas.append("http")
+            if marcas:
+                regressoes.append((tamanho, cenario, marcas))
+            print(f"{tamanho:>7} {cenario:15} "
+                  f"p50 {velho['ms']['p50']:8.1f} -> {novo['ms']['p50']:8.1f}  "
+                  f"p95 {velho['ms']['p95']:8.1f} -> {novo['ms']['p95']:8.1f} ({variacao:+.0%})  "
+                  f"db {velho['consultas_db']['media']:5.1f} -> {novo['consultas_db']['media']:5.1f}  "
+                  f"http {velho['http']['media']:5.1f} -> {novo['http']['media']:5.1f}"
+                  f"{'  REGRESSÃO ' + ','.join(marcas) if marcas else ''}")
+    if regressoes:
+        print(f"\n{len(regressoes)} regressão(ões)", file=sys.stderr)
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dos reruns do app")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    med = sub.add_parser("medir")
+    med.add_argument("--banco", default=os.getenv("BENCH_DB_NAME", "filmes_bench"),
+                     help="banco MySQL descartável (criado se não existir)")
+    med.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS, help="filmes de cada usuário sintético")
+    med.add_argument("--cenarios", nargs="+", choices=CENARIOS, default=CENARIOS)
+    med.add_argument("--iteracoes", type=int, default=20)
+    med.add_argument("--porta-tmdb", type=int, default=8799,
+                     help="porta fixa: as URLs dos pôsteres semeados apontam para ela")
+    med.add_argument("--latencia-tmdb", type=float, default=0.0, help="ms de atraso por requisição à TMDb falsa")
+    med.add_argument("-o", "--saida", help="arquivo JSON (padrão: benchmarks/resultados/<commit>.json)")
+
+    comp = sub.add_parser("comparar")
+    comp.add_argument("antes")
+    comp.add_argument("depois")
+    comp.add_argument("--limite", type=float, default=0.15, help="piora relativa tolerada no p95")
+    args = parser.parse_args(argv)
+
+    if args.comando == "medir":
+        medir(args)
+    else:
+        comparar(args)
+
+
+if __name__ == "__main__":
+    main()
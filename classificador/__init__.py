@@ -0,0 +1 @@
+# Lógica compartilhada por app.py e app1.py (banco, TMDb, classificação)
@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import threading
+
+from classificador.banco import transacao, agora_banco
+from classificador.cache import diretorio_cache
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc
+    import pandas as pd
+except ImportError:  # sem pyarrow/pandas não há relatórios
+    pa = pc = pd = None
+
+
+# Snapshots colunares das avaliações de todos os usuários, para relatórios
+# entre usuários (notas por ano de lançamento, classificações por ano
+# assistido, filmes mais avaliados) sem GROUP BY na tabela filmes, que serve
+# os reruns do app.
+#
+#   python -m classificador.analise exportar              incremental (o primeiro é completo)
+#   python -m classificador.analise exportar --completo
+#   python -m classificador.analise relatorio mais_avaliados
+#
+# O exportar lê filmes em blocos pela chave primária e grava arquivos Arrow
+# (formato IPC/Feather v2, sem compressão) particionados por faixa de id:
+# filmes/parte-00012.arrow tem as ids de 12 × TAMANHO_PARTICAO até a próxima
+# parte. O incremental refaz só as partes com avaliações alteradas desde o
+# snapshot anterior (filmes.atualizado_em, migração 6), as novas e as que
+# mudaram de tamanho (exclusões não deixam linha com atualizado_em: a
+# contagem de cada parte no banco é comparada com a do meta.json anterior);
+# as outras são hard links da versão anterior. O catálogo (título e ano) vai
+# inteiro a cada exportação.
+#
+# Os relatórios abrem o snapshot com mmap (arquivos Arrow sem compressão são
+# usados como estão no disco, sem cópia) e agregam com o pyarrow.compute; o
+# pandas só recebe o resultado, já pequeno. A página pages/relatorios.py lê
+# apenas o snapshot, nunca o banco.
+
+TAMANHO_PARTICAO = 250_000
+LOTE = 50_000
+
+# Avaliações gravadas pouco antes da marca, por transações que só fizeram
+# commit depois dela, também contam como alteradas
+FOLGA = 60
+
+SQL_PARTE = (
+    "SELECT id, usuario_id, tmdb_id, assistido_em, nota, classificacao FROM filmes "
+    "WHERE id > %s AND id < %s ORDER BY id LIMIT %s"
+)
+SQL_CATALOGO = "SELECT tmdb_id, titulo, ano FROM catalogo WHERE tmdb_id > %s ORDER BY tmdb_id LIMIT %s"
+# Partes com avaliações alteradas, pelo índice de atualizado_em
+SQL_PARTES_ALTERADAS = {
+    "mysql": "SELECT DISTINCT id DIV %s FROM filmes WHERE atualizado_em >= FROM_UNIXTIME(%s)",
+    "sqlite": "SELECT DISTINCT id / %s FROM filmes WHERE atualizado_em >= %s",
+}
+# Avaliações por parte, para achar as exclusões
+SQL_CONTAGEM_PARTES = {
+    "mysql": "SELECT id DIV %s, COUNT(*) FROM filmes GROUP BY 1",
+    "sqlite": "SELECT id / %s, COUNT(*) FROM filmes GROUP BY 1",
+}
+
+
+def disponivel():
+    return pa is not None
+
+
+def diretorio_analise():
+    return os.getenv("ANALISE_DIR") or os.path.join(diretorio_cache(), "analise")
+
+
+def esquema_filmes():
+    return pa.schema([
+        ("id", pa.int64()), ("usuario_id", pa.int64()), ("tmdb_id", pa.int64()),
+        ("assistido_em", pa.int16()), ("nota", pa.float32()), ("classificacao", pa.string()),
+    ])
+
+
+def esquema_catalogo():
+    return pa.schema([("tmdb_id", pa.int64()), ("titulo", pa.string()), ("ano", pa.int16())])
+
+
+def _lote(linhas, esquema):
+    colunas = list(zip(*linhas))
+    return pa.record_batch([pa.array(valores, tipo) for valores, tipo in zip(colunas, esquema.types)], schema=esquema)
+
+
+# Grava em `caminho` as linhas que `ler(apos)` devolver, bloco a bloco, sem
+# juntar a tabela em memória; devolve quantas linhas gravou
+def _gravar_arrow(caminho, esquema, ler, apos):
+    total = 0
+    temporario = caminho + ".tmp"
+    with pa.OSFile(temporario, "wb") as arquivo, pa.ipc.new_file(arquivo, esquema) as escritor:
+        while True:
+            linhas = ler(apos)
+            if not linhas:
+                break
+            escritor.write_batch(_lote(linhas, esquema))
+            total += len(linhas)
+            apos = linhas[-1][0]
+    os.replace(temporario, caminho)
+    return total
+
+
+def _ler_filmes(fim):
+    def ler(apos):
+        with transacao() as cursor:
+            cursor.execute(SQL_PARTE, (apos, fim, LOTE))
+            # DECIMAL no MySQL
+            return [(i, u, t, a, float(n), c) for i, u, t, a, n, c in cursor.fetchall()]
+    return ler
+
+
+def _ler_catalogo(apos):
+    with transacao() as cursor:
+        cursor.execute(SQL_CATALOGO, (apos, LOTE))
+        return cursor.fetchall()
+
+
+def _nome_parte(parte):
+    return f"parte-{parte:05d}.arrow"
+
+
+def _versao_atual(diretorio):
+    try:
+        with open(os.path.join(diretorio, "atual"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _ler_meta(caminho):
+    with open(os.path.join(caminho, "meta.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Troca o ponteiro "atual" para a versão nova; fica também a anterior, que um
+# processo pode ainda estar abrindo
+def _publicar(diretorio, versao):
+    temporario = os.path.join(diretorio, "atual.tmp")
+    with open(temporario, "w", encoding="utf-8") as f:
+        f.write(versao)
+    os.replace(temporario, os.path.join(diretorio, "atual"))
+    versoes = sorted(v for v in os.listdir(diretorio) if v.startswith("v") and v != versao)
+    for antiga in versoes[:-1]:
+        shutil.rmtree(os.path.join(diretorio, antiga), ignore_errors=True)
+
+
+def exportar(completo=False, diretorio=None):
+    diretorio = diretorio or diretorio_analise()
+    os.makedirs(diretorio, exist_ok=True)
+    anterior = None if completo else _versao_atual(diretorio)
+    meta_anterior = _ler_meta(os.path.join(diretorio, anterior)) if anterior else None
+
+    marca = agora_banco()
+    with transacao() as cursor:
+        cursor.execute("SELECT MAX(id) FROM filmes")
+        ultima = (cursor.fetchone()[0] or 0) // TAMANHO_PARTICAO
+        if meta_anterior is None or meta_anterior["particao"] != TAMANHO_PARTICAO:
+            meta_anterior = None
+            refazer = set(range(ultima + 1))
+        else:
+            cursor.execute(SQL_PARTES_ALTERADAS[cursor.motor], (TAMANHO_PARTICAO, meta_anterior["marca"] - FOLGA))
+            refazer = {int(r[0]) for r in cursor.fetchall()}
+            cursor.execute(SQL_CONTAGEM_PARTES[cursor.motor], (TAMANHO_PARTICAO,))
+            contagens = {int(parte): total for parte, total in cursor.fetchall()}
+            refazer.update(parte for parte in range(ultima + 1)
+                           if contagens.get(parte, 0) != meta_anterior["partes"].get(_nome_parte(parte), 0))
+
+    versao = f"v{int(time.time() * 1000)}"
+    destino = os.path.join(diretorio, versao)
+    os.makedirs(os.path.join(destino, "filmes"))
+    partes = {}
+    for parte in range(ultima + 1):
+        nome = _nome_parte(parte)
+        caminho = os.path.join(destino, "filmes", nome)
+        if parte in refazer:
+            inicio = parte * TAMANHO_PARTICAO - 1
+            linhas = _gravar_arrow(caminho, esquema_filmes(), _ler_filmes(inicio + TAMANHO_PARTICAO + 1), inicio)
+            if not linhas:
+                os.remove(caminho)
+                continue
+            partes[nome] = linhas
+            logging.info("Análise: %s com %s avaliações.", nome, linhas)
+        elif nome in meta_anterior["partes"]:
+            origem = os.path.join(diretorio, anterior, "filmes", nome)
+            try:
+                os.link(origem, caminho)
+            except OSError:
+                shutil.copyfile(origem, caminho)
+            partes[nome] = meta_anterior["partes"][nome]
+    catalogo = _gravar_arrow(os.path.join(destino, "catalogo.arrow"), esquema_catalogo(), _ler_catalogo, -2 ** 63)
+
+    meta = {
+        "marca": marca, "particao": TAMANHO_PARTICAO, "partes": partes, "avaliacoes": sum(partes.values()),
+        "catalogo": catalogo, "refeitas": len(refazer), "criado_em": time.time(),
+    }
+    with open(os.path.join(destino, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    _publicar(diretorio, versao)
+    return versao, meta
+
+
+def _abrir(caminho):
+    return pa.ipc.open_file(pa.memory_map(caminho, "r")).read_all()
+
+
+class Snapshot:
+    def __init__(self, caminho, versao):
+        self.versao = versao
+        self.meta = _ler_meta(caminho)
+        partes = [_abrir(os.path.join(caminho, "filmes", nome)) for nome in sorted(self.meta["partes"])]
+        self.filmes = pa.concat_tables(partes) if partes else esquema_filmes().empty_table()
+        self.catalogo = _abrir(os.path.join(caminho, "catalogo.arrow"))
+        self._relatorios = {}
+        self._lock = threading.Lock()
+
+    # Cada relatório é calculado uma vez por snapshot
+    def relatorio(self, nome, **params):
+        chave = (nome, tuple(sorted(params.items())))
+        with self._lock:
+            if chave not in self._relatorios:
+                self._relatorios[chave] = RELATORIOS[nome](self, **params)
+            return self._relatorios[chave]
+
+
+def resumo(snapshot):
+    filmes = snapshot.filmes
+    return {
+        "avaliacoes": filmes.num_rows,
+        "usuarios": pc.count_distinct(filmes["usuario_id"]).as_py(),
+        "filmes": pc.count_distinct(filmes["tmdb_id"]).as_py(),
+        "nota_media": round(pc.mean(filmes["nota"]).as_py() or 0.0, 2),
+    }
+
+
+def _com_catalogo(tabela, snapshot, colunas):
+    return tabela.join(snapshot.catalogo.select(["tmdb_id", *colunas]), "tmdb_id", join_type="left outer")
+
+
+# Filmes com mais avaliações, entre todos os usuários
+def mais_avaliados(snapshot, quantidade=20, minimo=2):
+    por_filme = snapshot.filmes.group_by("tmdb_id").aggregate([("nota", "count"), ("nota", "mean")])
+    por_filme = por_filme.filter(pc.greater_equal(por_filme["nota_count"], minimo))
+    ordem = [("nota_count", "descending"), ("nota_mean", "descending"), ("tmdb_id", "ascending")]
+    top = por_filme.take(pc.select_k_unstable(por_filme, quantidade, ordem))
+    tabela = _com_catalogo(top, snapshot, ["titulo", "ano"]).to_pandas()
+    tabela = tabela.rename(columns={"nota_count": "avaliacoes", "nota_mean": "nota_media"})
+    tabela["nota_media"] = tabela["nota_media"].round(2)
+    tabela["ano"] = tabela["ano"].astype("Int64")
+    tabela = tabela.sort_values(["avaliacoes", "nota_media", "tmdb_id"], ascending=[False, False, True])
+    return tabela[["tmdb_id", "titulo", "ano", "avaliacoes", "nota_media"]].reset_index(drop=True)
+
+
+# Quantidade, média, mediana e desvio das notas por ano de lançamento
+def notas_por_lancamento(snapshot):
+    notas = _com_catalogo(snapshot.filmes.select(["tmdb_id", "nota"]), snapshot, ["ano"])
+    notas = notas.filter(pc.is_valid(notas["ano"]))
+    por_ano = notas.group_by("ano").aggregate([
+        ("nota", "count"), ("nota", "mean"), ("nota", "approximate_median"), ("nota", "stddev"),
+    ]).to_pandas()
+    por_ano = por_ano.rename(columns={
+        "nota_count": "avaliacoes", "nota_mean": "nota_media", "nota_approximate_median": "nota_mediana", "nota_stddev": "desvio",
+    })
+    return por_ano.set_index("ano").sort_index().round(2)
+
+
+# Fração das avaliações de cada década de lançamento em cada nota inteira
+# (7 junta 7,0 e 7,5)
+def histograma_por_decada(snapshot):
+    notas = _com_catalogo(snapshot.filmes.select(["tmdb_id", "nota"]), snapshot, ["ano"])
+    notas = notas.filter(pc.is_valid(notas["ano"]))
+    decada = pc.multiply(pc.divide(notas["ano"], 10), 10)
+    faixa = pc.cast(pc.floor(notas["nota"]), pa.int8())
+    contagem = pa.table({"decada": decada, "nota": faixa}).group_by(["decada", "nota"]).aggregate([([], "count_all")])
+    tabela = contagem.to_pandas().pivot(index="decada", columns="nota", values="count_all").fillna(0)
+    return tabela.div(tabela.sum(axis=1), axis=0).round(4)
+
+
+# Avaliações de cada classificação por ano assistido
+def classificacoes_por_ano(snapshot):
+    filmes = snapshot.filmes.filter(pc.is_valid(snapshot.filmes["assistido_em"]))
+    contagem = filmes.group_by(["assistido_em", "classificacao"]).aggregate([([], "count_all")])
+    tabela = contagem.to_pandas().pivot(index="assistido_em", columns="classificacao", values="count_all")
+    return tabela.fillna(0).astype("int64").sort_index()
+
+
+RELATORIOS = {
+    "resumo": resumo,
+    "mais_avaliados": mais_avaliados,
+    "notas_por_lancamento": notas_por_lancamento,
+    "histograma_por_decada": histograma_por_decada,
+    "classificacoes_por_ano": classificacoes_por_ano,
+}
+
+
+# Snapshot atual do processo; troca sozinho quando o exportar publica outro
+class LeitorSnapshots:
+    def __init__(self, diretorio, intervalo=60.0):
+        self.diretorio = diretorio
+        self.intervalo = intervalo
+        self._snapshot = None
+        self._verificado = None
+        self._lock = threading.Lock()
+
+    def atual(self):
+        with self._lock:
+            agora = time.monotonic()
+            if self._verificado is None or agora - self._verificado >= self.intervalo:
+                self._verificado = agora
+                versao = _versao_atual(self.diretorio)
+                if versao and (self._snapshot is None or self._snapshot.versao != versao):
+                    try:
+                        self._snapshot = Snapshot(os.path.join(self.diretorio, versao), versao)
+                        logging.info("Snapshot de análise %s carregado.", versao)
+                    except (OSError, ValueError, pa.ArrowInvalid):
+                        logging.warning("Falha ao abrir o snapshot de análise %s.", versao, exc_info=True)
+            return self._snapshot
+
+
+_leitor = None
+_leitor_lock = threading.Lock()
+
+
+def obter_snapshots():
+    global _leitor
+    with _leitor_lock:
+        if _leitor is None:
+            _leitor = LeitorSnapshots(diretorio_analise(), float(os.getenv("ANALISE_VERIFICAR_INTERVALO", "60")))
+        return _leitor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshots colunares e relatórios entre usuários")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    exp = sub.add_parser("exportar", help="grava um snapshot novo (incremental, se houver um anterior)")
+    exp.add_argument("--completo", action="store_true", help="refaz todas as partes")
+
+    rel = sub.add_parser("relatorio", help="mostra um relatório do snapshot atual")
+    rel.add_argument("nome", choices=list(RELATORIOS))
+    args = parser.parse_args(argv)
+
+    if not disponivel():
+        parser.error("os snapshots precisam de pyarrow e pandas")
+
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+
+    if args.comando == "exportar":
+        inicio = time.perf_counter()
+        versao, meta = exportar(args.completo)
+        print(f"snapshot {versao}: {meta['avaliacoes']} avaliações, {meta['refeitas']} partes refeitas "
+              f"({time.perf_counter() - inicio:.1f}s)", file=sys.stderr)
+        return
+    snapshot = obter_snapshots().atual()
+    if snapshot is None:
+        parser.error("nenhum snapshot exportado ainda")
+    inicio = time.perf_counter()
+    resultado = snapshot.relatorio(args.nome)
+    ms = (time.perf_counter() - inicio) * 1000
+    print(resultado if isinstance(resultado, dict) else resultado.to_string())
+    print(f"{args.nome} em {ms:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from classificador.banco import transacao
+
+
+# Índice em memória dos filmes que o usuário já avaliou, pela id da TMDb:
+# carregado com uma única consulta e mantido em dia por salvar_filme e
+# excluir_filme
+class IndiceAssistidos:
+    def __init__(self, usuario_id, linhas=()):
+        self.usuario_id = usuario_id
+        self._por_tmdb = {}
+        self._por_id = {}
+        for filme_id, tmdb_id in linhas:
+            self.adicionar(filme_id, tmdb_id)
+
+    def adicionar(self, filme_id, tmdb_id):
+        self._por_tmdb[tmdb_id] = filme_id
+        self._por_id[filme_id] = tmdb_id
+
+    def remover(self, filme_id):
+        tmdb_id = self._por_id.pop(filme_id, None)
+        if tmdb_id is not None and self._por_tmdb.get(tmdb_id) == filme_id:
+            del self._por_tmdb[tmdb_id]
+
+    def contem(self, tmdb_id):
+        return tmdb_id in self._por_tmdb
+
+    def id_de(self, tmdb_id):
+        return self._por_tmdb.get(tmdb_id)
+
+    def __len__(self):
+        return len(self._por_id)
+
+
+# O índice do banco visto com as gravações ainda na fila por cima
+class AssistidosComPendentes:
+    def __init__(self, indice, pendentes):
+        self.indice = indice
+        self.pendentes = pendentes
+
+    def contem(self, tmdb_id):
+        if tmdb_id in self.pendentes:
+            return self.pendentes[tmdb_id][0] == "salvar"
+        return self.indice.contem(tmdb_id)
+
+    def id_de(self, tmdb_id):
+        return self.indice.id_de(tmdb_id)
+
+
+# Coberta pela chave única (usuario_id, tmdb_id), que já carrega o id
+SQL_ASSISTIDOS = "SELECT id, tmdb_id FROM filmes WHERE usuario_id = %s"
+
+
+def carregar_assistidos(usuario_id):
+    with transacao() as cursor:
+        cursor.execute(SQL_ASSISTIDOS, (usuario_id,))
+        return IndiceAssistidos(usuario_id, cursor.fetchall())
@@ -0,0 +1,303 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+import mysql.connector  # type: ignore
+
+from classificador import rastreamento
+from classificador.banco_sqlite import conectar_sqlite, AGORA
+
+
+# Banco do processo: "mysql" (padrão) ou "sqlite" (embutido, num arquivo
+# local; ver banco_sqlite). O motor vai em cada cursor (cursor.motor) para as
+# poucas instruções que mudam de um banco para o outro.
+def motor():
+    nome = os.getenv("DB_MOTOR", "mysql").strip().lower()
+    if nome not in ("mysql", "sqlite"):
+        raise ValueError(f"DB_MOTOR inválido: {nome!r} (use mysql ou sqlite)")
+    return nome
+
+
+def parametros_mysql():
+    return dict(
+        host=os.getenv("DB_HOST", "localhost"),
+        port=int(os.getenv("DB_PORT", "3305")),
+        user=os.getenv("DB_USER", "angeloiumatti"),
+        password=os.getenv("DB_PASSWORD", "Gfi#261022"),
+        database=os.getenv("DB_NAME", "filmes_db")
+    )
+
+
+# Conexão com o banco
+def conectar_mysql():
+    return mysql.connector.connect(**parametros_mysql())
+
+
+class PoolEsgotado(Exception):
+    pass
+
+
+# Repassa tudo ao cursor do conector, contando e cronometrando as idas ao banco
+class CursorContado:
+    def __init__(self, cursor, pool):
+        self._cursor = cursor
+        self._pool = pool
+        self.motor = pool.motor
+
+    def execute(self, sql, *args, **kwargs):
+        self._pool._contar_consulta()
+        with rastreamento.trecho_sql(sql):
+            return self._cursor.execute(sql, *args, **kwargs)
+
+    def executemany(self, sql, *args, **kwargs):
+        self._pool._contar_consulta()
+        with rastreamento.trecho_sql(sql):
+            return self._cursor.executemany(sql, *args, **kwargs)
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+# Pool de conexões compartilhado por todas as sessões do processo.
+# As conexões livres ficam numa pilha (a mais recente é reutilizada primeiro),
+# o que deixa as mais antigas envelhecerem e serem despejadas por ociosidade.
+class PoolConexoes:
+    def __init__(self, fabrica, tamanho=5, timeout=10.0, max_ocioso=300.0, verificar_apos=30.0, motor="mysql"):
+        self._fabrica = fabrica
+        self.motor = motor
+        self.tamanho = tamanho
+        self.timeout = timeout
+        self.max_ocioso = max_ocioso
+        self.verificar_apos = verificar_apos
+
+        self._cond = threading.Condition()
+        self._livres = []  # [(conexao, devolvida_em)]
+        self._criadas = 0
+        self._em_uso = 0
+        self._em_uso_max = 0
+        self._fechado = False
+
+        self._emprestimos = 0
+        self._misses = 0
+        self._esperas = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._timeouts = 0
+        self._descartadas = 0
+        self._ociosas_despejadas = 0
+        self._consultas = 0
+
+    # Fecha conexões paradas há mais de max_ocioso segundos (chamado com o lock)
+    def _despejar_ociosas(self, agora):
+        if not self._livres or self.max_ocioso <= 0:
+            return []
+        vencidas = [c for c, t in self._livres if agora - t > self.max_ocioso]
+        if vencidas:
+            self._livres = [(c, t) for c, t in self._livres if agora - t <= self.max_ocioso]
+            self._criadas -= len(vencidas)
+            self._ociosas_despejadas += len(vencidas)
+        return vencidas
+
+    def _fechar(self, conexoes):
+        for conn in conexoes:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _contar_consulta(self):
+        with self._cond:
+            self._consultas += 1
+
+    def _saudavel(self, conn):
+        try:
+            return conn.is_connected()
+        except Exception:
+            return False
+
+    def emprestar(self):
+        inicio = time.monotonic()
+        prazo = inicio + self.timeout
+        conn = None
+        devolvida_em = None
+        with self._cond:
+            while True:
+                if self._fechado:
+                    raise PoolEsgotado("Pool de conexões fechado.")
+                vencidas = self._despejar_ociosas(time.monotonic())
+                if vencidas:
+                    self._fechar(vencidas)
+                if self._livres:
+                    conn, devolvida_em = self._livres.pop()
+                    break
+                if self._criadas < self.tamanho:
+                    self._criadas += 1
+                    self._misses += 1
+                    break
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    self._timeouts += 1
+                    raise PoolEsgotado(f"Nenhuma conexão livre após {self.timeout:.1f}s.")
+                self._esperas += 1
+                self._cond.wait(restante)
+            self._em_uso += 1
+            self._em_uso_max = max(self._em_uso_max, self._em_uso)
+
+        try:
+            # Conexão reaproveitada: só testa se ficou parada tempo suficiente
+            # para o servidor ter derrubado (wait_timeout, reinício, rede).
+            if conn is not None and time.monotonic() - devolvida_em >= self.verificar_apos:
+                if not self._saudavel(conn):
+                    logging.warning("Conexão do pool inválida, reabrindo.")
+                    self._fechar([conn])
+                    conn = None
+                    with self._cond:
+                        self._descartadas += 1
+                        self._misses += 1
+            if conn is None:
+                with rastreamento.trecho("conexao", self.motor):
+                    conn = self._fabrica()
+        except Exception:
+            with self._cond:
+                self._criadas -= 1
+                self._em_uso -= 1
+                self._cond.notify()
+            raise
+
+        espera = time.monotonic() - inicio
+        with self._cond:
+            self._emprestimos += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+        return conn
+
+    def devolver(self, conn, descartar=False):
+        if not descartar:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                descartar = True
+        with self._cond:
+            self._em_uso -= 1
+            if descartar or self._fechado:
+                self._criadas -= 1
+                self._descartadas += 1
+            else:
+                self._livres.append((conn, time.monotonic()))
+            self._cond.notify()
+        if descartar or self._fechado:
+            self._fechar([conn])
+
+    @contextmanager
+    def conexao(self):
+        conn = self.emprestar()
+        descartar = False
+        try:
+            yield conn
+        except mysql.connector.errors.OperationalError:
+            descartar = True
+            raise
+        except mysql.connector.errors.InterfaceError:
+            descartar = True
+            raise
+        finally:
+            self.devolver(conn, descartar=descartar)
+
+    # Uso: with pool.transacao() as cursor: ...  (commit ao sair, rollback em erro)
+    # escrita=True é para transações que leem antes de gravar sem FOR UPDATE:
+    # no SQLite elas começam com a trava de escrita (ver banco_sqlite)
+    @contextmanager
+    def transacao(self, dictionary=False, escrita=False):
+        with self.conexao() as conn:
+            if escrita and self.motor == "sqlite":
+                conn.iniciar(escrita=True)
+            cursor = conn.cursor(buffered=True, dictionary=dictionary)
+            try:
+                yield CursorContado(cursor, self)
+                conn.commit()
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                raise
+            finally:
+                cursor.close()
+
+    def fechar(self):
+        with self._cond:
+            self._fechado = True
+            livres = [c for c, _ in self._livres]
+            self._criadas -= len(livres)
+            self._livres = []
+            self._cond.notify_all()
+        self._fechar(livres)
+
+    def metricas(self):
+        with self._cond:
+            return {
+                "tamanho": self.tamanho,
+                "criadas": self._criadas,
+                "em_uso": self._em_uso,
+                "em_uso_max": self._em_uso_max,
+                "livres": len(self._livres),
+                "emprestimos": self._emprestimos,
+                "misses": self._misses,
+                "esperas": self._esperas,
+                "espera_media_ms": (self._espera_total / self._emprestimos * 1000) if self._emprestimos else 0.0,
+                "espera_max_ms": self._espera_max * 1000,
+                "timeouts": self._timeouts,
+                "descartadas": self._descartadas,
+                "ociosas_despejadas": self._ociosas_despejadas,
+                "consultas": self._consultas,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Pool único do processo; os reruns do Streamlit reaproveitam o mesmo objeto
+def obter_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                nome = motor()
+                _pool = PoolConexoes(
+                    conectar_sqlite if nome == "sqlite" else conectar_mysql,
+                    tamanho=int(os.getenv("DB_POOL_TAMANHO", "5")),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+                    max_ocioso=float(os.getenv("DB_POOL_MAX_OCIOSO", "300")),
+                    verificar_apos=float(os.getenv("DB_POOL_VERIFICAR_APOS", "30")),
+                    motor=nome,
+                )
+                atexit.register(_pool.fechar)
+                rastreamento.registrar_medidor("pool", _pool.metricas)
+    return _pool
+
+
+def transacao(dictionary=False, escrita=False):
+    return obter_pool().transacao(dictionary=dictionary, escrita=escrita)
+
+
+def metricas_pool():
+    return obter_pool().metricas()
+
+
+SQL_AGORA = {"mysql": "SELECT UNIX_TIMESTAMP()", "sqlite": f"SELECT {AGORA}"}
+
+
+# Segundos desde 1970 no relógio do banco: a marca das leituras incrementais
+# por filmes.atualizado_em (recomendações, snapshots de análise)
+def agora_banco():
+    with transacao() as cursor:
+        cursor.execute(SQL_AGORA[cursor.motor])
+        return int(cursor.fetchone()[0])
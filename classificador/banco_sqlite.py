@@ -0,0 +1,204 @@
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+
+
+# Banco embutido (DB_MOTOR=sqlite): o mesmo esquema do MySQL num arquivo
+# SQLite local, para desenvolvimento, testes e instalações de um nó só, sem
+# servidor. As conexões imitam o pedaço do conector do MySQL que o pool e os
+# módulos usam (cursor(dictionary=...), commit, rollback, in_transaction,
+# is_connected), então o resto do código roda igual nos dois bancos.
+#
+# O cursor traduz o SQL na hora (com cache): %s vira ?, INSERT/UPDATE IGNORE
+# vira INSERT/UPDATE OR IGNORE e FOR UPDATE sai da consulta e vira a trava do
+# SQLite, que é do banco inteiro: a transação começa com BEGIN IMMEDIATE
+# (escritores em fila, leitores nunca esperam no WAL). Transações que começam
+# com uma leitura usam BEGIN comum e só enxergam o banco daquele instante: se
+# outra conexão gravar no meio, elas não conseguem mais gravar. Por isso quem
+# lê e depois grava sem FOR UPDATE abre a transação com
+# transacao(escrita=True), que já começa travando.
+# As instruções que mudam de forma (upserts, datas) ficam nos módulos, em
+# dicionários por motor (ex.: filmes_salvos.SQL_SALVAR[cursor.motor]).
+#
+# O sqlite3 guarda as instruções já preparadas de cada conexão
+# (cached_statements); as consultas do app são sempre as mesmas e não são
+# recompiladas a cada chamada.
+
+# Segundos desde 1970 no relógio do SQLite (unixepoch() só existe a partir
+# da 3.38)
+AGORA = "CAST((julianday('now') - 2440587.5) * 86400 AS INTEGER)"
+
+PRAGMAS = [
+    # Leitores não esperam o escritor nem o contrário
+    "PRAGMA journal_mode=WAL",
+    # No WAL, o commit não espera o fsync (só o checkpoint): uma queda de
+    # energia pode levar os últimos commits, mas não corrompe o banco
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    # 32 MB de páginas em memória por conexão e o arquivo mapeado (256 MB)
+    "PRAGMA cache_size=-32768",
+    "PRAGMA mmap_size=268435456",
+    # Ordenações e GROUP BY grandes em memória, não em arquivos temporários
+    "PRAGMA temp_store=MEMORY",
+]
+
+# Estado final das migrações do MySQL (classificador.migracoes). A coluna
+# atualizado_em guarda segundos desde 1970; o gatilho faz o papel do ON
+# UPDATE CURRENT_TIMESTAMP (só quando algum valor muda). O rowid vai no fim
+# de cada índice, como o id no InnoDB.
+ESQUEMA = f"""
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT NOT NULL COLLATE NOCASE UNIQUE,
+        senha_hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS catalogo (
+        tmdb_id INTEGER PRIMARY KEY,
+        titulo TEXT NOT NULL,
+        ano INTEGER,
+        poster_url TEXT NOT NULL DEFAULT ''
+    );
+    CREATE TABLE IF NOT EXISTS filmes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        usuario_id INTEGER NOT NULL REFERENCES usuarios (id) ON DELETE CASCADE,
+        tmdb_id INTEGER NOT NULL REFERENCES catalogo (tmdb_id),
+        assistido_em INTEGER,
+        nota REAL NOT NULL,
+        classificacao TEXT NOT NULL,
+        atualizado_em INTEGER NOT NULL DEFAULT ({AGORA}),
+        UNIQUE (usuario_id, tmdb_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_filmes_usuario_assistido ON filmes (usuario_id, assistido_em, nota);
+    CREATE INDEX IF NOT EXISTS idx_filmes_usuario_nota ON filmes (usuario_id, nota);
+    CREATE INDEX IF NOT EXISTS idx_filmes_tmdb ON filmes (tmdb_id);
+    CREATE INDEX IF NOT EXISTS idx_filmes_atualizado ON filmes (atualizado_em);
+    CREATE TRIGGER IF NOT EXISTS trg_filmes_atualizado
+    AFTER UPDATE OF usuario_id, tmdb_id, assistido_em, nota, classificacao ON filmes
+    WHEN OLD.usuario_id IS NOT NEW.usuario_id OR OLD.tmdb_id IS NOT NEW.tmdb_id
+        OR OLD.assistido_em IS NOT NEW.assistido_em OR OLD.nota IS NOT NEW.nota
+        OR OLD.classificacao IS NOT NEW.classificacao
+    BEGIN
+        UPDATE filmes SET atualizado_em = {AGORA} WHERE id = NEW.id;
+    END;
+    CREATE TABLE IF NOT EXISTS estatisticas_usuario (
+        usuario_id INTEGER PRIMARY KEY,
+        dados TEXT NOT NULL,
+        versao INTEGER NOT NULL DEFAULT 0
+    );
+"""
+
+# Colunas que entraram no esquema depois que já havia arquivos criados:
+# (tabela, coluna, definição), acrescentadas na primeira conexão
+COLUNAS_NOVAS = [
+    ("estatisticas_usuario", "versao", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+LEITURAS = ("SELECT", "WITH", "EXPLAIN", "PRAGMA")
+
+
+def arquivo_sqlite():
+    return os.getenv("DB_SQLITE_ARQUIVO", "filmes.sqlite3")
+
+
+# (sql do SQLite, se a transação precisa começar travando o banco)
+@lru_cache(maxsize=512)
+def traduzir(sql):
+    trava = "FOR UPDATE" in sql
+    texto = sql.replace("FOR UPDATE", "").replace("%s", "?")
+    texto = re.sub(r"\b(INSERT|UPDATE) IGNORE\b", r"\1 OR IGNORE", texto)
+    return texto, trava or not texto.lstrip().upper().startswith(LEITURAS)
+
+
+def _linha_dict(cursor, linha):
+    return {coluna[0]: valor for coluna, valor in zip(cursor.description, linha)}
+
+
+class CursorSQLite:
+    def __init__(self, conexao, dictionary=False):
+        self._conexao = conexao
+        self._cursor = conexao.conn.cursor()
+        if dictionary:
+            self._cursor.row_factory = _linha_dict
+
+    def execute(self, sql, params=()):
+        texto, escrita = traduzir(sql)
+        self._conexao.iniciar(escrita)
+        self._cursor.execute(texto, params)
+
+    def executemany(self, sql, params):
+        texto, _ = traduzir(sql)
+        self._conexao.iniciar(True)
+        self._cursor.executemany(texto, params)
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class ConexaoSQLite:
+    def __init__(self, conn):
+        self.conn = conn
+
+    # buffered é do conector do MySQL; o sqlite3 já lê tudo sob demanda
+    def cursor(self, buffered=False, dictionary=False):
+        return CursorSQLite(self, dictionary)
+
+    def iniciar(self, escrita=False):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE" if escrita else "BEGIN")
+
+    @property
+    def in_transaction(self):
+        return self.conn.in_transaction
+
+    def is_connected(self):
+        try:
+            self.conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    # Atualiza as estatísticas do planejador com o que a conexão aprendeu
+    def close(self):
+        try:
+            self.conn.execute("PRAGMA optimize")
+        finally:
+            self.conn.close()
+
+
+_esquemas = set()
+_esquemas_lock = threading.Lock()
+
+
+def _garantir_esquema(conn, arquivo):
+    with _esquemas_lock:
+        if arquivo in _esquemas:
+            return
+        conn.executescript(ESQUEMA)
+        for tabela, coluna, definicao in COLUNAS_NOVAS:
+            if coluna not in {linha[1] for linha in conn.execute(f"PRAGMA table_info({tabela})")}:
+                conn.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+        _esquemas.add(arquivo)
+
+
+def conectar_sqlite():
+    arquivo = arquivo_sqlite()
+    pasta = os.path.dirname(arquivo)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    # O pool garante que cada conexão esteja com uma thread só por vez
+    conn = sqlite3.connect(arquivo, timeout=10.0, isolation_level=None, check_same_thread=False, cached_statements=256)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    _garantir_esquema(conn, os.path.abspath(arquivo))
+    return ConexaoSQLite(conn)
@@ -0,0 +1,184 @@
+import re
+import heapq
+import itertools
+import bisect
+
+from classificador.banco import transacao
+from classificador.catalogo_local import normalizar
+from classificador.filmes_salvos import ID_PENDENTE
+
+
+# Busca por título na biblioteca do próprio usuário, enquanto ele digita:
+# índice em memória carregado com uma única consulta (id, tmdb_id, título e
+# ano) e mantido em dia por salvar_filme, excluir_filme e a edição em lote,
+# como o índice de assistidos. Sem acento e sem diferenciar maiúsculas; cada
+# palavra da consulta casa com o começo de uma palavra do título, em qualquer
+# ordem ("senhor anei" acha "O Senhor dos Anéis").
+#
+# Os candidatos saem da interseção das listas de trigramas das palavras do
+# título com um espaço na frente (" senhor" dá " se", "sen", "enh"...); um
+# termo de uma letra só usa as iniciais (" s"). Os títulos que começam com a
+# consulta vêm primeiro; o resto, do mais curto para o mais longo. Quando os
+# candidatos são muitos (consultas de uma ou duas letras), em vez de
+# ordená-los o índice percorre os títulos já em ordem até juntar o limite, o
+# que acaba cedo justamente porque quase tudo casa.
+
+# Acima desta fração da biblioteca, percorre a ordem em vez de ordenar
+FRACAO_DENSA = 0.02
+
+
+def palavras(texto):
+    return re.sub(r"\W+", " ", normalizar(texto)).split()
+
+
+# Da consulta: a inicial, se o termo tem uma letra só, ou os trigramas
+def _gramas(termo):
+    texto = f" {termo}"
+    if len(texto) < 3:
+        return {texto}
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+# Do título: as duas coisas, para cada palavra
+def _gramas_titulo(termos):
+    return set().union(*map(_gramas, termos), (f" {p[0]}" for p in termos))
+
+
+def _casa(termos, palavras_titulo):
+    return all(any(p.startswith(t) for p in palavras_titulo) for t in termos)
+
+
+# A mesma ordem do índice, para juntar resultados de fora dele
+def _ranking(termos, titulo):
+    normalizado = " ".join(palavras(titulo))
+    return not normalizado.startswith(" ".join(termos)), len(normalizado), normalizado
+
+
+class IndiceBiblioteca:
+    def __init__(self, usuario_id, linhas=()):
+        self.usuario_id = usuario_id
+        self._filmes = {}  # id -> (tmdb_id, titulo, ano, normalizado, palavras)
+        self._por_tmdb = {}
+        self._gramas = {}  # grama -> {id}
+        self._ordem = []  # (len(normalizado), normalizado, id): mais curtos primeiro
+        self._titulos = []  # (normalizado, id), para os que começam com a consulta
+        # Na carga, as listas ordenadas são montadas e ordenadas uma vez só
+        for filme_id, tmdb_id, titulo, ano in linhas:
+            normalizado = self._indexar(filme_id, tmdb_id, titulo, ano)
+            self._ordem.append((len(normalizado), normalizado, filme_id))
+            self._titulos.append((normalizado, filme_id))
+        self._ordem.sort()
+        self._titulos.sort()
+
+    def _indexar(self, filme_id, tmdb_id, titulo, ano):
+        termos = palavras(titulo)
+        normalizado = " ".join(termos)
+        self._filmes[filme_id] = (tmdb_id, titulo, ano, normalizado, termos)
+        self._por_tmdb[tmdb_id] = filme_id
+        for grama in _gramas_titulo(termos):
+            ids = self._gramas.get(grama)
+            if ids is None:
+                ids = self._gramas[grama] = set()
+            ids.add(filme_id)
+        return normalizado
+
+    def adicionar(self, filme_id, tmdb_id, titulo, ano):
+        if filme_id in self._filmes:
+            self.remover(filme_id)
+        normalizado = self._indexar(filme_id, tmdb_id, titulo, ano)
+        bisect.insort(self._ordem, (len(normalizado), normalizado, filme_id))
+        bisect.insort(self._titulos, (normalizado, filme_id))
+
+    def remover(self, filme_id):
+        filme = self._filmes.pop(filme_id, None)
+        if filme is None:
+            return
+        tmdb_id, _, _, normalizado, termos = filme
+        if self._por_tmdb.get(tmdb_id) == filme_id:
+            del self._por_tmdb[tmdb_id]
+        for grama in _gramas_titulo(termos):
+            ids = self._gramas[grama]
+            ids.discard(filme_id)
+            if not ids:
+                del self._gramas[grama]
+        del self._ordem[bisect.bisect_left(self._ordem, (len(normalizado), normalizado, filme_id))]
+        del self._titulos[bisect.bisect_left(self._titulos, (normalizado, filme_id))]
+
+    # Sem cópia quando é uma lista só: quem chama não altera o conjunto
+    def _candidatos(self, termos):
+        listas = []
+        for grama in set().union(*map(_gramas, termos)):
+            ids = self._gramas.get(grama)
+            if not ids:
+                return set()
+            listas.append(ids)
+        if len(listas) == 1:
+            return listas[0]
+        listas.sort(key=len)
+        return listas[0].intersection(*listas[1:])
+
+    # Até `limite` ids que `aceita(id, normalizado)`, na ordem do índice
+    # (mais curtos primeiro), entre `ids` (`total` deles)
+    def _primeiros(self, ids, total, limite, aceita):
+        if total > FRACAO_DENSA * len(self._filmes):
+            return list(itertools.islice((i for _, n, i in self._ordem if aceita(i, n)), limite))
+        return heapq.nsmallest(limite, (i for i in ids if aceita(i, self._filmes[i][3])), key=self._posicao)
+
+    def _posicao(self, filme_id):
+        normalizado = self._filmes[filme_id][3]
+        return len(normalizado), normalizado, filme_id
+
+    # [{id, tmdb_id, titulo, ano}] na ordem do ranking
+    def buscar(self, texto, limite=10):
+        termos = palavras(texto)
+        if not termos or limite <= 0:
+            return []
+        frase = " ".join(termos)
+        comeca = lambda i, normalizado: normalizado.startswith(frase)
+        inicio = bisect.bisect_left(self._titulos, (frase,))
+        fim = bisect.bisect_left(self._titulos, (frase + "\U0010ffff",))
+        ids = self._primeiros((i for _, i in self._titulos[inicio:fim]), fim - inicio, limite, comeca)
+        if len(ids) < limite:
+            candidatos = self._candidatos(termos)
+            # Os trigramas não garantem que cada termo começa uma palavra
+            ids += self._primeiros(candidatos, len(candidatos), limite - len(ids),
+                                   lambda i, n: i in candidatos and not comeca(i, n) and _casa(termos, self._filmes[i][4]))
+        return [self._linha(filme_id) for filme_id in ids]
+
+    def _linha(self, filme_id):
+        tmdb_id, titulo, ano, _, _ = self._filmes[filme_id]
+        return {"id": filme_id, "tmdb_id": tmdb_id, "titulo": titulo, "ano": ano}
+
+    def id_de(self, tmdb_id):
+        return self._por_tmdb.get(tmdb_id)
+
+    def __len__(self):
+        return len(self._filmes)
+
+
+# O índice do banco visto com as gravações ainda na fila por cima
+class BibliotecaComPendentes:
+    def __init__(self, indice, pendentes):
+        self.indice = indice
+        self.pendentes = pendentes
+
+    def buscar(self, texto, limite=10):
+        termos = palavras(texto)
+        linhas = [l for l in self.indice.buscar(texto, limite + len(self.pendentes))
+                  if l["tmdb_id"] not in self.pendentes]
+        for tmdb_id, (operacao, d) in self.pendentes.items():
+            if operacao == "salvar" and termos and _casa(termos, palavras(d["titulo"])):
+                linhas.append({"id": self.indice.id_de(tmdb_id) or ID_PENDENTE, "tmdb_id": tmdb_id,
+                               "titulo": d["titulo"], "ano": d["ano"]})
+        linhas.sort(key=lambda l: _ranking(termos, l["titulo"]))
+        return linhas[:limite]
+
+
+# Título e ano vêm do catálogo, pela chave primária
+SQL_BIBLIOTECA = "SELECT f.id, f.tmdb_id, c.titulo, c.ano FROM filmes f JOIN catalogo c ON c.tmdb_id = f.tmdb_id WHERE f.usuario_id = %s"
+
+
+def carregar_biblioteca(usuario_id):
+    with transacao() as cursor:
+        cursor.execute(SQL_BIBLIOTECA, (usuario_id,))
+        return IndiceBiblioteca(usuario_id, cursor.fetchall())
@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from classificador import rastreamento
+
+
+def diretorio_cache():
+    caminho = os.getenv("CACHE_DIR", ".cache")
+    os.makedirs(caminho, exist_ok=True)
+    return caminho
+
+
+# Abre o SQLite compartilhado entre os processos do host (WAL permite
+# leitores concorrentes enquanto outro processo grava)
+def abrir_sqlite(arquivo):
+    conn = sqlite3.connect(arquivo, timeout=5.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+SQL_CRIAR = """
+    CREATE TABLE IF NOT EXISTS cache (
+        nome TEXT NOT NULL,
+        chave TEXT NOT NULL,
+        valor TEXT NOT NULL,
+        gravado_em REAL NOT NULL,
+        acessado_em REAL NOT NULL,
+        tamanho INTEGER NOT NULL,
+        PRIMARY KEY (nome, chave)
+    )
+"""
+
+# Leituras em disco só anotam o acesso se a anotação anterior for mais velha
+# que isto: o despejo continua quase LRU sem uma escrita a cada leitura
+INTERVALO_ACESSO = 60.0
+
+
+# Cache em dois níveis: LRU em memória na frente de um SQLite em disco.
+# Entradas com idade < ttl são servidas direto; entre ttl e ttl + ttl_obsoleto
+# são servidas como estão enquanto uma thread busca a versão nova
+# (stale-while-revalidate); depois disso são tratadas como ausentes.
+class CacheDoisNiveis:
+    def __init__(self, nome, arquivo, ttl=3600.0, ttl_obsoleto=86400.0, max_itens=256, max_bytes_disco=50 * 1024 * 1024):
+        self.nome = nome
+        self.arquivo = arquivo
+        self.ttl = ttl
+        self.ttl_obsoleto = ttl_obsoleto
+        self.max_itens = max_itens
+        self.max_bytes_disco = max_bytes_disco
+
+        self._memoria = OrderedDict()  # chave -> (valor, gravado_em)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._revalidando = set()
+        self._gravacoes = 0
+        self._contadores = {
+            "hits_memoria": 0,
+            "hits_disco": 0,
+            "hits_obsoletos": 0,
+            "misses": 0,
+            "revalidacoes": 0,
+            "erros_revalidacao": 0,
+            "despejos_memoria": 0,
+            "despejos_disco": 0,
+        }
+
+        self._db().execute(SQL_CRIAR)
+
+    # Uma conexão SQLite por thread
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = abrir_sqlite(self.arquivo)
+            self._local.conn = conn
+        return conn
+
+    def _contar(self, nome):
+        with self._lock:
+            self._contadores[nome] += 1
+        rastreamento.contar(f"cache_{self.nome}_{nome}")
+
+    def _ler_memoria(self, chave):
+        with self._lock:
+            item = self._memoria.get(chave)
+            if item is not None:
+                self._memoria.move_to_end(chave)
+            return item
+
+    def _gravar_memoria(self, chave, valor, gravado_em):
+        with self._lock:
+            self._memoria[chave] = (valor, gravado_em)
+            self._memoria.move_to_end(chave)
+            while len(self._memoria) > self.max_itens:
+                self._memoria.popitem(last=False)
+                self._contadores["despejos_memoria"] += 1
+
+    def _ler_disco(self, chave):
+        try:
+            db = self._db()
+            linha = db.execute(
+                "SELECT valor, gravado_em, acessado_em FROM cache WHERE nome = ? AND chave = ?", (self.nome, chave)
+            ).fetchone()
+            if linha is None:
+                return None
+            agora = time.time()
+            if agora - linha[2] >= INTERVALO_ACESSO:
+                db.execute(
+                    "UPDATE cache SET acessado_em = ? WHERE nome = ? AND chave = ?", (agora, self.nome, chave)
+                )
+            return json.loads(linha[0]), linha[1]
+        except sqlite3.Error:
+            logging.warning("Falha ao ler cache '%s' em disco.", self.nome, exc_info=True)
+            return None
+
+    def _gravar_disco(self, chave, valor, gravado_em):
+        try:
+            texto = json.dumps(valor, ensure_ascii=False)
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO cache (nome, chave, valor, gravado_em, acessado_em, tamanho) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.nome, chave, texto, gravado_em, gravado_em, len(texto.encode("utf-8"))),
+            )
+            with self._lock:
+                self._gravacoes += 1
+                verificar = self._gravacoes % 50 == 1
+            if verificar:
+                self._despejar_disco(db)
+        except sqlite3.Error:
+            logging.warning("Falha ao gravar cache '%s' em disco.", self.nome, exc_info=True)
+
+    # Remove as entradas menos acessadas até a cota voltar a caber
+    def _despejar_disco(self, db):
+        total = db.execute("SELECT COALESCE(SUM(tamanho), 0) FROM cache WHERE nome = ?", (self.nome,)).fetchone()[0]
+        if total <= self.max_bytes_disco:
+            return
+        excesso = total - int(self.max_bytes_disco * 0.9)
+        removidas = 0
+        for chave, tamanho in db.execute(
+            "SELECT chave, tamanho FROM cache WHERE nome = ? ORDER BY acessado_em", (self.nome,)
+        ).fetchall():
+            if excesso <= 0:
+                break
+            db.execute("DELETE FROM cache WHERE nome = ? AND chave = ?", (self.nome, chave))
+            excesso -= tamanho
+            removidas += 1
+        with self._lock:
+            self._contadores["despejos_disco"] += removidas
+
+    def _revalidar(self, chave, carregar):
+        with self._lock:
+            if chave in self._revalidando:
+                return
+            self._revalidando.add(chave)
+
+        def tarefa():
+            try:
+                self.gravar(chave, carregar())
+                self._contar("revalidacoes")
+            except Exception:
+                self._contar("erros_revalidacao")
+                logging.warning("Falha ao revalidar cache '%s' (%s).", self.nome, chave, exc_info=True)
+            finally:
+                with self._lock:
+                    self._revalidando.discard(chave)
+
+        threading.Thread(target=tarefa, name=f"cache-{self.nome}", daemon=True).start()
+
+    def gravar(self, chave, valor):
+        agora = time.time()
+        self._gravar_memoria(chave, valor, agora)
+        self._gravar_disco(chave, valor, agora)
+
+    # Busca na memória, depois no disco, e por fim chama carregar().
+    # Exceções de carregar() sobem para o chamador e nada é gravado.
+    def obter(self, chave, carregar):
+        agora = time.time()
+        item = self._ler_memoria(chave)
+        origem = "hits_memoria"
+        if item is None or agora - item[1] >= self.ttl + self.ttl_obsoleto:
+            item = self._ler_disco(chave)
+            origem = "hits_disco"
+            if item is not None:
+                self._gravar_memoria(chave, item[0], item[1])
+
+        if item is not None:
+            idade = agora - item[1]
+            if idade < self.ttl:
+                self._contar(origem)
+                return item[0]
+            if idade < self.ttl + self.ttl_obsoleto:
+                self._contar("hits_obsoletos")
+                self._revalidar(chave, carregar)
+                return item[0]
+
+        self._contar("misses")
+        valor = carregar()
+        self.gravar(chave, valor)
+        return valor
+
+    # O que já estiver guardado (mesmo obsoleto), sem carregar nem contar;
+    # None se não houver
+    def espiar(self, chave):
+        item = self._ler_memoria(chave)
+        if item is None:
+            item = self._ler_disco(chave)
+            if item is None:
+                return None
+            self._gravar_memoria(chave, item[0], item[1])
+        if time.time() - item[1] >= self.ttl + self.ttl_obsoleto:
+            return None
+        return item[0]
+
+    def invalidar(self, chave):
+        with self._lock:
+            self._memoria.pop(chave, None)
+        try:
+            self._db().execute("DELETE FROM cache WHERE nome = ? AND chave = ?", (self.nome, chave))
+        except sqlite3.Error:
+            logging.warning("Falha ao invalidar cache '%s'.", self.nome, exc_info=True)
+
+    def estatisticas(self):
+        with self._lock:
+            dados = dict(self._contadores)
+            dados["itens_memoria"] = len(self._memoria)
+        consultas = dados["hits_memoria"] + dados["hits_disco"] + dados["hits_obsoletos"] + dados["misses"]
+        dados["taxa_acerto"] = (consultas - dados["misses"]) / consultas if consultas else 0.0
+        return dados
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+# Um cache por nome e por processo, configurado por CACHE_<NOME>_* no .env
+def obter_cache(nome, ttl=3600, ttl_obsoleto=86400, max_itens=256, max_mb_disco=50):
+    with _caches_lock:
+        if nome not in _caches:
+            prefixo = f"CACHE_{nome.upper()}_"
+            _caches[nome] = CacheDoisNiveis(
+                nome,
+                os.path.join(diretorio_cache(), "cache.sqlite3"),
+                ttl=float(os.getenv(prefixo + "TTL", ttl)),
+                ttl_obsoleto=float(os.getenv(prefixo + "TTL_OBSOLETO", ttl_obsoleto)),
+                max_itens=int(os.getenv(prefixo + "MAX_ITENS", max_itens)),
+                max_bytes_disco=float(os.getenv(prefixo + "MAX_MB_DISCO", max_mb_disco)) * 1024 * 1024,
+            )
+        return _caches[nome]
+
+
+# Chave de busca: espaços e maiúsculas não mudam o resultado da TMDb
+def chave_busca(titulo, idioma):
+    return f"{idioma}|{' '.join((titulo or '').casefold().split())}"
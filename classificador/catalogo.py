@@ -0,0 +1,59 @@
+import hashlib
+import unicodedata
+
+
+# Tabela catalogo do banco: título, ano e pôster de cada filme guardados uma
+# vez só, pela id da TMDb, e compartilhados pelas avaliações de todos os
+# usuários (filmes.tmdb_id). Filmes sem correspondência na TMDb (avaliações
+# anteriores ao catálogo e importações sem busca) recebem uma id negativa
+# derivada do título e do ano; `python -m classificador.importacao resolver`
+# tenta casá-los com a TMDb depois.
+
+# Um pôster vazio não apaga o que já se sabe do filme. Uma versão por motor
+# (banco.motor()), escolhida por cursor.motor.
+SQL_GRAVAR = {
+    "mysql": """
+        INSERT INTO catalogo (tmdb_id, titulo, ano, poster_url) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            titulo = VALUES(titulo),
+            ano = VALUES(ano),
+            poster_url = IF(VALUES(poster_url) = '', poster_url, VALUES(poster_url))
+    """,
+    "sqlite": """
+        INSERT INTO catalogo (tmdb_id, titulo, ano, poster_url) VALUES (%s, %s, %s, %s)
+        ON CONFLICT (tmdb_id) DO UPDATE SET
+            titulo = excluded.titulo,
+            ano = excluded.ano,
+            poster_url = CASE WHEN excluded.poster_url = '' THEN poster_url ELSE excluded.poster_url END
+    """,
+}
+
+
+# Mesma comparação que o MySQL faz nos títulos (utf8mb4_0900_ai_ci): sem
+# diferenciar maiúsculas nem acentos
+def _chave(titulo, ano):
+    texto = " ".join((titulo or "").casefold().split())
+    texto = "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+    return f"{texto}|{ano or ''}"
+
+
+# Id negativa estável (cabe num BIGINT) para um filme sem id da TMDb
+def id_local(titulo, ano):
+    resumo = hashlib.sha1(_chave(titulo, ano).encode()).digest()
+    return -(int.from_bytes(resumo[:8], "big") >> 1) - 1
+
+
+def gravar(cursor, filmes):
+    cursor.executemany(SQL_GRAVAR[cursor.motor], list(filmes))
+
+
+# Troca a id local `antiga` pela id da TMDb `nova` nas avaliações. Quem já
+# avaliou os dois fica só com a avaliação da id da TMDb. Devolve os usuários
+# afetados, cujas estatísticas precisam ser refeitas.
+def mesclar(cursor, antiga, nova):
+    cursor.execute("SELECT DISTINCT usuario_id FROM filmes WHERE tmdb_id = %s", (antiga,))
+    usuarios = [r[0] for r in cursor.fetchall()]
+    cursor.execute("UPDATE IGNORE filmes SET tmdb_id = %s WHERE tmdb_id = %s", (nova, antiga))
+    cursor.execute("DELETE FROM filmes WHERE tmdb_id = %s", (antiga,))
+    cursor.execute("DELETE FROM catalogo WHERE tmdb_id = %s", (antiga,))
+    return usuarios
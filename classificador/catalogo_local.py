@@ -0,0 +1,396 @@
+import os
+import re
+import sys
+import glob
+import gzip
+import json
+import time
+import argparse
+import threading
+import unicodedata
+from contextlib import contextmanager
+
+from classificador import rastreamento
+from classificador.cache import diretorio_cache, abrir_sqlite
+
+
+# Espelho local do catálogo da TMDb com índice de texto completo, para que a
+# busca não dependa da API. Fontes:
+#   - os arquivos diários de IDs da TMDb (movie_ids_MM_DD_AAAA.json.gz, uma
+#     linha JSON por filme: id, original_title, popularity, adult)
+#   - respostas de detalhes e de busca já obtidas (arquivos JSON/JSONL e o
+#     cache de buscas do app), que trazem título em português, data e pôster
+#   - as próprias respostas da API quando a busca cai nela (gravação direta)
+#
+#   python -m classificador.catalogo_local importar-export movie_ids_05_15_2025.json.gz
+#   python -m classificador.catalogo_local importar-detalhes detalhes/ respostas.jsonl
+#   python -m classificador.catalogo_local importar-cache
+#   python -m classificador.catalogo_local buscar "senhor dos aneis"
+#
+# Índices FTS5 de palavras sem acento (unicode61 remove_diacritics), com
+# prefixo na última palavra para a digitação incompleta: um com o catálogo
+# inteiro e outro só com os filmes detalhados, que é o que o app mostra. Os
+# trigramas do título normalizado (também só dos detalhados) cobrem erros de
+# digitação e só são usados quando as palavras não acham nada.
+
+SQL_CRIAR = [
+    """
+    CREATE TABLE IF NOT EXISTS filmes (
+        id INTEGER PRIMARY KEY,
+        titulo_original TEXT NOT NULL,
+        titulo TEXT,
+        data_lancamento TEXT,
+        poster_path TEXT,
+        popularidade REAL NOT NULL DEFAULT 0,
+        nota_media REAL,
+        sinopse TEXT,
+        adulto INTEGER NOT NULL DEFAULT 0,
+        detalhado INTEGER NOT NULL DEFAULT 0,
+        normalizado TEXT NOT NULL,
+        atualizado_em REAL NOT NULL
+    )
+    """,
+    "CREATE VIEW IF NOT EXISTS filmes_detalhados AS SELECT * FROM filmes WHERE detalhado = 1",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS busca_palavras USING fts5(
+        titulo, titulo_original, content='filmes', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS busca_detalhados USING fts5(
+        titulo, titulo_original, content='filmes_detalhados', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS busca_trigramas USING fts5(
+        normalizado, content='filmes_detalhados', content_rowid='id', tokenize='trigram'
+    )
+    """,
+]
+
+INDICES = ("busca_palavras", "busca_detalhados", "busca_trigramas")
+
+# Mantêm os índices em dia com a tabela (tabelas FTS de conteúdo externo);
+# busca_detalhados e busca_trigramas só têm os filmes detalhados
+SQL_GATILHOS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS filmes_ai AFTER INSERT ON filmes BEGIN
+        INSERT INTO busca_palavras (rowid, titulo, titulo_original) VALUES (new.id, new.titulo, new.titulo_original);
+        INSERT INTO busca_detalhados (rowid, titulo, titulo_original) SELECT new.id, new.titulo, new.titulo_original WHERE new.detalhado;
+        INSERT INTO busca_trigramas (rowid, normalizado) SELECT new.id, new.normalizado WHERE new.detalhado;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS filmes_ad AFTER DELETE ON filmes BEGIN
+        INSERT INTO busca_palavras (busca_palavras, rowid, titulo, titulo_original) VALUES ('delete', old.id, old.titulo, old.titulo_original);
+        INSERT INTO busca_detalhados (busca_detalhados, rowid, titulo, titulo_original) SELECT 'delete', old.id, old.titulo, old.titulo_original WHERE old.detalhado;
+        INSERT INTO busca_trigramas (busca_trigramas, rowid, normalizado) SELECT 'delete', old.id, old.normalizado WHERE old.detalhado;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS filmes_au AFTER UPDATE ON filmes BEGIN
+        INSERT INTO busca_palavras (busca_palavras, rowid, titulo, titulo_original) VALUES ('delete', old.id, old.titulo, old.titulo_original);
+        INSERT INTO busca_detalhados (busca_detalhados, rowid, titulo, titulo_original) SELECT 'delete', old.id, old.titulo, old.titulo_original WHERE old.detalhado;
+        INSERT INTO busca_trigramas (busca_trigramas, rowid, normalizado) SELECT 'delete', old.id, old.normalizado WHERE old.detalhado;
+        INSERT INTO busca_palavras (rowid, titulo, titulo_original) VALUES (new.id, new.titulo, new.titulo_original);
+        INSERT INTO busca_detalhados (rowid, titulo, titulo_original) SELECT new.id, new.titulo, new.titulo_original WHERE new.detalhado;
+        INSERT INTO busca_trigramas (rowid, normalizado) SELECT new.id, new.normalizado WHERE new.detalhado;
+    END
+    """,
+]
+
+# Linhas do export diário: não mexem em título, data e pôster já detalhados
+SQL_EXPORT = """
+    INSERT INTO filmes (id, titulo_original, popularidade, adulto, normalizado, atualizado_em)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET
+        titulo_original = excluded.titulo_original,
+        popularidade = excluded.popularidade,
+        adulto = excluded.adulto,
+        normalizado = CASE WHEN filmes.detalhado THEN filmes.normalizado ELSE excluded.normalizado END
+"""
+
+SQL_DETALHES = """
+    INSERT INTO filmes (id, titulo_original, titulo, data_lancamento, poster_path, popularidade,
+                        nota_media, sinopse, adulto, detalhado, normalizado, atualizado_em)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET
+        titulo_original = excluded.titulo_original,
+        titulo = excluded.titulo,
+        data_lancamento = excluded.data_lancamento,
+        poster_path = excluded.poster_path,
+        popularidade = excluded.popularidade,
+        nota_media = excluded.nota_media,
+        sinopse = excluded.sinopse,
+        adulto = excluded.adulto,
+        detalhado = 1,
+        normalizado = excluded.normalizado,
+        atualizado_em = excluded.atualizado_em
+"""
+
+COLUNAS = "f.id, f.titulo_original, f.titulo, f.data_lancamento, f.poster_path, f.popularidade, f.nota_media, f.sinopse, f.detalhado"
+
+
+def normalizar(texto):
+    return "".join(c for c in unicodedata.normalize("NFKD", (texto or "").casefold()) if not unicodedata.combining(c))
+
+
+def _normalizado(titulo, titulo_original):
+    titulos = [normalizar(titulo), normalizar(titulo_original)]
+    return " | ".join(dict.fromkeys(t for t in titulos if t))
+
+
+def trigramas(texto):
+    texto = f" {' '.join(normalizar(texto).split())} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+# Fração dos trigramas da consulta presentes no título: a consulta costuma
+# ser só um pedaço do título ("senhr dos aneis")
+def _cobertura(consulta, titulo):
+    if not consulta:
+        return 0.0
+    return len(consulta & titulo) / len(consulta)
+
+
+# As conexões de abrir_sqlite estão em autocommit; cargas vão num BEGIN só
+@contextmanager
+def _transacao(db):
+    db.execute("BEGIN")
+    try:
+        yield db
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+
+
+def _como_tmdb(linha):
+    filme_id, original, titulo, data, poster, popularidade, nota, sinopse, detalhado = linha
+    return {
+        "id": filme_id,
+        "title": titulo or original,
+        "original_title": original,
+        "release_date": data or "",
+        "poster_path": poster,
+        "popularity": popularidade,
+        "vote_average": nota,
+        "overview": sinopse or "",
+    }
+
+
+class CatalogoLocal:
+    def __init__(self, arquivo, similaridade_minima=0.6):
+        self.arquivo = arquivo
+        self.similaridade_minima = similaridade_minima
+        self._local = threading.local()
+        db = self._db()
+        for sql in SQL_CRIAR + SQL_GATILHOS:
+            db.execute(sql)
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = abrir_sqlite(self.arquivo)
+            self._local.conn = conn
+        return conn
+
+    # Em cargas grandes é bem mais rápido gravar sem os gatilhos e refazer os
+    # índices de uma vez no fim
+    @contextmanager
+    def _carga_em_massa(self):
+        db = self._db()
+        for nome in ("filmes_ai", "filmes_ad", "filmes_au"):
+            db.execute(f"DROP TRIGGER IF EXISTS {nome}")
+        try:
+            yield db
+        finally:
+            for indice in INDICES:
+                db.execute(f"INSERT INTO {indice} ({indice}) VALUES ('rebuild')")
+            for sql in SQL_GATILHOS:
+                db.execute(sql)
+
+    def _linha_detalhes(self, filme, agora):
+        titulo = filme.get("title") or filme.get("original_title") or ""
+        original = filme.get("original_title") or titulo
+        return (
+            int(filme["id"]), original, titulo, filme.get("release_date") or "", filme.get("poster_path"),
+            float(filme.get("popularity") or 0), filme.get("vote_average"), filme.get("overview") or "",
+            int(bool(filme.get("adult"))), _normalizado(titulo, original), agora,
+        )
+
+    # Grava resultados de busca ou respostas de detalhes da API
+    def gravar(self, filmes):
+        agora = time.time()
+        linhas = [self._linha_detalhes(f, agora) for f in filmes if f.get("id") and (f.get("title") or f.get("original_title"))]
+        if linhas:
+            db = self._db()
+            with _transacao(db):
+                db.executemany(SQL_DETALHES, linhas)
+        return len(linhas)
+
+    def importar_export(self, caminho, lote=20000):
+        total = 0
+        agora = time.time()
+        with gzip.open(caminho, "rt", encoding="utf-8") as arquivo, self._carga_em_massa() as db:
+            linhas = []
+            for texto in arquivo:
+                if not texto.strip():
+                    continue
+                obj = json.loads(texto)
+                if obj.get("video"):
+                    continue
+                original = obj.get("original_title") or ""
+                linhas.append((int(obj["id"]), original, float(obj.get("popularity") or 0),
+                               int(bool(obj.get("adult"))), _normalizado(None, original), agora))
+                if len(linhas) >= lote:
+                    with _transacao(db):
+                        db.executemany(SQL_EXPORT, linhas)
+                    total += len(linhas)
+                    linhas = []
+                    print(f"{total} filmes do export", file=sys.stderr)
+            if linhas:
+                with _transacao(db):
+                    db.executemany(SQL_EXPORT, linhas)
+                total += len(linhas)
+        return total
+
+    # Arquivos .json (um objeto de detalhes ou uma resposta de busca com
+    # "results") ou .jsonl (um por linha), ou pastas com eles
+    def importar_detalhes(self, caminhos, lote=5000):
+        arquivos = []
+        for caminho in caminhos:
+            if os.path.isdir(caminho):
+                arquivos += sorted(glob.glob(os.path.join(caminho, "**", "*.json*"), recursive=True))
+            else:
+                arquivos.append(caminho)
+        total = 0
+        pendentes = []
+        for nome in arquivos:
+            abrir = gzip.open if nome.endswith(".gz") else open
+            with abrir(nome, "rt", encoding="utf-8") as arquivo:
+                objetos = [json.loads(t) for t in arquivo if t.strip()] if ".jsonl" in nome else [json.load(arquivo)]
+            for obj in objetos:
+                pendentes += obj.get("results", []) if "results" in obj else [obj]
+            if len(pendentes) >= lote:
+                total += self.gravar(pendentes)
+                pendentes = []
+        return total + self.gravar(pendentes)
+
+    # Aproveita as buscas já guardadas no cache do app (tabela cache, nome 'busca')
+    def importar_cache_buscas(self, idioma="pt-BR"):
+        db_cache = abrir_sqlite(os.path.join(diretorio_cache(), "cache.sqlite3"))
+        try:
+            linhas = db_cache.execute(
+                "SELECT valor FROM cache WHERE nome = 'busca' AND chave LIKE ?", (f"{idioma}|%",)
+            ).fetchall()
+        finally:
+            db_cache.close()
+        total = 0
+        for (valor,) in linhas:
+            total += self.gravar(json.loads(valor))
+        return total
+
+    def _buscar_palavras(self, db, termos, limite, somente_detalhados):
+        indice = "busca_detalhados" if somente_detalhados else "busca_palavras"
+        consulta = " ".join(f'"{t}"' for t in termos[:-1]) + f' "{termos[-1]}"*'
+        return db.execute(
+            f"SELECT {COLUNAS} FROM {indice} b JOIN filmes f ON f.id = b.rowid "
+            f"WHERE {indice} MATCH ? ORDER BY f.popularidade DESC LIMIT ?",
+            (consulta.strip(), limite),
+        ).fetchall()
+
+    # Candidatos (só detalhados) que compartilham trigramas com a consulta,
+    # reordenados pela cobertura dos trigramas e pela popularidade
+    def _buscar_aproximado(self, db, consulta, limite, candidatos=200):
+        alvo = trigramas(consulta)
+        if len(alvo) < 2:
+            return []
+        expressao = " OR ".join('"' + t.replace('"', '""') + '"' for t in sorted(alvo))
+        linhas = db.execute(
+            f"SELECT {COLUNAS}, f.normalizado FROM busca_trigramas t JOIN filmes f ON f.id = t.rowid "
+            "WHERE busca_trigramas MATCH ? ORDER BY t.rank LIMIT ?",
+            (expressao, candidatos),
+        ).fetchall()
+        pontuadas = []
+        for linha in linhas:
+            nota = max(_cobertura(alvo, trigramas(t)) for t in linha[-1].split(" | "))
+            if nota >= self.similaridade_minima:
+                pontuadas.append((nota, linha[5], linha[:-1]))
+        pontuadas.sort(key=lambda p: (-p[0], -p[1]))
+        return [p[2] for p in pontuadas[:limite]]
+
+    # Resultados no formato da API de busca. Filmes só do export não têm
+    # título em português, data nem pôster; somente_detalhados os deixa de fora
+    # (a busca aproximada só olha os detalhados de qualquer forma).
+    def buscar(self, consulta, limite=20, somente_detalhados=False):
+        termos = re.findall(r"\w+", normalizar(consulta))
+        if not termos:
+            return []
+        db = self._db()
+        with rastreamento.trecho("catalogo", "buscar"):
+            linhas = self._buscar_palavras(db, termos, limite, somente_detalhados)
+            if not linhas:
+                linhas = self._buscar_aproximado(db, consulta, limite)
+        return [_como_tmdb(l) for l in linhas]
+
+    def estatisticas(self):
+        total, detalhados = self._db().execute("SELECT COUNT(*), COALESCE(SUM(detalhado), 0) FROM filmes").fetchone()
+        return {"filmes": total, "detalhados": detalhados}
+
+
+_catalogo = None
+_catalogo_lock = threading.Lock()
+
+
+def obter_catalogo():
+    global _catalogo
+    with _catalogo_lock:
+        if _catalogo is None:
+            _catalogo = CatalogoLocal(
+                os.getenv("CATALOGO_ARQUIVO") or os.path.join(diretorio_cache(), "catalogo.sqlite3"),
+                similaridade_minima=float(os.getenv("CATALOGO_SIMILARIDADE", "0.6")),
+            )
+        return _catalogo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Catálogo local da TMDb")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    exp = sub.add_parser("importar-export", help="arquivo diário de IDs da TMDb (.json.gz)")
+    exp.add_argument("arquivo")
+    det = sub.add_parser("importar-detalhes", help="respostas de detalhes/busca em .json, .jsonl ou pastas")
+    det.add_argument("caminhos", nargs="+")
+    sub.add_parser("importar-cache", help="buscas guardadas no cache do app")
+    bus = sub.add_parser("buscar")
+    bus.add_argument("consulta")
+    bus.add_argument("--vezes", type=int, default=1, help="repete a busca e mostra o tempo médio")
+    sub.add_parser("estatisticas")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+    catalogo = obter_catalogo()
+
+    if args.comando == "importar-export":
+        print(f"{catalogo.importar_export(args.arquivo)} filmes importados", file=sys.stderr)
+    elif args.comando == "importar-detalhes":
+        print(f"{catalogo.importar_detalhes(args.caminhos)} filmes detalhados", file=sys.stderr)
+    elif args.comando == "importar-cache":
+        print(f"{catalogo.importar_cache_buscas()} filmes das buscas em cache", file=sys.stderr)
+    elif args.comando == "buscar":
+        inicio = time.perf_counter()
+        for _ in range(args.vezes):
+            resultados = catalogo.buscar(args.consulta)
+        ms = (time.perf_counter() - inicio) * 1000 / args.vezes
+        for filme in resultados:
+            print(f"{filme['id']:>8}  {filme['title']} ({filme['release_date'][:4]})  pop {filme['popularity']:.1f}")
+        print(f"{len(resultados)} resultados em {ms:.2f} ms", file=sys.stderr)
+    else:
+        print(catalogo.estatisticas())
+
+
+if __name__ == "__main__":
+    main()
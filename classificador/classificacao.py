@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import bisect
+import argparse
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # sem NumPy não há reclassificação em massa; o app só usa classificar_filme
+    np = None
+
+
+# Faixas de classificação: cada rótulo vale para notas até o limite
+# (inclusive) e acima do limite anterior. Configuráveis no .env com
+# CLASSIFICACAO_FAIXAS="4:Ruim,6:Mediano,9:Bom,10:Filmão".
+FAIXAS_PADRAO = "4:Ruim,6:Mediano,9:Bom,10:Filmão"
+
+
+def carregar_faixas(texto=None):
+    texto = texto or os.getenv("CLASSIFICACAO_FAIXAS") or FAIXAS_PADRAO
+    faixas = []
+    for parte in texto.split(","):
+        limite, rotulo = parte.split(":", 1)
+        faixas.append((float(limite), rotulo.strip()))
+    faixas.sort()
+    return faixas
+
+
+def disponivel():
+    return np is not None
+
+
+def rotulos(faixas=None):
+    return [rotulo for _, rotulo in (faixas or carregar_faixas())]
+
+
+def classificar_filme(nota, faixas=None):
+    faixas = faixas or carregar_faixas()
+    limites = [limite for limite, _ in faixas]
+    # notas acima do último limite ficam na última faixa
+    indice = min(bisect.bisect_left(limites, nota), len(faixas) - 1)
+    return faixas[indice][1]
+
+
+# Versão vetorizada: classifica um array de notas de uma vez e devolve o
+# índice da faixa de cada nota (use rotulos() para traduzir)
+def classificar_codigos(notas, faixas=None):
+    faixas = faixas or carregar_faixas()
+    limites = np.array([limite for limite, _ in faixas], dtype=np.float64)
+    codigos = np.searchsorted(limites, np.asarray(notas, dtype=np.float64), side="left")
+    return np.minimum(codigos, len(faixas) - 1)
+
+
+def classificar_lote(notas, faixas=None):
+    faixas = faixas or carregar_faixas()
+    return np.array(rotulos(faixas), dtype=object)[classificar_codigos(notas, faixas)]
+
+
+SQL_LER_LOTE = "SELECT id, usuario_id, nota, classificacao FROM filmes WHERE id > %s ORDER BY id LIMIT %s"
+SQL_RELER = "SELECT id, usuario_id, nota, classificacao FROM filmes WHERE id IN ({}) FOR UPDATE"
+
+
+# Reescreve a coluna classificacao de todos os usuários com as faixas atuais.
+# Lê pela chave primária em blocos, classifica cada bloco com NumPy e grava só
+# as linhas que mudaram, com um UPDATE ... WHERE id IN (...) por rótulo. As
+# contagens por classificação das estatísticas mudam na mesma transação de
+# cada bloco, e com elas a versão dos usuários.
+def reclassificar(faixas=None, lote=50000, ids_por_update=5000):
+    from classificador.banco import transacao
+
+    faixas = faixas or carregar_faixas()
+    nomes = np.array(rotulos(faixas), dtype=object)
+    ultimo_id = 0
+    lidas = alteradas = 0
+    inicio = time.perf_counter()
+    while True:
+        with transacao(escrita=True) as cursor:
+            cursor.execute(SQL_LER_LOTE, (ultimo_id, lote))
+            linhas = cursor.fetchall()
+            if not linhas:
+                break
+            ids = np.fromiter((l[0] for l in linhas), dtype=np.int64, count=len(linhas))
+            usuarios = np.fromiter((l[1] for l in linhas), dtype=np.int64, count=len(linhas))
+            notas = np.fromiter((float(l[2]) for l in linhas), dtype=np.float64, count=len(linhas))
+            atuais = np.array([l[3] for l in linhas], dtype=object)
+            mudou = nomes[classificar_codigos(notas, faixas)] != atuais
+            lidas += len(linhas)
+            ultimo_id = int(ids[-1])
+            if mudou.any():
+                alteradas += _reclassificar_linhas(cursor, ids[mudou].tolist(), np.unique(usuarios[mudou]).tolist(),
+                                                   faixas, nomes, ids_por_update)
+        print(f"{lidas} linhas lidas, {alteradas} reclassificadas ({time.perf_counter() - inicio:.1f}s)", file=sys.stderr)
+    return lidas, alteradas
+
+
+# As linhas `alvo` de um bloco, com as estatísticas dos `usuarios` travadas
+# antes (como em salvar e excluir) e relidas depois: o app pode ter gravado
+# outra nota desde a leitura do bloco. Devolve quantas mudaram.
+def _reclassificar_linhas(cursor, alvo, usuarios, faixas, nomes, ids_por_update):
+    from classificador import estatisticas
+
+    dados = estatisticas.bloquear_usuarios(cursor, usuarios)
+    linhas = []
+    for i in range(0, len(alvo), ids_por_update):
+        parte = alvo[i:i + ids_por_update]
+        cursor.execute(SQL_RELER.format(",".join(["%s"] * len(parte))), tuple(parte))
+        linhas.extend(cursor.fetchall())
+    if not linhas:
+        return 0
+    ids = np.fromiter((l[0] for l in linhas), dtype=np.int64, count=len(linhas))
+    codigos = classificar_codigos(np.fromiter((float(l[2]) for l in linhas), dtype=np.float64, count=len(linhas)), faixas)
+    mudou = nomes[codigos] != np.array([l[3] for l in linhas], dtype=object)
+    for codigo in np.unique(codigos[mudou]):
+        destino = ids[mudou & (codigos == codigo)]
+        for i in range(0, len(destino), ids_por_update):
+            parte = destino[i:i + ids_por_update].tolist()
+            placeholders = ",".join(["%s"] * len(parte))
+            cursor.execute(
+                f"UPDATE filmes SET classificacao = %s WHERE id IN ({placeholders})",
+                (nomes[codigo], *parte),
+            )
+    # Nota e ano assistido não mudam: só as classificações saem e entram
+    mudancas = defaultdict(list)
+    for i in np.flatnonzero(mudou):
+        _, usuario_id, nota, atual = linhas[i]
+        codigo = codigos[i]
+        mudancas[usuario_id].append(({"nota": nota, "classificacao": atual}, {"nota": nota, "classificacao": nomes[codigo]}))
+    for usuario_id in sorted(mudancas):
+        estatisticas.atualizar_em_massa(cursor, usuario_id, dados.get(usuario_id), mudancas[usuario_id], notas_mudaram=False)
+    return int(mudou.sum())
+
+
+def benchmark(quantidade, faixas=None):
+    faixas = faixas or carregar_faixas()
+    notas = np.round(np.random.default_rng(0).uniform(0, 10, quantidade) * 2) / 2
+
+    inicio = time.perf_counter()
+    codigos = classificar_codigos(notas, faixas)
+    vetorizado = time.perf_counter() - inicio
+
+    amostra = notas[:min(quantidade, 200000)]
+    inicio = time.perf_counter()
+    escalar = [classificar_filme(n, faixas) for n in amostra]
+    por_linha = (time.perf_counter() - inicio) / len(amostra)
+
+    contagens = defaultdict(int)
+    for codigo, qtd in zip(*np.unique(codigos, return_counts=True)):
+        contagens[faixas[codigo][1]] = int(qtd)
+    if list(classificar_lote(amostra[:1000], faixas)) != escalar[:1000]:
+        sys.exit("a classificação vetorizada diverge da escalar")
+    print(f"{quantidade} notas: vetorizado {vetorizado * 1000:.1f} ms "
+          f"({quantidade / vetorizado / 1e6:.1f} M/s); escalar estimado {por_linha * quantidade:.2f} s")
+    print(dict(contagens))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classificação das avaliações por faixas de nota")
+    parser.add_argument("--faixas", help=f'ex.: "{FAIXAS_PADRAO}" (padrão: CLASSIFICACAO_FAIXAS)')
+    sub = parser.add_subparsers(dest="comando", required=True)
+    rec = sub.add_parser("reclassificar", help="reescreve a classificação de todos os filmes salvos")
+    rec.add_argument("--lote", type=int, default=50000)
+    ben = sub.add_parser("benchmark", help="mede a classificação vetorizada em notas sintéticas")
+    ben.add_argument("quantidade", type=int, nargs="?", default=5_000_000)
+    args = parser.parse_args(argv)
+
+    if not disponivel():
+        parser.error("reclassificar e benchmark precisam do NumPy")
+
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+    faixas = carregar_faixas(args.faixas)
+
+    if args.comando == "reclassificar":
+        lidas, alteradas = reclassificar(faixas, args.lote)
+        print(f"concluído: {alteradas} de {lidas} filmes reclassificados", file=sys.stderr)
+    else:
+        benchmark(args.quantidade, faixas)
+
+
+if __name__ == "__main__":
+    main()
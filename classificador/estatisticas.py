@@ -0,0 +1,303 @@
+import sys
+import json
+import argparse
+
+from classificador.banco import transacao
+
+
+# Quantos filmes mais bem avaliados ficam guardados; o painel mostra 5, a
+# folga evita ir ao banco a cada exclusão de um filme do top
+TOP_RESERVA = 20
+TOP_EXIBIDOS = 5
+
+SQL_TOP = (
+    "SELECT f.id, c.titulo, c.ano, f.nota, c.poster_url FROM filmes f JOIN catalogo c ON c.tmdb_id = f.tmdb_id "
+    "WHERE f.usuario_id = %s ORDER BY f.nota DESC, f.id DESC LIMIT %s"
+)
+SQL_CALCULAR = (
+    "SELECT classificacao, nota, assistido_em, COUNT(*) FROM filmes WHERE usuario_id = %s "
+    "GROUP BY classificacao, nota, assistido_em"
+)
+SQL_LER = "SELECT dados FROM estatisticas_usuario WHERE usuario_id = %s"
+SQL_VERSAO = "SELECT versao FROM estatisticas_usuario WHERE usuario_id = %s"
+# Toda gravação de avaliações do usuário passa por aqui, na mesma transação,
+# e sobe a versão dele: é por ela que os caches de cada processo sabem que
+# outro processo gravou (servicos). A versão nova volta pelo lastrowid
+# (LAST_INSERT_ID(expr), como em filmes_salvos.SQL_SALVAR) ou pelo RETURNING.
+SQL_GRAVAR = {
+    "mysql": (
+        "INSERT INTO estatisticas_usuario (usuario_id, dados, versao) VALUES (%s, %s, LAST_INSERT_ID(1)) "
+        "ON DUPLICATE KEY UPDATE dados = VALUES(dados), versao = LAST_INSERT_ID(versao + 1)"
+    ),
+    "sqlite": (
+        "INSERT INTO estatisticas_usuario (usuario_id, dados, versao) VALUES (%s, %s, 1) "
+        "ON CONFLICT (usuario_id) DO UPDATE SET dados = excluded.dados, versao = estatisticas_usuario.versao + 1 "
+        "RETURNING versao"
+    ),
+}
+SQL_BLOQUEAR_SALVAR = """
+    SELECT e.dados, f.id, f.nota, f.classificacao, f.assistido_em
+    FROM (SELECT %s AS usuario_id) u
+    LEFT JOIN estatisticas_usuario e ON e.usuario_id = u.usuario_id
+    LEFT JOIN filmes f ON f.usuario_id = u.usuario_id AND f.tmdb_id = %s
+    FOR UPDATE
+"""
+SQL_BLOQUEAR_EXCLUIR = """
+    SELECT e.dados, f.id, f.nota, f.classificacao, f.assistido_em
+    FROM filmes f
+    LEFT JOIN estatisticas_usuario e ON e.usuario_id = f.usuario_id
+    WHERE f.usuario_id = %s AND f.tmdb_id = %s
+    FOR UPDATE
+"""
+# Edição em lote: as estatísticas e todos os filmes do lote numa ida só; o
+# catálogo completa os itens que podem entrar no top
+SQL_BLOQUEAR_LOTE = """
+    SELECT e.dados, f.tmdb_id, f.id, f.nota, f.classificacao, f.assistido_em, c.titulo, c.ano, c.poster_url
+    FROM (SELECT %s AS usuario_id) u
+    LEFT JOIN estatisticas_usuario e ON e.usuario_id = u.usuario_id
+    LEFT JOIN filmes f ON f.usuario_id = u.usuario_id AND f.tmdb_id IN ({})
+    LEFT JOIN catalogo c ON c.tmdb_id = f.tmdb_id
+    FOR UPDATE
+"""
+# Gravações em massa: as estatísticas de vários usuários, sempre na mesma
+# ordem, e as avaliações que um lote da importação substitui
+SQL_BLOQUEAR_USUARIOS = "SELECT usuario_id, dados FROM estatisticas_usuario WHERE usuario_id IN ({}) ORDER BY usuario_id FOR UPDATE"
+SQL_BLOQUEAR_IMPORTACAO = (
+    "SELECT tmdb_id, nota, classificacao, assistido_em FROM filmes WHERE usuario_id = %s AND tmdb_id IN ({}) FOR UPDATE"
+)
+
+
+def vazias():
+    return {"total": 0, "classificacoes": {}, "histograma": {}, "por_ano": {}, "top": []}
+
+
+def _somar(mapa, chave, delta):
+    chave = str(chave)
+    valor = mapa.get(chave, 0) + delta
+    if valor > 0:
+        mapa[chave] = valor
+    else:
+        mapa.pop(chave, None)
+
+
+def _chave_top(item):
+    return (item["nota"], item["id"])
+
+
+# Só os contadores (total, classificações, histograma e anos) de aplicar_delta
+def _contar(dados, antigo=None, novo=None):
+    for linha, delta in ((antigo, -1), (novo, 1)):
+        if linha is None:
+            continue
+        dados["total"] += delta
+        _somar(dados["classificacoes"], linha["classificacao"], delta)
+        _somar(dados["histograma"], f"{float(linha['nota']):.1f}", delta)
+        if linha.get("assistido_em"):
+            _somar(dados["por_ano"], linha["assistido_em"], delta)
+
+
+# Aplica em `dados` a remoção de `antigo` e/ou a inclusão de `novo`
+# (uma edição é as duas coisas). Devolve True se o top precisa ser recarregado.
+def aplicar_delta(dados, antigo=None, novo=None):
+    top = dados["top"]
+    # O top guarda sempre os len(top) melhores filmes; se tem todos, qualquer
+    # filme novo entra nele
+    completo = len(top) >= dados["total"]
+    _contar(dados, antigo, novo)
+
+    if antigo is not None:
+        top[:] = [item for item in top if item["id"] != antigo["id"]]
+    if novo is not None:
+        item = {
+            "id": novo["id"],
+            "titulo": novo["titulo"],
+            "ano": novo["ano"],
+            "nota": float(novo["nota"]),
+            "poster_url": novo["poster_url"],
+        }
+        if completo or (top and _chave_top(item) > _chave_top(top[-1])):
+            top.append(item)
+            top.sort(key=_chave_top, reverse=True)
+            del top[TOP_RESERVA:]
+    return len(top) < min(TOP_EXIBIDOS, dados["total"])
+
+
+def _carregar_top(cursor, usuario_id):
+    cursor.execute(SQL_TOP, (usuario_id, TOP_RESERVA))
+    return [
+        {"id": r[0], "titulo": r[1], "ano": r[2], "nota": float(r[3]), "poster_url": r[4]}
+        for r in cursor.fetchall()
+    ]
+
+
+def calcular(cursor, usuario_id):
+    dados = vazias()
+    cursor.execute(SQL_CALCULAR, (usuario_id,))
+    for classificacao, nota, assistido_em, qtd in cursor.fetchall():
+        dados["total"] += qtd
+        _somar(dados["classificacoes"], classificacao, qtd)
+        _somar(dados["histograma"], f"{float(nota):.1f}", qtd)
+        if assistido_em:
+            _somar(dados["por_ano"], assistido_em, qtd)
+    dados["top"] = _carregar_top(cursor, usuario_id)
+    return dados
+
+
+# Devolve a versão nova do usuário
+def gravar(cursor, usuario_id, dados):
+    cursor.execute(SQL_GRAVAR[cursor.motor], (usuario_id, json.dumps(dados, ensure_ascii=False)))
+    if cursor.motor == "sqlite":
+        return cursor.fetchone()[0]
+    return cursor.lastrowid
+
+
+# Recalcula do zero. Leitores usam sobrescrever=False para não apagar o
+# resultado de uma escrita que tenha terminado enquanto calculavam; a linha
+# que eles criam já nasce na versão 1, como a de SQL_GRAVAR, porque a versão
+# 0 é a de quem não tem linha.
+def reconstruir(cursor, usuario_id, sobrescrever=True):
+    dados = calcular(cursor, usuario_id)
+    if sobrescrever:
+        gravar(cursor, usuario_id, dados)
+    else:
+        cursor.execute(
+            "INSERT IGNORE INTO estatisticas_usuario (usuario_id, dados, versao) VALUES (%s, %s, 1)",
+            (usuario_id, json.dumps(dados, ensure_ascii=False)),
+        )
+    return dados
+
+
+def _linha(valores, colunas):
+    if valores is None or valores[0] is None:
+        return None
+    return dict(zip(colunas, valores))
+
+
+# Trava a linha de estatísticas do usuário e lê o filme que vai ser salvo, se
+# já existir, numa única ida ao banco. Devolve (dados, filme_antigo); dados é
+# None enquanto o usuário ainda não tiver estatísticas materializadas.
+def bloquear_para_salvar(cursor, usuario_id, tmdb_id):
+    cursor.execute(SQL_BLOQUEAR_SALVAR, (usuario_id, tmdb_id))
+    linha = cursor.fetchone()
+    dados = json.loads(linha[0]) if linha[0] else None
+    return dados, _linha(linha[1:], ["id", "nota", "classificacao", "assistido_em"])
+
+
+# Equivalente para exclusão: devolve (dados, filme); filme é None se o
+# usuário não tiver avaliado o filme
+def bloquear_para_excluir(cursor, usuario_id, tmdb_id):
+    cursor.execute(SQL_BLOQUEAR_EXCLUIR, (usuario_id, tmdb_id))
+    linha = cursor.fetchone()
+    if linha is None:
+        return None, None
+    dados = json.loads(linha[0]) if linha[0] else None
+    return dados, _linha(linha[1:], ["id", "nota", "classificacao", "assistido_em"])
+
+
+# Equivalente para um lote de filmes: devolve (dados, {tmdb_id: filme}), só
+# com os filmes que o usuário avaliou
+def bloquear_para_lote(cursor, usuario_id, tmdb_ids):
+    cursor.execute(SQL_BLOQUEAR_LOTE.format(",".join(["%s"] * len(tmdb_ids))), (usuario_id, *tmdb_ids))
+    linhas = cursor.fetchall()
+    dados = json.loads(linhas[0][0]) if linhas[0][0] else None
+    colunas = ["id", "nota", "classificacao", "assistido_em", "titulo", "ano", "poster_url"]
+    return dados, {linha[1]: _linha(linha[2:], colunas) for linha in linhas if linha[1] is not None}
+
+
+# Trava as estatísticas dos usuários de um lote de gravação em massa (antes
+# das avaliações, como salvar e excluir); devolve {usuario_id: dados}, sem
+# os que ainda não têm estatísticas materializadas
+def bloquear_usuarios(cursor, usuario_ids):
+    usuario_ids = sorted(set(usuario_ids))
+    if not usuario_ids:
+        return {}
+    cursor.execute(SQL_BLOQUEAR_USUARIOS.format(",".join(["%s"] * len(usuario_ids))), tuple(usuario_ids))
+    return {usuario_id: json.loads(dados) for usuario_id, dados in cursor.fetchall()}
+
+
+# Um lote da importação: devolve (dados, {tmdb_id: filme}) com os filmes do
+# lote que o usuário já avaliou
+def bloquear_para_importacao(cursor, usuario_id, tmdb_ids):
+    dados = bloquear_usuarios(cursor, [usuario_id]).get(usuario_id)
+    cursor.execute(SQL_BLOQUEAR_IMPORTACAO.format(",".join(["%s"] * len(tmdb_ids))), (usuario_id, *tmdb_ids))
+    colunas = ["nota", "classificacao", "assistido_em"]
+    return dados, {linha[0]: dict(zip(colunas, linha[1:])) for linha in cursor.fetchall()}
+
+
+# Equivalente de atualizar_varios para as gravações em massa (importação,
+# reclassificação), cujas linhas novas não têm id aqui: os contadores vão por
+# delta e o top é relido do banco, se alguma nota mudou. Assim cada lote sobe
+# a versão junto com as estatísticas certas.
+def atualizar_em_massa(cursor, usuario_id, dados, mudancas, notas_mudaram=True):
+    if dados is None:
+        return gravar(cursor, usuario_id, calcular(cursor, usuario_id))
+    for antigo, novo in mudancas:
+        _contar(dados, antigo, novo)
+    if notas_mudaram:
+        dados["top"] = _carregar_top(cursor, usuario_id)
+    return gravar(cursor, usuario_id, dados)
+
+
+# Chamado na mesma transação da escrita, depois do INSERT/UPDATE/DELETE;
+# devolve a versão nova do usuário
+def atualizar(cursor, usuario_id, dados, antigo=None, novo=None):
+    return atualizar_varios(cursor, usuario_id, dados, [(antigo, novo)])
+
+
+# Várias mudanças [(antigo, novo)] da mesma transação, com uma gravação só
+def atualizar_varios(cursor, usuario_id, dados, mudancas):
+    if dados is None:
+        return gravar(cursor, usuario_id, calcular(cursor, usuario_id))
+    recarregar = False
+    for antigo, novo in mudancas:
+        recarregar = aplicar_delta(dados, antigo, novo) or recarregar
+    if recarregar:
+        dados["top"] = _carregar_top(cursor, usuario_id)
+    return gravar(cursor, usuario_id, dados)
+
+
+# Versão atual das avaliações do usuário (0 se ele nunca gravou): uma
+# consulta pela chave primária
+def versao(usuario_id):
+    with transacao() as cursor:
+        cursor.execute(SQL_VERSAO, (usuario_id,))
+        linha = cursor.fetchone()
+    return linha[0] if linha else 0
+
+
+# Leitura do painel: uma consulta por chave primária. Sem estatísticas
+# materializadas, calcula e grava numa transação de escrita.
+def ler(usuario_id):
+    with transacao() as cursor:
+        cursor.execute(SQL_LER, (usuario_id,))
+        linha = cursor.fetchone()
+        if linha is not None:
+            return json.loads(linha[0])
+    with transacao(escrita=True) as cursor:
+        return reconstruir(cursor, usuario_id, sobrescrever=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estatísticas materializadas por usuário")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    rec = sub.add_parser("reconstruir", help="recalcula as estatísticas a partir da tabela filmes")
+    rec.add_argument("--usuario", type=int, help="apenas este usuário (padrão: todos)")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+
+    with transacao() as cursor:
+        if args.usuario is not None:
+            usuarios = [args.usuario]
+        else:
+            cursor.execute("SELECT DISTINCT usuario_id FROM filmes")
+            usuarios = [r[0] for r in cursor.fetchall()]
+    for usuario_id in usuarios:
+        with transacao(escrita=True) as cursor:
+            dados = reconstruir(cursor, usuario_id)
+        print(f"usuário {usuario_id}: {dados['total']} filmes", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import json
+import time
+import logging
+import threading
+import traceback
+
+from classificador import rastreamento
+from classificador.cache import abrir_sqlite
+
+
+# Fila de gravação (write-behind) num diário SQLite local. Salvar e excluir
+# entram no diário e voltam na hora; uma thread grava no MySQL em lotes, uma
+# transação por lote. Há no máximo uma entrada por (usuario_id, tmdb_id):
+# editar de novo um filme que ainda não foi gravado só troca a entrada (fica
+# a última operação) e sobe a versão, para que uma gravação já em andamento
+# não apague a edição nova ao terminar.
+#
+# O diário sobrevive a quedas: o que ficar pendente é gravado pela próxima
+# fila aberta no mesmo arquivo, de qualquer processo do host. Cada lote é
+# reservado por um prazo (reservado_ate), para que dois processos não gravem
+# as mesmas entradas ao mesmo tempo; uma edição nova de uma entrada reservada
+# espera a reserva acabar. Falhas voltam para a fila com espera crescente
+# (proxima_em).
+
+SQL_CRIAR = """
+    CREATE TABLE IF NOT EXISTS pendentes (
+        usuario_id INTEGER NOT NULL,
+        tmdb_id INTEGER NOT NULL,
+        operacao TEXT NOT NULL,
+        dados TEXT NOT NULL,
+        versao INTEGER NOT NULL DEFAULT 1,
+        criado_em REAL NOT NULL,
+        reservado_ate REAL NOT NULL DEFAULT 0,
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        proxima_em REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (usuario_id, tmdb_id)
+    )
+"""
+
+# A entrada mantém o lugar na fila (criado_em) e a reserva, se estiver sendo
+# gravada, e deixa de esperar por falhas anteriores
+SQL_ENFILEIRAR = """
+    INSERT INTO pendentes (usuario_id, tmdb_id, operacao, dados, criado_em) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (usuario_id, tmdb_id) DO UPDATE SET
+        operacao = excluded.operacao,
+        dados = excluded.dados,
+        versao = pendentes.versao + 1,
+        tentativas = 0,
+        proxima_em = 0
+"""
+
+PRAZO_RESERVA = 60.0
+ESPERA_MAXIMA = 300.0
+
+
+class FilaOcupada(Exception):
+    pass
+
+
+class FilaGravacao:
+    # gravar_lote recebe [(usuario_id, tmdb_id, operacao, dados)] e grava
+    # tudo numa transação; se levantar exceção, nada do lote foi gravado
+    def __init__(self, arquivo, gravar_lote, lote=100, espera=0.2):
+        self.arquivo = arquivo
+        self.gravar_lote = gravar_lote
+        self.lote = lote
+        self.espera = espera
+        self._local = threading.local()
+        self._evento = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._parar = False
+        db = self._db()
+        db.execute(SQL_CRIAR)
+        # Diários de antes da espera separada da reserva
+        if "proxima_em" not in {c[1] for c in db.execute("PRAGMA table_info(pendentes)")}:
+            db.execute("ALTER TABLE pendentes ADD COLUMN proxima_em REAL NOT NULL DEFAULT 0")
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = abrir_sqlite(self.arquivo)
+            self._local.conn = conn
+        return conn
+
+    def enfileirar(self, usuario_id, tmdb_id, operacao, dados):
+        self._db().execute(SQL_ENFILEIRAR, (usuario_id, tmdb_id, operacao, json.dumps(dados, ensure_ascii=False), time.time()))
+        rastreamento.contar("fila_enfileiradas")
+        self.iniciar()
+        self._evento.set()
+
+    # {tmdb_id: (operacao, dados)} ainda não gravados, para as leituras do
+    # usuário enxergarem as próprias gravações
+    def pendentes(self, usuario_id):
+        linhas = self._db().execute(
+            "SELECT tmdb_id, operacao, dados FROM pendentes WHERE usuario_id = ?", (usuario_id,)
+        ).fetchall()
+        return {tmdb_id: (operacao, json.loads(dados)) for tmdb_id, operacao, dados in linhas}
+
+    def quantidade(self):
+        return self._db().execute("SELECT COUNT(*) FROM pendentes").fetchone()[0]
+
+    # Entradas livres, na ordem da fila; só as do usuário, se ele for dado,
+    # e então também as que esperam por falhas anteriores
+    def _reservar(self, usuario_id=None):
+        db = self._db()
+        agora = time.time()
+        if usuario_id is None:
+            condicao, parametros = "reservado_ate <= ? AND proxima_em <= ?", (agora, agora)
+        else:
+            condicao, parametros = "usuario_id = ? AND reservado_ate <= ?", (usuario_id, agora)
+        # Sem nada livre, nem pega a trava de escrita
+        if db.execute(f"SELECT 1 FROM pendentes WHERE {condicao} LIMIT 1", parametros).fetchone() is None:
+            return []
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            linhas = db.execute(
+                "SELECT usuario_id, tmdb_id, operacao, dados, versao FROM pendentes "
+                f"WHERE {condicao} ORDER BY criado_em LIMIT ?",
+                (*parametros, self.lote),
+            ).fetchall()
+            db.executemany(
+                "UPDATE pendentes SET reservado_ate = ? WHERE usuario_id = ? AND tmdb_id = ?",
+                [(agora + PRAZO_RESERVA, l[0], l[1]) for l in linhas],
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return [(u, t, operacao, json.loads(dados), versao) for u, t, operacao, dados, versao in linhas]
+
+    # Só sai do diário a versão que foi gravada; uma edição que chegou
+    # durante a gravação fica livre para a próxima
+    def _concluir(self, entradas):
+        db = self._db()
+        db.execute("BEGIN")
+        db.executemany(
+            "DELETE FROM pendentes WHERE usuario_id = ? AND tmdb_id = ? AND versao = ?",
+            [(u, t, versao) for u, t, _, _, versao in entradas],
+        )
+        self._liberar(db, entradas)
+        db.execute("COMMIT")
+
+    def _adiar(self, entradas):
+        db = self._db()
+        agora = time.time()
+        db.execute("BEGIN")
+        db.executemany(
+            "UPDATE pendentes SET tentativas = tentativas + 1, reservado_ate = 0, "
+            "proxima_em = ? + MIN(?, 1 << MIN(tentativas, 16)) WHERE usuario_id = ? AND tmdb_id = ? AND versao = ?",
+            [(agora, ESPERA_MAXIMA, u, t, versao) for u, t, _, _, versao in entradas],
+        )
+        self._liberar(db, entradas)
+        db.execute("COMMIT")
+
+    def _liberar(self, db, entradas):
+        db.executemany(
+            "UPDATE pendentes SET reservado_ate = 0 WHERE usuario_id = ? AND tmdb_id = ? AND versao <> ?",
+            [(u, t, versao) for u, t, _, _, versao in entradas],
+        )
+
+    def _gravar(self, entradas):
+        try:
+            with rastreamento.trecho("fila", "gravar_lote"):
+                self.gravar_lote([e[:4] for e in entradas])
+        except Exception:
+            erro = traceback.format_exc()
+        else:
+            self._concluir(entradas)
+            rastreamento.contar("fila_gravadas", len(entradas))
+            return len(entradas)
+
+        if len(entradas) == 1:
+            logging.error("Erro ao gravar a fila (usuário %s, filme %s):\n%s", entradas[0][0], entradas[0][1], erro)
+            rastreamento.contar("fila_falhas")
+            self._adiar(entradas)
+            return 0
+        # Uma entrada ruim não segura as outras: grava uma a uma, mas se as
+        # primeiras também falharem o problema é o banco e o resto espera
+        gravadas = falhas = 0
+        for i, entrada in enumerate(entradas):
+            if falhas >= 3 and not gravadas:
+                self._adiar(entradas[i:])
+                break
+            n = self._gravar([entrada])
+            gravadas += n
+            falhas += 1 - n
+        return gravadas
+
+    # Grava tudo o que estiver livre no diário; devolve quantas entradas
+    def esvaziar(self):
+        total = 0
+        while True:
+            entradas = self._reservar()
+            if not entradas:
+                return total
+            total += self._gravar(entradas)
+
+    # Grava já as entradas do usuário, inclusive as que esperam por falhas, e
+    # espera as que outra thread ou processo está gravando; levanta
+    # FilaOcupada se alguma falhar ou se o prazo acabar antes
+    def esvaziar_usuario(self, usuario_id, prazo=10.0):
+        limite = time.monotonic() + prazo
+        db = self._db()
+        while db.execute("SELECT 1 FROM pendentes WHERE usuario_id = ? LIMIT 1", (usuario_id,)).fetchone():
+            entradas = self._reservar(usuario_id)
+            if entradas:
+                if self._gravar(entradas) < len(entradas):
+                    raise FilaOcupada(f"Falha ao gravar as gravações pendentes do usuário {usuario_id}.")
+                continue
+            if time.monotonic() >= limite:
+                raise FilaOcupada(f"Gravações do usuário {usuario_id} ainda na fila após {prazo:.1f}s.")
+            time.sleep(0.05)
+
+    def _trabalhar(self):
+        while not self._parar:
+            # Acorda a cada gravação nova, e de tempos em tempos para as
+            # entradas adiadas ou deixadas por outro processo
+            self._evento.wait(5.0)
+            self._evento.clear()
+            if self._parar:
+                return
+            # Janela curta para juntar edições seguidas no mesmo lote
+            time.sleep(self.espera)
+            try:
+                self.esvaziar()
+            except Exception:
+                logging.error("Erro na fila de gravação:\n%s", traceback.format_exc())
+
+    def iniciar(self):
+        with self._lock:
+            if self._thread is None and not self._parar:
+                self._thread = threading.Thread(target=self._trabalhar, name="fila-gravacao", daemon=True)
+                self._thread.start()
+
+    # Para a thread e grava o que ainda estiver na fila (no fim do processo)
+    def parar(self, prazo=30.0):
+        with self._lock:
+            self._parar = True
+            thread = self._thread
+        self._evento.set()
+        if thread is not None:
+            thread.join(prazo)
+        try:
+            gravadas = self.esvaziar()
+            if gravadas:
+                logging.info("Fila de gravação: %s entradas gravadas ao encerrar.", gravadas)
+        except Exception:
+            logging.error("Erro ao esvaziar a fila ao encerrar:\n%s", traceback.format_exc())
+        restantes = self.quantidade()
+        if restantes:
+            logging.warning("Fila de gravação: %s entradas continuam em %s.", restantes, self.arquivo)
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+
+from classificador.banco import transacao
+
+
+# Título, ano e pôster vêm do catálogo, pela chave primária (eq_ref)
+COLUNAS = "f.id, f.tmdb_id, c.titulo, c.ano, f.assistido_em, f.nota, f.classificacao, c.poster_url"
+ORDEM = " ORDER BY f.assistido_em DESC, f.nota DESC, f.id DESC"
+
+
+# Grava ou atualiza a avaliação numa única instrução, apoiada na chave única
+# (usuario_id, tmdb_id). O filme precisa estar no catálogo antes
+# (catalogo.SQL_GRAVAR). Uma versão por motor; use salvar(), que devolve o id.
+SQL_SALVAR = {
+    # LAST_INSERT_ID(id) faz lastrowid devolver o id também quando a linha
+    # já existia
+    "mysql": """
+        INSERT INTO filmes (usuario_id, tmdb_id, assistido_em, nota, classificacao)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            id = LAST_INSERT_ID(id),
+            assistido_em = VALUES(assistido_em),
+            nota = VALUES(nota),
+            classificacao = VALUES(classificacao)
+    """,
+    # Sem RETURNING: o executemany das importações não aceita instruções que
+    # devolvem linhas
+    "sqlite": """
+        INSERT INTO filmes (usuario_id, tmdb_id, assistido_em, nota, classificacao)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (usuario_id, tmdb_id) DO UPDATE SET
+            assistido_em = excluded.assistido_em,
+            nota = excluded.nota,
+            classificacao = excluded.classificacao
+    """,
+}
+
+# Edição de uma avaliação existente, pelo id (edição em lote)
+SQL_EDITAR = "UPDATE filmes SET assistido_em = %s, nota = %s, classificacao = %s WHERE id = %s"
+
+
+# Devolve o id da avaliação, nova ou já existente. No SQLite o lastrowid não
+# muda quando o upsert cai no UPDATE; o id vem do RETURNING.
+def salvar(cursor, usuario_id, tmdb_id, assistido_em, nota, classificacao):
+    params = (usuario_id, tmdb_id, assistido_em, nota, classificacao)
+    if cursor.motor == "sqlite":
+        cursor.execute(SQL_SALVAR["sqlite"] + " RETURNING id", params)
+        return cursor.fetchone()[0]
+    cursor.execute(SQL_SALVAR["mysql"], params)
+    return cursor.lastrowid
+
+
+def normalizar_filtros(ano_filtro, classificacoes, nota_min, nota_max):
+    return (ano_filtro, tuple(sorted(classificacoes)), float(nota_min), float(nota_max))
+
+
+# Condição de continuação da paginação por chave (assistido_em, nota, id),
+# na mesma ordem do ORDER BY. No MySQL e no SQLite os NULL de assistido_em vêm
+# por último.
+def _depois_de(apos):
+    assistido_em, nota, filme_id = apos
+    empate_nota = "(f.nota < %s OR (f.nota = %s AND f.id < %s))"
+    if assistido_em is None:
+        return f" AND f.assistido_em IS NULL AND {empate_nota}", [nota, nota, filme_id]
+    return (
+        f" AND (f.assistido_em < %s OR f.assistido_em IS NULL OR (f.assistido_em = %s AND {empate_nota}))",
+        [assistido_em, assistido_em, nota, nota, filme_id],
+    )
+
+
+def montar_consulta(usuario_id, filtros, tamanho, apos=None):
+    ano_filtro, classificacoes, nota_min, nota_max = filtros
+    query = f"SELECT {COLUNAS} FROM filmes f JOIN catalogo c ON c.tmdb_id = f.tmdb_id WHERE f.usuario_id = %s"
+    params = [usuario_id]
+
+    if ano_filtro != "Todos":
+        query += " AND f.assistido_em = %s"
+        params.append(ano_filtro)
+    if classificacoes:
+        placeholders = ','.join(['%s'] * len(classificacoes))
+        query += f" AND f.classificacao IN ({placeholders})"
+        params.extend(classificacoes)
+    query += " AND f.nota BETWEEN %s AND %s"
+    params.extend([nota_min, nota_max])
+    if apos is not None:
+        condicao, valores = _depois_de(apos)
+        query += condicao
+        params.extend(valores)
+    query += ORDEM + " LIMIT %s"
+    params.append(tamanho + 1)
+    return query, tuple(params)
+
+
+# Devolve (linhas, chave_da_proxima_pagina); a chave é None na última página
+def buscar_pagina(usuario_id, filtros, tamanho, apos=None):
+    query, params = montar_consulta(usuario_id, filtros, tamanho, apos)
+    with transacao(dictionary=True) as cursor:
+        cursor.execute(query, params)
+        linhas = cursor.fetchall()
+
+    if len(linhas) > tamanho:
+        ultima = linhas[tamanho - 1]
+        return linhas[:tamanho], (ultima['assistido_em'], ultima['nota'], ultima['id'])
+    return linhas, None
+
+
+# Id provisória dos filmes salvos que ainda estão na fila de gravação: ficam
+# à frente dos empates, como os mais novos
+ID_PENDENTE = 2 ** 62
+
+
+# Posição na ordem da lista como tupla crescente (assistido_em DESC com os
+# NULL por último, nota DESC, id DESC)
+def _posicao(assistido_em, nota, filme_id):
+    return (assistido_em is None, -(assistido_em or 0), -float(nota), -filme_id)
+
+
+def _passa(filtros, linha):
+    ano_filtro, classificacoes, nota_min, nota_max = filtros
+    return ((ano_filtro == "Todos" or linha["assistido_em"] == ano_filtro)
+            and (not classificacoes or linha["classificacao"] in classificacoes)
+            and nota_min <= float(linha["nota"]) <= nota_max)
+
+
+# Aplica numa página do banco as gravações ainda na fila (linhas no formato
+# de COLUNAS, por tmdb_id; None para exclusão): os filmes com gravação
+# pendente saem e voltam com os valores novos se caírem no trecho da ordem
+# coberto por esta página, entre a chave `apos` e a `proxima`
+def sobrepor_pendentes(linhas, apos, proxima, filtros, pendentes):
+    if not pendentes:
+        return linhas
+    inicio = _posicao(*apos) if apos is not None else None
+    fim = _posicao(*proxima) if proxima is not None else None
+    resultado = [l for l in linhas if l["tmdb_id"] not in pendentes]
+    for linha in pendentes.values():
+        if linha is None or not _passa(filtros, linha):
+            continue
+        posicao = _posicao(linha["assistido_em"], linha["nota"], linha["id"])
+        if (inicio is None or posicao > inicio) and (fim is None or posicao <= fim):
+            resultado.append(linha)
+    resultado.sort(key=lambda l: _posicao(l["assistido_em"], l["nota"], l["id"]))
+    return resultado
+
+
+SQL_ANOS = "SELECT DISTINCT assistido_em FROM filmes WHERE usuario_id = %s ORDER BY assistido_em DESC"
+
+
+def buscar_anos(usuario_id):
+    with transacao(dictionary=True) as cursor:
+        cursor.execute(SQL_ANOS, (usuario_id,))
+        return [row['assistido_em'] for row in cursor.fetchall() if row['assistido_em']]
+
+
+# Páginas já carregadas na sessão, por (filtros, tamanho, chave); mexer num
+# slider de volta para um valor anterior não vai ao banco. salvar_filme e
+# excluir_filme chamam limpar().
+class CachePaginas:
+    def __init__(self, usuario_id, max_paginas=64):
+        self.usuario_id = usuario_id
+        self.max_paginas = max_paginas
+        self._paginas = OrderedDict()
+        self._anos = None
+
+    def anos(self):
+        if self._anos is None:
+            self._anos = buscar_anos(self.usuario_id)
+        return self._anos
+
+    def pagina(self, filtros, tamanho, apos=None):
+        chave = (filtros, tamanho, apos)
+        if chave in self._paginas:
+            self._paginas.move_to_end(chave)
+            return self._paginas[chave]
+        resultado = buscar_pagina(self.usuario_id, filtros, tamanho, apos)
+        self._paginas[chave] = resultado
+        while len(self._paginas) > self.max_paginas:
+            self._paginas.popitem(last=False)
+        return resultado
+
+    def limpar(self):
+        self._paginas.clear()
+        self._anos = None
@@ -0,0 +1,318 @@
+import os
+import sys
+import csv
+import json
+import math
+import argparse
+import logging
+from itertools import islice
+
+from classificador.banco import transacao
+from classificador import tmdb, estatisticas, catalogo
+from classificador.classificacao import classificar_filme
+from classificador.filmes_salvos import SQL_SALVAR, montar_consulta, normalizar_filtros
+
+
+# Importação e exportação em massa das avaliações de um usuário.
+#
+#   python -m classificador.importacao importar --usuario 3 --formato letterboxd ratings.csv
+#   python -m classificador.importacao exportar --usuario 3 --formato csv -o filmes.csv
+#   python -m classificador.importacao resolver
+#
+# A importação lê o arquivo em fluxo, casa os títulos com a TMDb em paralelo
+# (passando pelo cache de buscas), grava cada lote com executemany e um commit
+# por lote, e anota o progresso em <arquivo>.progresso para poder continuar de
+# onde parou se for interrompida. Arquivos exportados pelo app trazem a id da
+# TMDb e não passam pela busca.
+
+FORMATOS = ["csv", "letterboxd", "json"]
+COLUNAS_EXPORTACAO = ["tmdb_id", "titulo", "ano", "assistido_em", "nota", "classificacao", "poster_url"]
+
+
+def _int(valor):
+    try:
+        return int(str(valor).strip()[:4]) if valor not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def _id(valor):
+    try:
+        return int(valor) if valor not in (None, "") else None
+    except ValueError:
+        return None
+
+
+# Nota do arquivo, ou None se vazia, ausente ou inválida
+def _nota(valor):
+    try:
+        nota = float(valor)
+    except (TypeError, ValueError):
+        return None
+    return nota if math.isfinite(nota) else None
+
+
+# Cada leitor produz dicts com titulo, ano, nota e assistido_em (e, nos
+# arquivos exportados pelo app, tmdb_id e poster_url), ou None no lugar de um
+# registro inválido: ele conta no progresso, para continuar no mesmo ponto
+def ler_csv(arquivo):
+    for linha in csv.DictReader(arquivo):
+        nota = _nota(linha.get("nota"))
+        if nota is None:
+            yield None
+            continue
+        yield {
+            "titulo": (linha.get("titulo") or "").strip(),
+            "ano": _int(linha.get("ano")),
+            "nota": nota,
+            "assistido_em": _int(linha.get("assistido_em")),
+            "tmdb_id": _id(linha.get("tmdb_id")),
+            "poster_url": linha.get("poster_url") or "",
+        }
+
+
+# ratings.csv / diary.csv do Letterboxd: notas de 0,5 a 5 estrelas
+def ler_letterboxd(arquivo):
+    for linha in csv.DictReader(arquivo):
+        if not linha.get("Rating"):
+            continue
+        nota = _nota(linha["Rating"])
+        if nota is None:
+            yield None
+            continue
+        yield {
+            "titulo": (linha.get("Name") or "").strip(),
+            "ano": _int(linha.get("Year")),
+            "nota": nota * 2,
+            "assistido_em": _int(linha.get("Watched Date") or linha.get("Date")),
+        }
+
+
+# JSON Lines (um objeto por linha), para não carregar o arquivo inteiro
+def ler_json(arquivo):
+    for texto in arquivo:
+        if not texto.strip():
+            continue
+        try:
+            obj = json.loads(texto)
+        except ValueError:
+            obj = None
+        nota = _nota(obj.get("nota")) if isinstance(obj, dict) else None
+        if nota is None:
+            yield None
+            continue
+        yield {
+            "titulo": (obj.get("titulo") or "").strip(),
+            "ano": _int(obj.get("ano")),
+            "nota": nota,
+            "assistido_em": _int(obj.get("assistido_em")),
+            "tmdb_id": _id(obj.get("tmdb_id")),
+            "poster_url": obj.get("poster_url") or "",
+        }
+
+
+LEITORES = {"csv": ler_csv, "letterboxd": ler_letterboxd, "json": ler_json}
+
+
+# Escolhe o resultado da TMDb do mesmo ano; sem ano, o primeiro (mais relevante)
+def casar(registro, resultados):
+    if isinstance(resultados, Exception) or not resultados:
+        return None
+    for filme in resultados:
+        if registro["ano"] and (filme.get("release_date") or "")[:4] == str(registro["ano"]):
+            return filme
+    return None if registro["ano"] else resultados[0]
+
+
+# Devolve os filmes do catálogo e as avaliações do lote. Sem correspondência
+# na TMDb, o filme entra no catálogo com id local.
+def preparar_lote(registros, usuario_id, usar_tmdb, idioma):
+    resultados = [None] * len(registros)
+    if usar_tmdb:
+        cliente = tmdb.obter_cliente()
+        indices = [i for i, r in enumerate(registros) if not r.get("tmdb_id")]
+        achados = cliente.em_lote([(tmdb.buscar_filmes, registros[i]["titulo"], idioma) for i in indices])
+        for i, resultado in zip(indices, achados):
+            resultados[i] = resultado
+    filmes = {}
+    linhas = []
+    sem_correspondencia = 0
+    for registro, achados in zip(registros, resultados):
+        filme = casar(registro, achados)
+        if registro.get("tmdb_id"):
+            tmdb_id, titulo, ano, poster_url = registro["tmdb_id"], registro["titulo"], registro["ano"], registro["poster_url"]
+        elif filme is not None:
+            tmdb_id = int(filme["id"])
+            titulo = filme.get("title") or registro["titulo"]
+            ano = _int(filme.get("release_date")) or registro["ano"]
+            poster_url = tmdb.url_poster(filme.get("poster_path"))
+        else:
+            sem_correspondencia += 1
+            titulo, ano, poster_url = registro["titulo"], registro["ano"], ""
+            tmdb_id = catalogo.id_local(titulo, ano)
+        filmes[tmdb_id] = (tmdb_id, titulo, ano, poster_url)
+        nota = max(0.0, min(10.0, registro["nota"]))
+        linhas.append((usuario_id, tmdb_id, registro["assistido_em"], nota, classificar_filme(nota)))
+    # Ordem fixa das linhas do catálogo: importações simultâneas travam as
+    # mesmas linhas na mesma ordem
+    return [filmes[k] for k in sorted(filmes)], linhas, sem_correspondencia
+
+
+def _ler_progresso(caminho):
+    try:
+        with open(caminho, encoding="utf-8") as f:
+            return json.load(f).get("registros", 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def _gravar_progresso(caminho, registros):
+    temporario = caminho + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump({"registros": registros}, f)
+    os.replace(temporario, caminho)
+
+
+def importar(caminho, usuario_id, formato, lote=500, usar_tmdb=True, idioma="pt-BR", recomecar=False):
+    arquivo_progresso = caminho + ".progresso"
+    feitos = 0 if recomecar else _ler_progresso(arquivo_progresso)
+    if feitos:
+        print(f"continuando após {feitos} registros já importados", file=sys.stderr)
+
+    total_sem_correspondencia = invalidos = 0
+    with open(caminho, encoding="utf-8-sig", newline="") as arquivo:
+        registros = islice(LEITORES[formato](arquivo), feitos, None)
+        while True:
+            lidos = list(islice(registros, lote))
+            if not lidos:
+                break
+            bloco = [r for r in lidos if r is not None and r["titulo"]]
+            invalidos += sum(1 for r in lidos if r is None)
+            filmes, linhas, sem_correspondencia = preparar_lote(bloco, usuario_id, usar_tmdb, idioma)
+            if linhas:
+                # As estatísticas e a versão do usuário mudam no mesmo commit
+                # do lote: os outros processos nunca veem um sem o outro
+                with transacao() as cursor:
+                    dados, antigos = estatisticas.bloquear_para_importacao(cursor, usuario_id, sorted({l[1] for l in linhas}))
+                    catalogo.gravar(cursor, filmes)
+                    cursor.executemany(SQL_SALVAR[cursor.motor], linhas)
+                    # Filme repetido no arquivo: fica a última linha, como no banco
+                    novos = {l[1]: {"assistido_em": l[2], "nota": l[3], "classificacao": l[4]} for l in linhas}
+                    estatisticas.atualizar_em_massa(cursor, usuario_id, dados,
+                                                    [(antigos.get(tmdb_id), novo) for tmdb_id, novo in novos.items()])
+            feitos += len(lidos)
+            total_sem_correspondencia += sem_correspondencia
+            _gravar_progresso(arquivo_progresso, feitos)
+            print(f"{feitos} registros importados", file=sys.stderr)
+
+    if os.path.exists(arquivo_progresso):
+        os.remove(arquivo_progresso)
+    if total_sem_correspondencia:
+        logging.warning("%s títulos sem correspondência na TMDb foram importados como estavam.", total_sem_correspondencia)
+    if invalidos:
+        logging.warning("%s registros com nota vazia ou inválida foram ignorados.", invalidos)
+    return feitos
+
+
+# Percorre os filmes do usuário em páginas pela mesma chave da lista de
+# salvos, sem nunca carregar a tabela inteira
+def iterar_filmes(usuario_id, lote=1000):
+    filtros = normalizar_filtros("Todos", [], 0.0, 10.0)
+    apos = None
+    while True:
+        query, params = montar_consulta(usuario_id, filtros, lote, apos)
+        with transacao(dictionary=True) as cursor:
+            cursor.execute(query, params)
+            linhas = cursor.fetchall()
+        yield from linhas[:lote]
+        if len(linhas) <= lote:
+            return
+        ultima = linhas[lote - 1]
+        apos = (ultima["assistido_em"], ultima["nota"], ultima["id"])
+
+
+def exportar(usuario_id, formato, saida):
+    if formato == "json":
+        for filme in iterar_filmes(usuario_id):
+            registro = {c: filme[c] for c in COLUNAS_EXPORTACAO}
+            registro["nota"] = float(registro["nota"])
+            saida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    else:
+        escritor = csv.DictWriter(saida, fieldnames=COLUNAS_EXPORTACAO, extrasaction="ignore")
+        escritor.writeheader()
+        for filme in iterar_filmes(usuario_id):
+            escritor.writerow(filme)
+
+
+# Casa com a TMDb os filmes do catálogo que ainda têm id local (avaliações
+# anteriores ao catálogo, importações sem correspondência) e passa as
+# avaliações para a id da TMDb. Filmes sem ano ficam como estão: o casamento
+# seria um palpite.
+def resolver(lote=200, idioma="pt-BR"):
+    cliente = tmdb.obter_cliente()
+    apos = 0
+    resolvidos = pendentes = 0
+    while True:
+        with transacao() as cursor:
+            cursor.execute(
+                "SELECT tmdb_id, titulo, ano FROM catalogo WHERE tmdb_id < %s ORDER BY tmdb_id DESC LIMIT %s",
+                (apos, lote),
+            )
+            locais = cursor.fetchall()
+        if not locais:
+            break
+        apos = locais[-1][0]
+        locais = [l for l in locais if l[2]]
+        resultados = cliente.em_lote([(tmdb.buscar_filmes, titulo, idioma) for _, titulo, _ in locais])
+        for (antiga, titulo, ano), achados in zip(locais, resultados):
+            filme = casar({"titulo": titulo, "ano": ano}, achados)
+            if filme is None:
+                pendentes += 1
+                continue
+            nova = int(filme["id"])
+            with transacao() as cursor:
+                catalogo.gravar(cursor, [(nova, filme.get("title") or titulo, ano, tmdb.url_poster(filme.get("poster_path")))])
+                for usuario_id in catalogo.mesclar(cursor, antiga, nova):
+                    estatisticas.reconstruir(cursor, usuario_id)
+            resolvidos += 1
+        print(f"{resolvidos} filmes casados com a TMDb, {pendentes} sem correspondência", file=sys.stderr)
+    return resolvidos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importação e exportação de avaliações")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    imp = sub.add_parser("importar")
+    imp.add_argument("arquivo")
+    imp.add_argument("--usuario", type=int, required=True)
+    imp.add_argument("--formato", choices=FORMATOS, default="csv")
+    imp.add_argument("--lote", type=int, default=500, help="registros por transação")
+    imp.add_argument("--sem-tmdb", action="store_true", help="não consulta a TMDb (títulos como estão no arquivo)")
+    imp.add_argument("--recomecar", action="store_true", help="ignora o progresso salvo")
+
+    exp = sub.add_parser("exportar")
+    exp.add_argument("--usuario", type=int, required=True)
+    exp.add_argument("--formato", choices=["csv", "json"], default="csv")
+    exp.add_argument("-o", "--saida", help="arquivo de saída (padrão: stdout)")
+
+    sub.add_parser("resolver", help="casa com a TMDb os filmes do catálogo sem id da TMDb")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+
+    if args.comando == "importar":
+        total = importar(args.arquivo, args.usuario, args.formato, args.lote, not args.sem_tmdb, recomecar=args.recomecar)
+        print(f"importação concluída: {total} registros", file=sys.stderr)
+    elif args.comando == "resolver":
+        resolver()
+    elif args.saida:
+        with open(args.saida, "w", encoding="utf-8", newline="") as saida:
+            exportar(args.usuario, args.formato, saida)
+    else:
+        exportar(args.usuario, args.formato, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import time
+import logging
+import threading
+import traceback
+
+from classificador import rastreamento
+from classificador.cache import abrir_sqlite
+
+
+# Canal de invalidações entre os processos do app no mesmo host, sem broker:
+# um arquivo SQLite compartilhado onde cada gravação de avaliações anota
+# (usuario_id, versao) depois do commit, e uma thread por processo lê o que
+# entrou desde a última leitura e descarta os caches daquele usuário.
+#
+# É só um atalho: a garantia vem da versão por usuário no banco
+# (estatisticas_usuario.versao), que os processos conferem antes de usar os
+# caches (servicos). Com o canal ligado, a gravação de outro processo do host
+# aparece em até `intervalo` segundos em vez de esperar a próxima conferência;
+# processos de outros hosts continuam dependendo só da conferência.
+
+SQL_CRIAR = """
+    CREATE TABLE IF NOT EXISTS invalidacoes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        usuario_id INTEGER NOT NULL,
+        versao INTEGER,
+        origem TEXT NOT NULL,
+        criado_em REAL NOT NULL
+    )
+"""
+
+# Quantas publicações entre as limpezas das anotações antigas
+LIMPAR_A_CADA = 500
+
+
+class CanalInvalidacao:
+    # ao_receber(usuario_id, versao) roda na thread do canal, para cada
+    # anotação de outro processo
+    def __init__(self, arquivo, ao_receber, intervalo=0.2, retencao=3600.0):
+        self.arquivo = arquivo
+        self.ao_receber = ao_receber
+        self.intervalo = intervalo
+        self.retencao = retencao
+        self.origem = f"{os.getpid()}-{id(self):x}"
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._parar = threading.Event()
+        self._publicadas = 0
+        conn = self._db()
+        conn.execute(SQL_CRIAR)
+        # Só o que for publicado daqui em diante: os caches deste processo
+        # ainda estão vazios
+        self._ultimo = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM invalidacoes").fetchone()[0]
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = abrir_sqlite(self.arquivo)
+            self._local.conn = conn
+        return conn
+
+    def publicar(self, usuario_id, versao):
+        agora = time.time()
+        conn = self._db()
+        conn.execute(
+            "INSERT INTO invalidacoes (usuario_id, versao, origem, criado_em) VALUES (?, ?, ?, ?)",
+            (usuario_id, versao, self.origem, agora),
+        )
+        with self._lock:
+            self._publicadas += 1
+            limpar = self._publicadas % LIMPAR_A_CADA == 0
+        if limpar:
+            conn.execute("DELETE FROM invalidacoes WHERE criado_em < ?", (agora - self.retencao,))
+        rastreamento.contar("invalidacoes_publicadas")
+
+    # Lê as anotações novas e chama ao_receber; devolve quantas eram de
+    # outros processos
+    def receber(self):
+        linhas = self._db().execute(
+            "SELECT seq, usuario_id, versao, origem FROM invalidacoes WHERE seq > ? ORDER BY seq", (self._ultimo,)
+        ).fetchall()
+        recebidas = 0
+        for seq, usuario_id, versao, origem in linhas:
+            self._ultimo = seq
+            if origem != self.origem:
+                self.ao_receber(usuario_id, versao)
+                recebidas += 1
+        if recebidas:
+            rastreamento.contar("invalidacoes_recebidas", recebidas)
+        return recebidas
+
+    def _ouvir(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.receber()
+            except Exception:
+                logging.error("Erro no canal de invalidações:\n%s", traceback.format_exc())
+
+    def iniciar(self):
+        with self._lock:
+            if self._thread is None and not self._parar.is_set():
+                self._thread = threading.Thread(target=self._ouvir, name="invalidacao", daemon=True)
+                self._thread.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join(5.0)
@@ -0,0 +1,371 @@
+import sys
+import time
+import argparse
+import logging
+
+from classificador.banco import transacao, motor
+from classificador import estatisticas, filmes_salvos, assistidos, busca_biblioteca, catalogo, recomendacoes
+from classificador.classificacao import rotulos
+
+
+# Migrações versionadas do esquema. Cada passo é idempotente (pode rodar de
+# novo num banco criado à mão ou numa migração interrompida no meio) e a
+# versão aplicada fica registrada em schema_migracoes.
+#
+#   python -m classificador.migracoes             aplica as pendentes
+#   python -m classificador.migracoes status      lista o que já foi aplicado
+#   python -m classificador.migracoes verificar   EXPLAIN das consultas do app
+#
+# Com DB_MOTOR=sqlite não há migrações: o banco embutido é criado direto no
+# esquema final (banco_sqlite.ESQUEMA) na primeira conexão, e o verificar usa
+# o EXPLAIN QUERY PLAN do SQLite.
+
+
+SQL_CONTROLE = """
+    CREATE TABLE IF NOT EXISTS schema_migracoes (
+        versao INT NOT NULL PRIMARY KEY,
+        descricao VARCHAR(255) NOT NULL,
+        aplicada_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def _indice_existe(cursor, tabela, indice):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+        (tabela, indice),
+    )
+    return cursor.fetchone() is not None
+
+
+def _tabela_existe(cursor, tabela):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+        (tabela,),
+    )
+    return cursor.fetchone() is not None
+
+
+def _coluna_existe(cursor, tabela, coluna):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+        (tabela, coluna),
+    )
+    return cursor.fetchone() is not None
+
+
+def _restricao_existe(cursor, tabela, restricao):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.table_constraints "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND constraint_name = %s",
+        (tabela, restricao),
+    )
+    return cursor.fetchone() is not None
+
+
+def _criar_indice(cursor, tabela, indice, definicao):
+    if not _indice_existe(cursor, tabela, indice):
+        cursor.execute(f"ALTER TABLE {tabela} ADD {definicao}")
+
+
+def m001_tabelas(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            email VARCHAR(255) NOT NULL,
+            senha_hash CHAR(64) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS filmes (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            usuario_id INT NOT NULL,
+            titulo VARCHAR(255) NOT NULL,
+            ano SMALLINT NULL,
+            assistido_em SMALLINT NULL,
+            poster_url VARCHAR(512) NOT NULL DEFAULT '',
+            nota DECIMAL(3, 1) NOT NULL,
+            classificacao VARCHAR(20) NOT NULL,
+            CONSTRAINT fk_filmes_usuario FOREIGN KEY (usuario_id) REFERENCES usuarios (id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+
+# Duplicatas criadas pela antiga corrida SELECT + INSERT impediriam a chave
+# única; fica a avaliação mais recente de cada filme
+def m002_chave_unica(cursor):
+    if not _indice_existe(cursor, "filmes", "uk_filmes_usuario_titulo_ano"):
+        cursor.execute("""
+            SELECT DISTINCT f.usuario_id FROM filmes f
+            JOIN filmes g ON g.usuario_id = f.usuario_id AND g.titulo = f.titulo AND g.ano = f.ano AND g.id > f.id
+        """)
+        afetados = [r[0] for r in cursor.fetchall()]
+        if afetados:
+            cursor.execute("""
+                DELETE f FROM filmes f
+                JOIN filmes g ON g.usuario_id = f.usuario_id AND g.titulo = f.titulo AND g.ano = f.ano AND g.id > f.id
+            """)
+            logging.warning("Removidas %s avaliações duplicadas.", cursor.rowcount)
+            if _tabela_existe(cursor, "estatisticas_usuario"):
+                placeholders = ",".join(["%s"] * len(afetados))
+                cursor.execute(f"DELETE FROM estatisticas_usuario WHERE usuario_id IN ({placeholders})", tuple(afetados))
+    _criar_indice(cursor, "filmes", "uk_filmes_usuario_titulo_ano", "UNIQUE KEY uk_filmes_usuario_titulo_ano (usuario_id, titulo, ano)")
+
+
+# Índices das listas: o InnoDB acrescenta o id ao fim de cada índice
+# secundário, então (usuario_id, assistido_em, nota) já entrega a ordem
+# assistido_em, nota, id da paginação e (usuario_id, nota) a do top 5
+def m003_indices(cursor):
+    _criar_indice(cursor, "filmes", "idx_filmes_usuario_assistido", "INDEX idx_filmes_usuario_assistido (usuario_id, assistido_em, nota)")
+    _criar_indice(cursor, "filmes", "idx_filmes_usuario_nota", "INDEX idx_filmes_usuario_nota (usuario_id, nota)")
+    _criar_indice(cursor, "usuarios", "uk_usuarios_email", "UNIQUE KEY uk_usuarios_email (email)")
+
+
+def m004_estatisticas(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS estatisticas_usuario (
+            usuario_id INT NOT NULL PRIMARY KEY,
+            dados JSON NOT NULL,
+            atualizado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+
+# Preenche filmes.tmdb_id das avaliações antigas, em blocos pela chave
+# primária. Sem a id da TMDb, cada (titulo, ano) vira um filme do catálogo
+# com id local (negativa); o INSERT ... ON DUPLICATE KEY UPDATE com
+# executemany vai ao banco num único comando por bloco.
+def _preencher_tmdb_id(cursor, lote=5000):
+    ultimo_id = 0
+    total = 0
+    while True:
+        cursor.execute(
+            "SELECT id, usuario_id, titulo, ano, poster_url, nota, classificacao FROM filmes "
+            "WHERE id > %s AND tmdb_id IS NULL ORDER BY id LIMIT %s",
+            (ultimo_id, lote),
+        )
+        linhas = cursor.fetchall()
+        if not linhas:
+            return total
+        filmes = {}
+        for _, _, titulo, ano, poster_url, _, _ in linhas:
+            tmdb_id = catalogo.id_local(titulo, ano)
+            if tmdb_id not in filmes or not filmes[tmdb_id][3]:
+                filmes[tmdb_id] = (tmdb_id, titulo, ano, poster_url or "")
+        catalogo.gravar(cursor, filmes.values())
+        cursor.executemany(
+            "INSERT INTO filmes (id, usuario_id, titulo, nota, classificacao, tmdb_id) VALUES (%s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE tmdb_id = VALUES(tmdb_id)",
+            [(i, u, t, n, c, catalogo.id_local(t, a)) for i, u, t, a, _, n, c in linhas],
+        )
+        total += len(linhas)
+        ultimo_id = linhas[-1][0]
+        print(f"{total} avaliações ligadas ao catálogo", file=sys.stderr)
+
+
+# Título, ano e pôster saem de filmes para a tabela catalogo, compartilhada
+# pelos usuários; filmes passa a apontar para ela pela id da TMDb
+def m005_catalogo(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS catalogo (
+            tmdb_id BIGINT NOT NULL PRIMARY KEY,
+            titulo VARCHAR(255) NOT NULL,
+            ano SMALLINT NULL,
+            poster_url VARCHAR(512) NOT NULL DEFAULT ''
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    if not _coluna_existe(cursor, "filmes", "tmdb_id"):
+        cursor.execute("ALTER TABLE filmes ADD tmdb_id BIGINT NULL AFTER usuario_id")
+    if _coluna_existe(cursor, "filmes", "titulo"):
+        _preencher_tmdb_id(cursor)
+    cursor.execute(
+        "SELECT is_nullable FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = 'filmes' AND column_name = 'tmdb_id'"
+    )
+    if cursor.fetchone()[0] == "YES":
+        cursor.execute("ALTER TABLE filmes MODIFY tmdb_id BIGINT NOT NULL")
+
+    # Títulos que o MySQL diferenciava mas que caíram na mesma id local: fica
+    # a avaliação mais recente, como em m002
+    if not _indice_existe(cursor, "filmes", "uk_filmes_usuario_tmdb"):
+        cursor.execute("""
+            SELECT DISTINCT f.usuario_id FROM filmes f
+            JOIN filmes g ON g.usuario_id = f.usuario_id AND g.tmdb_id = f.tmdb_id AND g.id > f.id
+        """)
+        afetados = [r[0] for r in cursor.fetchall()]
+        if afetados:
+            cursor.execute("""
+                DELETE f FROM filmes f
+                JOIN filmes g ON g.usuario_id = f.usuario_id AND g.tmdb_id = f.tmdb_id AND g.id > f.id
+            """)
+            logging.warning("Removidas %s avaliações duplicadas.", cursor.rowcount)
+            placeholders = ",".join(["%s"] * len(afetados))
+            cursor.execute(f"DELETE FROM estatisticas_usuario WHERE usuario_id IN ({placeholders})", tuple(afetados))
+    _criar_indice(cursor, "filmes", "uk_filmes_usuario_tmdb", "UNIQUE KEY uk_filmes_usuario_tmdb (usuario_id, tmdb_id)")
+    _criar_indice(cursor, "filmes", "idx_filmes_tmdb", "INDEX idx_filmes_tmdb (tmdb_id)")
+    if not _restricao_existe(cursor, "filmes", "fk_filmes_catalogo"):
+        cursor.execute("ALTER TABLE filmes ADD CONSTRAINT fk_filmes_catalogo FOREIGN KEY (tmdb_id) REFERENCES catalogo (tmdb_id)")
+
+    # A chave antiga sai antes das colunas: sem titulo e ano ela viraria uma
+    # chave única só de usuario_id
+    if _indice_existe(cursor, "filmes", "uk_filmes_usuario_titulo_ano"):
+        cursor.execute("ALTER TABLE filmes DROP INDEX uk_filmes_usuario_titulo_ano")
+    for coluna in ("titulo", "ano", "poster_url"):
+        if _coluna_existe(cursor, "filmes", coluna):
+            cursor.execute(f"ALTER TABLE filmes DROP COLUMN {coluna}")
+
+
+# Quando cada avaliação mudou pela última vez, para o modelo de
+# recomendações ler só as notas novas (recomendacoes atualizar)
+def m006_atualizado_em(cursor):
+    if not _coluna_existe(cursor, "filmes", "atualizado_em"):
+        cursor.execute(
+            "ALTER TABLE filmes ADD atualizado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"
+        )
+    _criar_indice(cursor, "filmes", "idx_filmes_atualizado", "INDEX idx_filmes_atualizado (atualizado_em)")
+
+
+# Versão das avaliações de cada usuário, que sobe a cada gravação: os
+# processos do app conferem por ela se os caches deles ainda valem
+def m007_versao_usuario(cursor):
+    if not _coluna_existe(cursor, "estatisticas_usuario", "versao"):
+        cursor.execute("ALTER TABLE estatisticas_usuario ADD versao BIGINT NOT NULL DEFAULT 0")
+
+
+MIGRACOES = [
+    (1, "tabelas usuarios e filmes", m001_tabelas),
+    (2, "chave única (usuario_id, titulo, ano) em filmes", m002_chave_unica),
+    (3, "índices das listas e do login", m003_indices),
+    (4, "tabela estatisticas_usuario", m004_estatisticas),
+    (5, "tabela catalogo e filmes.tmdb_id", m005_catalogo),
+    (6, "filmes.atualizado_em", m006_atualizado_em),
+    (7, "estatisticas_usuario.versao", m007_versao_usuario),
+]
+
+
+def aplicadas(cursor):
+    cursor.execute(SQL_CONTROLE)
+    cursor.execute("SELECT versao FROM schema_migracoes")
+    return {r[0] for r in cursor.fetchall()}
+
+
+def migrar():
+    if motor() == "sqlite":
+        with transacao() as cursor:
+            cursor.execute("SELECT 1")
+        print("banco SQLite no esquema atual", file=sys.stderr)
+        return
+    with transacao() as cursor:
+        feitas = aplicadas(cursor)
+    for versao, descricao, passo in MIGRACOES:
+        if versao in feitas:
+            continue
+        # DDL no MySQL faz commit implícito; por isso cada passo é idempotente
+        with transacao() as cursor:
+            passo(cursor)
+            cursor.execute("INSERT INTO schema_migracoes (versao, descricao) VALUES (%s, %s)", (versao, descricao))
+        print(f"aplicada {versao:03d}: {descricao}", file=sys.stderr)
+
+
+def status():
+    if motor() == "sqlite":
+        print("SQLite: esquema criado na primeira conexão, sem migrações")
+        return
+    with transacao() as cursor:
+        feitas = aplicadas(cursor)
+    for versao, descricao, _ in MIGRACOES:
+        print(f"[{'x' if versao in feitas else ' '}] {versao:03d} {descricao}")
+
+
+# Consultas do app com parâmetros de exemplo, para o EXPLAIN
+def consultas_do_app(usuario_id, nome_motor="mysql"):
+    filtros = filmes_salvos.normalizar_filtros("Todos", rotulos(), 0.0, 10.0)
+    return [
+        ("login", "SELECT id, senha_hash FROM usuarios WHERE email = %s", ("x@exemplo.com",)),
+        ("assistidos", assistidos.SQL_ASSISTIDOS, (usuario_id,)),
+        ("biblioteca", busca_biblioteca.SQL_BIBLIOTECA, (usuario_id,)),
+        ("anos", filmes_salvos.SQL_ANOS, (usuario_id,)),
+        ("lista", *filmes_salvos.montar_consulta(usuario_id, filtros, 25)),
+        ("lista_ano", *filmes_salvos.montar_consulta(usuario_id, filmes_salvos.normalizar_filtros(2024, ["Bom"], 5.0, 9.0), 25)),
+        ("lista_pagina_2", *filmes_salvos.montar_consulta(usuario_id, filtros, 25, (2024, 7.0, 10 ** 9))),
+        ("salvar", filmes_salvos.SQL_SALVAR[nome_motor], (usuario_id, 603, 2024, 7.0, "Bom")),
+        ("catalogo", catalogo.SQL_GRAVAR[nome_motor], (603, "x", 1999, "")),
+        ("excluir", "DELETE FROM filmes WHERE id = %s AND usuario_id = %s", (1, usuario_id)),
+        ("estatisticas", estatisticas.SQL_LER, (usuario_id,)),
+        ("versao", estatisticas.SQL_VERSAO, (usuario_id,)),
+        ("estatisticas_top", estatisticas.SQL_TOP, (usuario_id, estatisticas.TOP_RESERVA)),
+        ("estatisticas_calcular", estatisticas.SQL_CALCULAR, (usuario_id,)),
+        ("bloquear_salvar", estatisticas.SQL_BLOQUEAR_SALVAR.replace("FOR UPDATE", ""), (usuario_id, 603)),
+        ("bloquear_excluir", estatisticas.SQL_BLOQUEAR_EXCLUIR.replace("FOR UPDATE", ""), (usuario_id, 603)),
+        ("recomendacoes_notas", recomendacoes.SQL_NOTAS, (usuario_id,)),
+        ("recomendacoes_alteradas", recomendacoes.SQL_ALTERADAS[nome_motor], (int(time.time()) - 3600,)),
+    ]
+
+
+# No SQLite, "SCAN tabela" é a varredura completa; "SCAN x" de uma subconsulta
+# (CO-ROUTINE x) percorre só o resultado dela
+def _verificar_sqlite(cursor, nome, sql, params):
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    planos = [p["detail"] for p in cursor.fetchall()]
+    subconsultas = {d.split()[1] for d in planos if d.startswith("CO-ROUTINE ")}
+    problemas = []
+    for detalhe in planos:
+        partes = detalhe.split()
+        situacao = "OK"
+        if partes[0] == "SCAN" and partes[1] not in subconsultas and partes[1:3] != ["CONSTANT", "ROW"]:
+            situacao = "VARREDURA COMPLETA"
+            problemas.append((nome, partes[1]))
+        print(f"{nome:24} {detalhe:80} {situacao}")
+    return problemas
+
+
+# Falha se alguma consulta do app varrer uma tabela inteira (type = ALL).
+# Rode num banco com dados: em tabelas quase vazias o otimizador pode preferir
+# a varredura mesmo com índice.
+def verificar(usuario_id=None):
+    problemas = []
+    with transacao(dictionary=True) as cursor:
+        if usuario_id is None:
+            cursor.execute("SELECT usuario_id FROM filmes GROUP BY usuario_id ORDER BY COUNT(*) DESC LIMIT 1")
+            linha = cursor.fetchone()
+            usuario_id = linha["usuario_id"] if linha else 1
+        for nome, sql, params in consultas_do_app(usuario_id, cursor.motor):
+            if cursor.motor == "sqlite":
+                problemas.extend(_verificar_sqlite(cursor, nome, sql, params))
+                continue
+            cursor.execute("EXPLAIN " + sql, params)
+            for plano in cursor.fetchall():
+                tabela = plano.get("table") or ""
+                situacao = "OK"
+                # EXPLAIN INSERT sempre mostra type=ALL na tabela de destino
+                varre = plano.get("type") == "ALL" and plano.get("select_type") not in ("INSERT", "REPLACE")
+                if varre and not tabela.startswith("<"):
+                    situacao = "VARREDURA COMPLETA"
+                    problemas.append((nome, tabela))
+                print(f"{nome:24} {tabela:22} type={plano.get('type')!s:8} key={plano.get('key')!s:32} {situacao}")
+    if problemas:
+        print(f"\n{len(problemas)} consulta(s) com varredura completa: {problemas}", file=sys.stderr)
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrações do banco do classificador")
+    parser.add_argument("comando", nargs="?", default="migrar", choices=["migrar", "status", "verificar"])
+    parser.add_argument("--usuario", type=int, help="usuário usado nos EXPLAIN (padrão: o com mais filmes)")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+
+    if args.comando == "migrar":
+        migrar()
+    elif args.comando == "status":
+        status()
+    elif not verificar(args.usuario):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import io
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from classificador import rastreamento
+from classificador.cache import diretorio_cache, abrir_sqlite
+
+try:
+    from PIL import Image
+except ImportError:  # sem Pillow os pôsteres são guardados sem redimensionar
+    Image = None
+
+
+SQL_CRIAR = [
+    """
+    CREATE TABLE IF NOT EXISTS posters (
+        url TEXT PRIMARY KEY,
+        hash TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS miniaturas (
+        hash TEXT NOT NULL,
+        largura INTEGER NOT NULL,
+        tamanho INTEGER NOT NULL,
+        acessado_em REAL NOT NULL,
+        PRIMARY KEY (hash, largura)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_miniaturas_acesso ON miniaturas (acessado_em)",
+]
+
+
+def redimensionar(dados, largura):
+    if Image is None:
+        return dados
+    imagem = Image.open(io.BytesIO(dados))
+    if imagem.width > largura:
+        altura = round(imagem.height * largura / imagem.width)
+        imagem = imagem.convert("RGB").resize((largura, altura), Image.LANCZOS)
+    saida = io.BytesIO()
+    imagem.convert("RGB").save(saida, format="JPEG", quality=85, optimize=True)
+    return saida.getvalue()
+
+
+# Cache local de pôsteres: cada imagem é baixada uma única vez, guardada pelo
+# sha256 do conteúdo e convertida nas larguras que a interface usa. O disco
+# é limitado por uma cota e as miniaturas menos acessadas saem primeiro.
+class CachePosters:
+    def __init__(self, diretorio, larguras=(80, 200), quota_bytes=200 * 1024 * 1024, itens_memoria=512, downloads=8):
+        self.diretorio = diretorio
+        self.larguras = tuple(larguras)
+        self.quota_bytes = quota_bytes
+        self.itens_memoria = itens_memoria
+        os.makedirs(diretorio, exist_ok=True)
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memoria = OrderedDict()  # (url, largura) -> bytes
+        self._baixando = {}  # url -> threading.Event
+        self._executor = ThreadPoolExecutor(max_workers=downloads, thread_name_prefix="posters")
+        self._sessao = requests.Session()
+        self._sessao.mount("https://", HTTPAdapter(pool_maxsize=downloads))
+        self._sessao.mount("http://", HTTPAdapter(pool_maxsize=downloads))
+        self._gravacoes = 0
+        self.contadores = {"hits_memoria": 0, "hits_disco": 0, "downloads": 0, "bytes_baixados": 0, "erros": 0, "despejos": 0}
+
+        db = self._db()
+        for sql in SQL_CRIAR:
+            db.execute(sql)
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = abrir_sqlite(os.path.join(self.diretorio, "posters.sqlite3"))
+            self._local.conn = conn
+        return conn
+
+    def _caminho(self, hash_, largura):
+        return os.path.join(self.diretorio, hash_[:2], f"{hash_}_{largura}.jpg")
+
+    def _contar(self, nome, quantidade=1):
+        with self._lock:
+            self.contadores[nome] += quantidade
+        rastreamento.contar(f"posters_{nome}", quantidade)
+
+    def _lembrar(self, chave, dados):
+        with self._lock:
+            self._memoria[chave] = dados
+            self._memoria.move_to_end(chave)
+            while len(self._memoria) > self.itens_memoria:
+                self._memoria.popitem(last=False)
+
+    def _ler_disco(self, url, largura):
+        db = self._db()
+        linha = db.execute("SELECT hash FROM posters WHERE url = ?", (url,)).fetchone()
+        if linha is None:
+            return None
+        try:
+            with open(self._caminho(linha[0], largura), "rb") as f:
+                dados = f.read()
+        except OSError:
+            return None
+        db.execute("UPDATE miniaturas SET acessado_em = ? WHERE hash = ? AND largura = ?", (time.time(), linha[0], largura))
+        return dados
+
+    def _baixar(self, url):
+        with rastreamento.trecho("http", "poster"):
+            resposta = self._sessao.get(url, timeout=(3.05, 15))
+        resposta.raise_for_status()
+        original = resposta.content
+        self._contar("downloads")
+        self._contar("bytes_baixados", len(original))
+
+        hash_ = hashlib.sha256(original).hexdigest()
+        os.makedirs(os.path.dirname(self._caminho(hash_, 0)), exist_ok=True)
+        db = self._db()
+        agora = time.time()
+        for largura in self.larguras:
+            caminho = self._caminho(hash_, largura)
+            if not os.path.exists(caminho):
+                dados = redimensionar(original, largura)
+                temporario = f"{caminho}.{os.getpid()}.tmp"
+                with open(temporario, "wb") as f:
+                    f.write(dados)
+                os.replace(temporario, caminho)
+            db.execute(
+                "INSERT OR REPLACE INTO miniaturas (hash, largura, tamanho, acessado_em) VALUES (?, ?, ?, ?)",
+                (hash_, largura, os.path.getsize(caminho), agora),
+            )
+        db.execute("INSERT OR REPLACE INTO posters (url, hash) VALUES (?, ?)", (url, hash_))
+
+        with self._lock:
+            self._gravacoes += 1
+            verificar = self._gravacoes % 20 == 1
+        if verificar:
+            self._despejar()
+
+    # Garante que o pôster está em disco; downloads simultâneos da mesma URL
+    # (várias sessões abrindo a mesma busca) esperam o primeiro terminar
+    def _garantir(self, url):
+        with self._lock:
+            evento = self._baixando.get(url)
+            dono = evento is None
+            if dono:
+                evento = self._baixando[url] = threading.Event()
+        if not dono:
+            evento.wait(20)
+            return
+        try:
+            self._baixar(url)
+        finally:
+            with self._lock:
+                del self._baixando[url]
+            evento.set()
+
+    def _despejar(self):
+        db = self._db()
+        total = db.execute("SELECT COALESCE(SUM(tamanho), 0) FROM miniaturas").fetchone()[0]
+        if total <= self.quota_bytes:
+            return
+        excesso = total - int(self.quota_bytes * 0.9)
+        removidas = 0
+        for hash_, largura, tamanho in db.execute(
+            "SELECT hash, largura, tamanho FROM miniaturas ORDER BY acessado_em"
+        ).fetchall():
+            if excesso <= 0:
+                break
+            try:
+                os.remove(self._caminho(hash_, largura))
+            except OSError:
+                pass
+            db.execute("DELETE FROM miniaturas WHERE hash = ? AND largura = ?", (hash_, largura))
+            excesso -= tamanho
+            removidas += 1
+        # URLs cujo conteúdo perdeu todas as miniaturas serão baixadas de novo
+        db.execute("DELETE FROM posters WHERE hash NOT IN (SELECT hash FROM miniaturas)")
+        with self._lock:
+            self._memoria.clear()
+        self._contar("despejos", removidas)
+
+    # Devolve os bytes da miniatura, ou None se o pôster não pôde ser obtido
+    def obter(self, url, largura):
+        if not url:
+            return None
+        chave = (url, largura)
+        with self._lock:
+            dados = self._memoria.get(chave)
+            if dados is not None:
+                self._memoria.move_to_end(chave)
+                self.contadores["hits_memoria"] += 1
+                rastreamento.contar("posters_hits_memoria")
+                return dados
+        try:
+            dados = self._ler_disco(url, largura)
+            if dados is not None:
+                self._contar("hits_disco")
+            else:
+                self._garantir(url)
+                dados = self._ler_disco(url, largura)
+        except (requests.RequestException, OSError, sqlite3.Error, ValueError):
+            self._contar("erros")
+            logging.warning("Falha ao obter pôster %s.", url, exc_info=True)
+            return None
+        if dados is not None:
+            self._lembrar(chave, dados)
+        return dados
+
+    # Baixa em paralelo os pôsteres que ainda não estão em disco
+    def precarregar(self, urls, largura):
+        faltando = []
+        for url in dict.fromkeys(u for u in urls if u):
+            with self._lock:
+                if (url, largura) in self._memoria:
+                    continue
+            faltando.append(url)
+        list(self._executor.map(rastreamento.propagar(lambda u: self.obter(u, largura)), faltando))
+
+    def estatisticas(self):
+        with self._lock:
+            dados = dict(self.contadores)
+            dados["itens_memoria"] = len(self._memoria)
+        return dados
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obter_posters():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CachePosters(
+                os.path.join(diretorio_cache(), "posters"),
+                quota_bytes=float(os.getenv("POSTERS_QUOTA_MB", "200")) * 1024 * 1024,
+                itens_memoria=int(os.getenv("POSTERS_ITENS_MEMORIA", "512")),
+            )
+        return _cache
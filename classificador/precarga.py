@@ -0,0 +1,150 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from classificador import tmdb, rastreamento
+from classificador.posters import obter_posters
+
+
+# Pré-carga em segundo plano do que a tela de busca vai pedir em seguida:
+# assim que os resultados chegam, as miniaturas dos pôsteres, os detalhes de
+# cada filme e a próxima página da TMDb são buscados num pool pequeno e
+# gravados nos caches de sempre (pôsteres, "detalhes" e "busca"). Quando o
+# usuário vira a página ou abre os detalhes, tudo já sai do cache.
+#
+# Cada sessão tem no máximo `por_sessao` tarefas no pool ao mesmo tempo (o
+# resto espera na fila da própria sessão), para que uma sessão não ocupe o
+# pool das outras. Uma busca nova da sessão descarta o que a anterior ainda
+# não começou; o que já está em andamento termina e fica no cache.
+# As tarefas não entram no rerun de quem buscou (o rerun acaba antes delas),
+# só nos contadores do processo (precarga_*).
+
+class _Rodada:
+    def __init__(self, tarefas):
+        self.fila = deque(tarefas)
+        self.em_andamento = set()
+        self.cancelada = False
+
+
+class PreCarregador:
+    def __init__(self, threads=4, por_sessao=6):
+        self.por_sessao = por_sessao
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="precarga")
+        self._lock = threading.Lock()
+        self._rodadas = {}  # sessao -> _Rodada
+        self.contadores = {"agendadas": 0, "feitas": 0, "canceladas": 0, "erros": 0}
+
+    def _contar(self, nome, quantidade=1):
+        if not quantidade:
+            return
+        with self._lock:
+            self.contadores[nome] += quantidade
+        rastreamento.contar(f"precarga_{nome}", quantidade)
+
+    # Devolve quantas tarefas deixaram de rodar. Fora do lock: cancel()
+    # chama na hora o _terminou da tarefa, que pega o lock.
+    def _descartar(self, rodada):
+        if rodada is None:
+            return 0
+        with self._lock:
+            rodada.cancelada = True
+            descartadas = len(rodada.fila)
+            rodada.fila.clear()
+            futuros = list(rodada.em_andamento)
+        return descartadas + sum(1 for futuro in futuros if futuro.cancel())
+
+    def _executar(self, rodada, tarefa):
+        if rodada.cancelada:
+            self._contar("canceladas")
+            return
+        try:
+            tarefa()
+        except Exception:
+            self._contar("erros")
+            logging.warning("Falha na pré-carga.", exc_info=True)
+        else:
+            self._contar("feitas")
+
+    # Põe no pool as próximas tarefas da rodada, até o limite da sessão
+    def _completar(self, sessao, rodada):
+        while True:
+            with self._lock:
+                if rodada.cancelada or not rodada.fila or len(rodada.em_andamento) >= self.por_sessao:
+                    return
+                try:
+                    futuro = self._executor.submit(self._executar, rodada, rodada.fila.popleft())
+                except RuntimeError:
+                    # Pool encerrado: o processo está saindo
+                    rodada.cancelada = True
+                    rodada.fila.clear()
+                    return
+                rodada.em_andamento.add(futuro)
+            futuro.add_done_callback(lambda f: self._terminou(sessao, rodada, f))
+
+    def _terminou(self, sessao, rodada, futuro):
+        with self._lock:
+            rodada.em_andamento.discard(futuro)
+            if not rodada.fila and not rodada.em_andamento and self._rodadas.get(sessao) is rodada:
+                del self._rodadas[sessao]
+        self._completar(sessao, rodada)
+
+    # Troca o que a sessão tinha agendado pelas tarefas novas (na ordem de
+    # prioridade)
+    def agendar(self, sessao, tarefas):
+        rodada = _Rodada(tarefas)
+        with self._lock:
+            anterior = self._rodadas.get(sessao)
+            self._rodadas[sessao] = rodada
+        self._contar("canceladas", self._descartar(anterior))
+        self._contar("agendadas", len(rodada.fila))
+        self._completar(sessao, rodada)
+
+    def cancelar(self, sessao):
+        with self._lock:
+            anterior = self._rodadas.pop(sessao, None)
+        self._contar("canceladas", self._descartar(anterior))
+
+    # Primeiro o que aparece na tela (miniaturas e detalhes dos `visiveis`
+    # primeiros), depois a próxima página e o resto dos resultados
+    def apos_busca(self, sessao, titulo, resultados, pagina=1, idioma="pt-BR", visiveis=5, largura=200):
+        posters = obter_posters()
+        com_detalhes = os.getenv("TMDB_BUSCA", "api") != "offline"
+
+        def tarefas_de(filmes):
+            for filme in filmes:
+                url = tmdb.url_poster(filme.get("poster_path"))
+                if url:
+                    yield lambda url=url: posters.obter(url, largura)
+                if com_detalhes and filme.get("id"):
+                    yield lambda tmdb_id=filme["id"]: tmdb.detalhes_filme(tmdb_id, idioma)
+
+        tarefas = list(tarefas_de(resultados[:visiveis]))
+        # Página cheia (20 resultados): provavelmente há uma próxima
+        if len(resultados) >= 20:
+            tarefas.append(lambda: tmdb.buscar_filmes(titulo, idioma, pagina + 1))
+        tarefas.extend(tarefas_de(resultados[visiveis:]))
+        self.agendar(sessao, tarefas)
+
+    def estatisticas(self):
+        with self._lock:
+            dados = dict(self.contadores)
+            dados["sessoes_ativas"] = len(self._rodadas)
+            dados["em_andamento"] = sum(len(r.em_andamento) for r in self._rodadas.values())
+        return dados
+
+
+_precarregador = None
+_precarregador_lock = threading.Lock()
+
+
+def obter_precarregador():
+    global _precarregador
+    with _precarregador_lock:
+        if _precarregador is None:
+            _precarregador = PreCarregador(
+                threads=int(os.getenv("PRECARGA_THREADS", "4")),
+                por_sessao=int(os.getenv("PRECARGA_POR_SESSAO", "6")),
+            )
+        return _precarregador
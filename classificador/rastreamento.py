@@ -0,0 +1,329 @@
+import os
+import re
+import json
+import time
+import threading
+import contextvars
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+
+# Rastreamento leve dos reruns: cada consulta ao banco, requisição HTTP e
+# seção da página vira um trecho (tipo, nome, duração). Os trechos são
+# somados por rerun, por sessão e no processo inteiro, e cada rerun encerrado
+# pode ser exportado como uma linha JSON (RASTREAMENTO_JSONL) e num arquivo no
+# formato texto do Prometheus (RASTREAMENTO_PROMETHEUS), que o coletor
+# textfile do node_exporter lê.
+#
+# O rerun corrente fica numa ContextVar; as threads dos pools (TMDb, pôsteres)
+# só o enxergam quando a tarefa é submetida com propagar().
+
+MAX_AMOSTRAS = 2048
+MAX_NOMES = 500
+MAX_SESSOES = 256
+
+_rerun_atual = contextvars.ContextVar("rerun_atual", default=None)
+_lock = threading.Lock()
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+# Janela das últimas durações, com contagem e soma desde o início
+class Amostras:
+    def __init__(self):
+        self.janela = deque(maxlen=MAX_AMOSTRAS)
+        self.n = 0
+        self.soma = 0.0
+
+    def adicionar(self, valor):
+        self.janela.append(valor)
+        self.n += 1
+        self.soma += valor
+
+    def resumo(self):
+        janela = list(self.janela)
+        return {"n": self.n, "soma": self.soma, "p50": _percentil(janela, 50),
+                "p95": _percentil(janela, 95), "max": max(janela, default=0.0)}
+
+
+class Agregado:
+    def __init__(self):
+        self.reruns = Amostras()
+        self.consultas = Amostras()
+        self.trechos = defaultdict(Amostras)  # (tipo, nome) -> Amostras
+        self.contadores = defaultdict(int)
+
+    def registrar(self, tipo, nome, ms):
+        if (tipo, nome) not in self.trechos and len(self.trechos) >= MAX_NOMES:
+            nome = "outros"
+        self.trechos[(tipo, nome)].adicionar(ms)
+
+    def resumo(self):
+        return {
+            "reruns": self.reruns.resumo(),
+            "consultas_por_rerun": self.consultas.resumo(),
+            "trechos": [{"tipo": t, "nome": n, **a.resumo()} for (t, n), a in self.trechos.items()],
+            "contadores": dict(self.contadores),
+        }
+
+
+class Rerun:
+    def __init__(self, sessao, numero):
+        self.sessao = sessao
+        self.numero = numero
+        self.inicio = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self.trechos = []  # (tipo, nome, ms)
+        self.contadores = defaultdict(int)
+        self._secao = None  # (nome, inicio)
+
+    def registrar(self, tipo, nome, ms):
+        with self._lock:
+            self.trechos.append((tipo, nome, ms))
+
+    def contar(self, nome, quantidade):
+        with self._lock:
+            self.contadores[nome] += quantidade
+
+    def secao(self, nome):
+        agora = time.perf_counter()
+        if self._secao is not None:
+            self.registrar("render", self._secao[0], (agora - self._secao[1]) * 1000)
+        self._secao = (nome, agora) if nome else None
+
+    def resumo(self):
+        with self._lock:
+            trechos = list(self.trechos)
+            contadores = dict(self.contadores)
+        por_tipo = {}
+        for tipo, _, ms in trechos:
+            soma = por_tipo.setdefault(tipo, {"n": 0, "ms": 0.0})
+            soma["n"] += 1
+            soma["ms"] += ms
+        return {
+            "sessao": self.sessao,
+            "rerun": self.numero,
+            "inicio": self.inicio,
+            "total_ms": (time.perf_counter() - self._t0) * 1000,
+            "consultas": por_tipo.get("db", {}).get("n", 0),
+            "http": por_tipo.get("http", {}).get("n", 0),
+            "por_tipo": por_tipo,
+            "contadores": contadores,
+            "mais_lentos": [{"tipo": t, "nome": n, "ms": ms} for t, n, ms in sorted(trechos, key=lambda x: -x[2])[:10]],
+        }
+
+
+_processo = Agregado()
+_sessoes = OrderedDict()  # sessao -> Agregado
+_abertos = {}  # sessao -> Rerun ainda não encerrado (st.rerun/st.stop no meio)
+_medidores = {}  # nome -> função que devolve {chave: valor}
+_prometheus_gravado = float("-inf")
+
+
+def _nome_sql(sql):
+    sql = re.sub(r"(%s\s*,\s*)+%s", "%s…", " ".join(str(sql).split()))
+    return sql[:80]
+
+
+def registrar(tipo, nome, ms):
+    with _lock:
+        _processo.registrar(tipo, nome, ms)
+    rerun = _rerun_atual.get()
+    if rerun is not None:
+        rerun.registrar(tipo, nome, ms)
+
+
+@contextmanager
+def trecho(tipo, nome):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar(tipo, nome, (time.perf_counter() - inicio) * 1000)
+
+
+def trecho_sql(sql):
+    return trecho("db", _nome_sql(sql))
+
+
+def contar(nome, quantidade=1):
+    with _lock:
+        _processo.contadores[nome] += quantidade
+    rerun = _rerun_atual.get()
+    if rerun is not None:
+        rerun.contar(nome, quantidade)
+
+
+# Embrulha uma tarefa de thread pool para que os trechos dela contem no
+# rerun de quem a submeteu
+def propagar(funcao):
+    contexto = contextvars.copy_context()
+    return lambda *args, **kwargs: contexto.copy().run(funcao, *args, **kwargs)
+
+
+# Fecha a seção de página anterior e abre outra; a última é fechada por
+# finalizar_rerun()
+def secao(nome):
+    rerun = _rerun_atual.get()
+    if rerun is not None:
+        rerun.secao(nome)
+
+
+def iniciar_rerun(sessao):
+    with _lock:
+        aberto = _abertos.pop(sessao, None)
+    if aberto is not None:
+        _encerrar(aberto)
+    with _lock:
+        agregado = _sessoes.get(sessao)
+        numero = (agregado.reruns.n if agregado else 0) + 1
+        rerun = Rerun(sessao, numero)
+        _abertos[sessao] = rerun
+    _rerun_atual.set(rerun)
+    return rerun
+
+
+def finalizar_rerun():
+    rerun = _rerun_atual.get()
+    if rerun is None:
+        return None
+    _rerun_atual.set(None)
+    with _lock:
+        if _abertos.get(rerun.sessao) is rerun:
+            del _abertos[rerun.sessao]
+    return _encerrar(rerun)
+
+
+def _encerrar(rerun):
+    global _prometheus_gravado
+    rerun.secao(None)
+    resumo = rerun.resumo()
+    resumo["medidores"] = medidores()
+    with _lock:
+        sessao = _sessoes.get(rerun.sessao)
+        if sessao is None:
+            sessao = _sessoes[rerun.sessao] = Agregado()
+            while len(_sessoes) > MAX_SESSOES:
+                _sessoes.popitem(last=False)
+        _sessoes.move_to_end(rerun.sessao)
+        for agregado in (sessao, _processo):
+            agregado.reruns.adicionar(resumo["total_ms"])
+            agregado.consultas.adicionar(resumo["consultas"])
+        for tipo, nome, ms in list(rerun.trechos):
+            sessao.registrar(tipo, nome, ms)
+        for nome, quantidade in resumo["contadores"].items():
+            sessao.contadores[nome] += quantidade
+        gravar_prometheus = time.monotonic() - _prometheus_gravado >= float(os.getenv("RASTREAMENTO_PROMETHEUS_INTERVALO", "15"))
+        if gravar_prometheus:
+            _prometheus_gravado = time.monotonic()
+
+    caminho = os.getenv("RASTREAMENTO_JSONL")
+    if caminho:
+        with open(caminho, "a", encoding="utf-8") as f:
+            f.write(json.dumps(resumo, ensure_ascii=False) + "\n")
+    caminho = os.getenv("RASTREAMENTO_PROMETHEUS")
+    if caminho and gravar_prometheus:
+        temporario = caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            f.write(texto_prometheus())
+        os.replace(temporario, caminho)
+    return resumo
+
+
+# Valores instantâneos de outros módulos (ex.: o pool de conexões), lidos
+# ao encerrar cada rerun e exportados como gauges
+def registrar_medidor(nome, funcao):
+    with _lock:
+        _medidores[nome] = funcao
+
+
+def medidores():
+    with _lock:
+        funcoes = dict(_medidores)
+    return {nome: funcao() for nome, funcao in funcoes.items()}
+
+
+def sessao(sessao_id):
+    with _lock:
+        agregado = _sessoes.get(sessao_id)
+        return agregado.resumo() if agregado else None
+
+
+def processo():
+    with _lock:
+        return _processo.resumo()
+
+
+def _rotulos(**rotulos):
+    def escapar(valor):
+        return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    texto = ",".join(f'{k}="{escapar(v)}"' for k, v in rotulos.items())
+    return f"{{{texto}}}" if texto else ""
+
+
+def texto_prometheus():
+    dados = processo()
+    linhas = []
+
+    def sumario(nome, ajuda, series):
+        linhas.append(f"# HELP {nome} {ajuda}")
+        linhas.append(f"# TYPE {nome} summary")
+        for amostras, rotulos in series:
+            linhas.append(f"{nome}{_rotulos(**rotulos, quantile='0.5')} {amostras['p50']}")
+            linhas.append(f"{nome}{_rotulos(**rotulos, quantile='0.95')} {amostras['p95']}")
+            linhas.append(f"{nome}_sum{_rotulos(**rotulos)} {amostras['soma']}")
+            linhas.append(f"{nome}_count{_rotulos(**rotulos)} {amostras['n']}")
+
+    sumario("classificador_rerun_ms", "Duração dos reruns do app", [(dados["reruns"], {})])
+    sumario("classificador_consultas_por_rerun", "Consultas ao banco por rerun", [(dados["consultas_por_rerun"], {})])
+    sumario("classificador_trecho_ms", "Duração dos trechos rastreados",
+            [(t, {"tipo": t["tipo"], "nome": t["nome"]}) for t in dados["trechos"]])
+    linhas.append("# HELP classificador_eventos_total Acertos de cache, downloads e outros contadores")
+    linhas.append("# TYPE classificador_eventos_total counter")
+    for nome, valor in sorted(dados["contadores"].items()):
+        linhas.append(f"classificador_eventos_total{_rotulos(nome=nome)} {valor}")
+    linhas.append("# HELP classificador_medidor Valores instantâneos, como as conexões do pool")
+    linhas.append("# TYPE classificador_medidor gauge")
+    for medidor, valores in sorted(medidores().items()):
+        for nome, valor in sorted(valores.items()):
+            linhas.append(f"classificador_medidor{_rotulos(medidor=medidor, nome=nome)} {valor}")
+    return "\n".join(linhas) + "\n"
+
+
+def painel_ativo():
+    return os.getenv("RASTREAMENTO_PAINEL", "0") == "1"
+
+
+# Painel de depuração na barra lateral (RASTREAMENTO_PAINEL=1)
+def mostrar_painel(resumo):
+    import streamlit as st
+
+    with st.sidebar.expander("⏱️ Rastreamento", expanded=False):
+        st.markdown(f"**Rerun {resumo['rerun']}:** {resumo['total_ms']:.0f} ms · "
+                    f"{resumo['consultas']} consultas · {resumo['http']} requisições")
+        st.table([{"tipo": t, "trechos": v["n"], "ms": round(v["ms"], 1)} for t, v in sorted(resumo["por_tipo"].items())])
+        st.caption("Trechos mais lentos")
+        st.table([{"tipo": t["tipo"], "nome": t["nome"], "ms": round(t["ms"], 1)} for t in resumo["mais_lentos"]])
+
+        dados_sessao = sessao(resumo["sessao"])
+        if dados_sessao:
+            r = dados_sessao["reruns"]
+            c = dados_sessao["consultas_por_rerun"]
+            st.markdown(f"**Sessão:** {r['n']} reruns · p50 {r['p50']:.0f} ms · p95 {r['p95']:.0f} ms · "
+                        f"p95 consultas/rerun {c['p95']:.0f}")
+
+        dados_processo = processo()
+        st.caption("Processo: trechos com maior p95")
+        st.table([
+            {"tipo": t["tipo"], "nome": t["nome"], "n": t["n"], "p50": round(t["p50"], 1), "p95": round(t["p95"], 1)}
+            for t in sorted(dados_processo["trechos"], key=lambda t: -t["p95"])[:15]
+        ])
+        if dados_processo["contadores"]:
+            st.caption("Contadores")
+            st.table([{"nome": n, "valor": v} for n, v in sorted(dados_processo["contadores"].items())])
@@ -0,0 +1,403 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import threading
+
+from classificador.banco import transacao, agora_banco
+from classificador.cache import diretorio_cache
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # sem NumPy/SciPy o app não mostra recomendações
+    np = sparse = None
+
+
+# Recomendações "você pode gostar" por filtragem colaborativa item-item sobre
+# as notas de todos os usuários (tabela filmes).
+#
+#   python -m classificador.recomendacoes construir     modelo do zero
+#   python -m classificador.recomendacoes atualizar     só o que mudou
+#   python -m classificador.recomendacoes recomendar --usuario 3
+#
+# O construir monta a matriz esparsa usuário × filme, calcula a similaridade
+# (cosseno ajustado: notas menos a média do usuário, encolhido pelo número de
+# usuários em comum) em blocos de colunas e guarda só os K vizinhos de cada
+# filme em arquivos .npy, que o app abre com mmap. O atualizar lê as notas
+# alteradas desde o último modelo (filmes.atualizado_em) e refaz os vizinhos
+# dos filmes afetados; exclusões e o efeito da média nova nos outros filmes
+# só entram no próximo construir (um por dia basta).
+#
+# Para recomendar, as notas atuais do usuário (lidas do banco a cada
+# gravação, não as do modelo) votam nos vizinhos de cada filme avaliado; a
+# nota prevista é a média do usuário mais a média ponderada dos desvios.
+
+ARQUIVOS = ["filmes", "usuarios", "vizinhos", "similaridades", "indptr", "indices", "notas"]
+
+# Células da matriz densa de similaridades calculada por vez (~128 MB)
+CELULAS_POR_BLOCO = 32 * 1024 * 1024
+
+SQL_NOTAS = "SELECT tmdb_id, nota FROM filmes WHERE usuario_id = %s"
+# atualizado_em é TIMESTAMP no MySQL e segundos desde 1970 no SQLite
+SQL_ALTERADAS = {
+    "mysql": "SELECT usuario_id, tmdb_id, nota FROM filmes WHERE atualizado_em >= FROM_UNIXTIME(%s)",
+    "sqlite": "SELECT usuario_id, tmdb_id, nota FROM filmes WHERE atualizado_em >= %s",
+}
+
+
+def disponivel():
+    return np is not None
+
+
+def diretorio_modelo():
+    return os.getenv("RECOMENDACOES_DIR") or os.path.join(diretorio_cache(), "recomendacoes")
+
+
+def _colunas(linhas):
+    usuarios = np.fromiter((l[0] for l in linhas), np.int64, len(linhas))
+    filmes = np.fromiter((l[1] for l in linhas), np.int64, len(linhas))
+    notas = np.fromiter((float(l[2]) for l in linhas), np.float32, len(linhas))
+    return usuarios, filmes, notas
+
+
+# Todas as notas, em blocos pela chave primária
+def ler_avaliacoes(lote=50000):
+    blocos = []
+    apos = 0
+    while True:
+        with transacao() as cursor:
+            cursor.execute(
+                "SELECT id, usuario_id, tmdb_id, nota FROM filmes WHERE id > %s ORDER BY id LIMIT %s", (apos, lote)
+            )
+            linhas = cursor.fetchall()
+        if not linhas:
+            break
+        apos = linhas[-1][0]
+        blocos.append(_colunas([l[1:] for l in linhas]))
+        print(f"{sum(len(b[0]) for b in blocos)} avaliações lidas", file=sys.stderr)
+    if not blocos:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    return tuple(np.concatenate(coluna) for coluna in zip(*blocos))
+
+
+# Matriz usuário × filme (CSR) e as ids das linhas e das colunas. Se o mesmo
+# par aparecer mais de uma vez, vale a última nota.
+def montar_matriz(usuarios, filmes, notas):
+    lista_usuarios, linhas = np.unique(usuarios, return_inverse=True)
+    lista_filmes, colunas = np.unique(filmes, return_inverse=True)
+    chave = linhas.astype(np.int64) * len(lista_filmes) + colunas
+    _, primeiro = np.unique(chave[::-1], return_index=True)
+    ultimas = len(chave) - 1 - primeiro
+    matriz = sparse.csr_matrix(
+        (notas[ultimas].astype(np.float32), (linhas[ultimas], colunas[ultimas])),
+        shape=(len(lista_usuarios), len(lista_filmes)),
+    )
+    return lista_usuarios, lista_filmes, matriz
+
+
+# Notas centradas na média de cada usuário e colunas com norma 1 (o produto
+# de duas colunas vira o cosseno ajustado), mais a matriz de presença para
+# contar usuários em comum
+def _normalizar(matriz):
+    contagem = np.diff(matriz.indptr)
+    somas = np.asarray(matriz.sum(axis=1)).ravel()
+    medias = np.divide(somas, contagem, out=np.zeros(len(contagem), np.float32), where=contagem > 0)
+    centrada = matriz.copy()
+    centrada.data -= np.repeat(medias, contagem).astype(np.float32)
+    normas = np.sqrt(np.asarray(centrada.multiply(centrada).sum(axis=0)).ravel())
+    normas[normas == 0] = 1
+    centrada = (centrada @ sparse.diags((1 / normas).astype(np.float32))).tocsr()
+    presenca = matriz.copy()
+    presenca.data[:] = 1
+    return centrada, centrada.tocsc(), presenca, presenca.tocsc()
+
+
+# Similaridades das `colunas` com todos os filmes, um bloco denso por vez
+def _blocos_similaridade(matriz, colunas, encolhimento):
+    centrada, centrada_csc, presenca, presenca_csc = _normalizar(matriz)
+    tamanho = max(1, min(1024, CELULAS_POR_BLOCO // max(matriz.shape[1], 1)))
+    for inicio in range(0, len(colunas), tamanho):
+        bloco = colunas[inicio:inicio + tamanho]
+        similaridades = (centrada_csc[:, bloco].T @ centrada).toarray()
+        comuns = (presenca_csc[:, bloco].T @ presenca).toarray()
+        similaridades *= comuns / (comuns + encolhimento)
+        similaridades[np.arange(len(bloco)), bloco] = 0
+        yield bloco, similaridades
+
+
+# Os k maiores de cada linha, em ordem decrescente; só similaridades
+# positivas (o resto fica -1 / 0)
+def _maiores(similaridades, k):
+    n = similaridades.shape[1]
+    vizinhos = np.full((len(similaridades), k), -1, np.int32)
+    valores = np.zeros((len(similaridades), k), np.float32)
+    m = min(k, n)
+    if m == 0:
+        return vizinhos, valores
+    indices = np.argpartition(-similaridades, m - 1, axis=1)[:, :m] if m < n else np.tile(np.arange(n), (len(similaridades), 1))
+    escolhidos = np.take_along_axis(similaridades, indices, axis=1)
+    ordem = np.argsort(-escolhidos, axis=1, kind="stable")
+    indices = np.take_along_axis(indices, ordem, axis=1)
+    escolhidos = np.take_along_axis(escolhidos, ordem, axis=1)
+    positivos = escolhidos > 0
+    vizinhos[:, :m] = np.where(positivos, indices, -1)
+    valores[:, :m] = np.where(positivos, escolhidos, 0)
+    return vizinhos, valores
+
+
+def _gravar_modelo(diretorio, dados, meta):
+    os.makedirs(diretorio, exist_ok=True)
+    versao = f"v{int(time.time() * 1000)}"
+    destino = os.path.join(diretorio, versao)
+    os.makedirs(destino)
+    for nome in ARQUIVOS:
+        np.save(os.path.join(destino, nome + ".npy"), dados[nome])
+    with open(os.path.join(destino, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    temporario = os.path.join(diretorio, "atual.tmp")
+    with open(temporario, "w", encoding="utf-8") as f:
+        f.write(versao)
+    os.replace(temporario, os.path.join(diretorio, "atual"))
+    # Fica também a versão anterior, que um processo pode ainda estar abrindo
+    versoes = sorted(v for v in os.listdir(diretorio) if v.startswith("v") and v != versao)
+    for antiga in versoes[:-1]:
+        shutil.rmtree(os.path.join(diretorio, antiga), ignore_errors=True)
+    return versao
+
+
+def _dados(usuarios, filmes, matriz, vizinhos, similaridades):
+    return {
+        "filmes": filmes, "usuarios": usuarios, "vizinhos": vizinhos, "similaridades": similaridades,
+        "indptr": matriz.indptr, "indices": matriz.indices, "notas": matriz.data,
+    }
+
+
+def construir(k=50, encolhimento=10.0, diretorio=None):
+    marca = agora_banco()
+    lista_usuarios, lista_filmes, matriz = montar_matriz(*ler_avaliacoes())
+    vizinhos = np.full((len(lista_filmes), k), -1, np.int32)
+    similaridades = np.zeros((len(lista_filmes), k), np.float32)
+    feitos = 0
+    for bloco, densas in _blocos_similaridade(matriz, np.arange(len(lista_filmes)), encolhimento):
+        vizinhos[bloco], similaridades[bloco] = _maiores(densas, k)
+        feitos += len(bloco)
+        print(f"{feitos}/{len(lista_filmes)} filmes", file=sys.stderr)
+    meta = {"marca": marca, "k": k, "encolhimento": encolhimento, "avaliacoes": int(matriz.nnz)}
+    return _gravar_modelo(diretorio or diretorio_modelo(), _dados(lista_usuarios, lista_filmes, matriz, vizinhos, similaridades), meta)
+
+
+def _versao_atual(diretorio):
+    try:
+        with open(os.path.join(diretorio, "atual"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+# Junta as notas alteradas desde o último modelo e refaz os vizinhos dos
+# filmes afetados. Nas listas dos outros filmes, a similaridade com um filme
+# afetado é corrigida ou ele entra no lugar do vizinho mais fraco.
+def atualizar(diretorio=None):
+    diretorio = diretorio or diretorio_modelo()
+    versao = _versao_atual(diretorio)
+    if versao is None:
+        return construir(diretorio=diretorio)
+    modelo = ModeloRecomendacoes(os.path.join(diretorio, versao), versao)
+    marca = agora_banco()
+    with transacao() as cursor:
+        cursor.execute(SQL_ALTERADAS[cursor.motor], (modelo.meta["marca"],))
+        alteradas = cursor.fetchall()
+    if not alteradas:
+        return versao
+    k, encolhimento = modelo.meta["k"], modelo.meta["encolhimento"]
+
+    anterior = modelo.matriz().tocoo()
+    novos = _colunas(alteradas)
+    lista_usuarios, lista_filmes, matriz = montar_matriz(
+        np.concatenate([modelo.usuarios[anterior.row], novos[0]]),
+        np.concatenate([modelo.filmes[anterior.col], novos[1]]),
+        np.concatenate([anterior.data, novos[2]]),
+    )
+
+    # As listas antigas nas posições novas (filmes novos entram no meio)
+    mapa = np.searchsorted(lista_filmes, modelo.filmes).astype(np.int32)
+    vizinhos = np.full((len(lista_filmes), k), -1, np.int32)
+    similaridades = np.zeros((len(lista_filmes), k), np.float32)
+    vizinhos[mapa] = np.where(modelo.vizinhos >= 0, mapa[np.maximum(modelo.vizinhos, 0)], -1)
+    similaridades[mapa] = modelo.similaridades
+
+    afetados = np.unique(np.searchsorted(lista_filmes, novos[1]))
+    for bloco, densas in _blocos_similaridade(matriz, afetados, encolhimento):
+        vizinhos[bloco], similaridades[bloco] = _maiores(densas, k)
+        linhas, posicoes = np.nonzero(np.isin(vizinhos, bloco))
+        similaridades[linhas, posicoes] = densas[np.searchsorted(bloco, vizinhos[linhas, posicoes]), linhas]
+        for i, filme in enumerate(bloco):
+            for outro in vizinhos[filme]:
+                if outro < 0:
+                    break
+                if filme in vizinhos[outro]:
+                    continue
+                fraco = np.argmin(np.where(vizinhos[outro] >= 0, similaridades[outro], -np.inf))
+                if vizinhos[outro][fraco] < 0 or densas[i, outro] > similaridades[outro][fraco]:
+                    vizinhos[outro][fraco], similaridades[outro][fraco] = filme, densas[i, outro]
+
+    # Reordena as listas e tira as similaridades que deixaram de ser positivas
+    similaridades[vizinhos < 0] = 0
+    ordem = np.argsort(-similaridades, axis=1, kind="stable")
+    vizinhos = np.take_along_axis(vizinhos, ordem, axis=1)
+    similaridades = np.take_along_axis(similaridades, ordem, axis=1)
+    vizinhos[similaridades <= 0] = -1
+    similaridades[similaridades <= 0] = 0
+
+    meta = dict(modelo.meta, marca=marca, avaliacoes=int(matriz.nnz))
+    print(f"{len(alteradas)} notas alteradas, {len(afetados)} filmes refeitos", file=sys.stderr)
+    return _gravar_modelo(diretorio, _dados(lista_usuarios, lista_filmes, matriz, vizinhos, similaridades), meta)
+
+
+# Um modelo gravado, aberto com mmap: as páginas vão para a memória conforme
+# os filmes são consultados e são compartilhadas pelos processos do host
+class ModeloRecomendacoes:
+    def __init__(self, caminho, versao):
+        self.caminho = caminho
+        self.versao = versao
+        with open(os.path.join(caminho, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        for nome in ARQUIVOS:
+            setattr(self, nome, np.load(os.path.join(caminho, nome + ".npy"), mmap_mode="r"))
+
+    def matriz(self):
+        return sparse.csr_matrix(
+            (np.asarray(self.notas), np.asarray(self.indices), np.asarray(self.indptr)),
+            shape=(len(self.usuarios), len(self.filmes)),
+        )
+
+    # Posições das ids no modelo e quais delas existem
+    def _posicoes(self, tmdb_ids):
+        posicoes = np.minimum(np.searchsorted(self.filmes, tmdb_ids), max(len(self.filmes) - 1, 0))
+        existem = np.asarray(self.filmes[posicoes] == tmdb_ids) if len(self.filmes) else np.zeros(len(tmdb_ids), bool)
+        return posicoes, existem
+
+    # notas: {tmdb_id: nota}. Devolve [(tmdb_id, nota_prevista)], só de
+    # filmes com pelo menos `minimo_votos` filmes avaliados votando neles
+    # (se nenhum tiver, vale um voto)
+    def recomendar(self, notas, quantidade=10, minimo_votos=2, amortecimento=1.0):
+        if not notas or not len(self.filmes):
+            return []
+        ids = np.fromiter(notas.keys(), np.int64, len(notas))
+        valores = np.fromiter((float(v) for v in notas.values()), np.float32, len(notas))
+        posicoes, existem = self._posicoes(ids)
+        if not existem.any():
+            return []
+        media = valores.mean()
+        avaliados = posicoes[existem]
+        vizinhos = np.asarray(self.vizinhos[avaliados])
+        pesos = np.asarray(self.similaridades[avaliados])
+        desvios = np.broadcast_to((valores[existem] - media)[:, None], vizinhos.shape)
+        validos = vizinhos >= 0
+        alvos = vizinhos[validos]
+        n = len(self.filmes)
+        soma = np.bincount(alvos, weights=pesos[validos] * desvios[validos], minlength=n)
+        peso = np.bincount(alvos, weights=pesos[validos], minlength=n)
+        votos = np.bincount(alvos, minlength=n)
+        votos[avaliados] = 0
+        candidatos = np.flatnonzero(votos >= minimo_votos)
+        if not len(candidatos):
+            candidatos = np.flatnonzero(votos > 0)
+        previstas = np.clip(media + soma[candidatos] / peso[candidatos], 0.0, 10.0)
+        # A ordem usa o desvio amortecido: poucos votos fracos não passam na
+        # frente de muitos votos de filmes bem parecidos
+        amortecidas = soma[candidatos] / (peso[candidatos] + amortecimento)
+        ordem = np.argsort(-amortecidas, kind="stable")[:quantidade]
+        return [(int(self.filmes[candidatos[i]]), round(float(previstas[i]), 1)) for i in ordem]
+
+
+# Modelo atual do diretório, trocado quando um construir/atualizar grava
+# outro (verificado no máximo a cada `intervalo` segundos)
+class Recomendador:
+    def __init__(self, diretorio, intervalo=30.0):
+        self.diretorio = diretorio
+        self.intervalo = intervalo
+        self._modelo = None
+        self._verificado = None
+        self._lock = threading.Lock()
+
+    def modelo(self):
+        with self._lock:
+            agora = time.monotonic()
+            if self._verificado is None or agora - self._verificado >= self.intervalo:
+                self._verificado = agora
+                versao = _versao_atual(self.diretorio)
+                if versao and (self._modelo is None or self._modelo.versao != versao):
+                    try:
+                        self._modelo = ModeloRecomendacoes(os.path.join(self.diretorio, versao), versao)
+                        logging.info("Modelo de recomendações %s carregado.", versao)
+                    except (OSError, ValueError):
+                        logging.warning("Falha ao abrir o modelo de recomendações %s.", versao, exc_info=True)
+            return self._modelo
+
+    def recomendar(self, notas, quantidade=10):
+        modelo = self.modelo()
+        if modelo is None:
+            return None
+        return modelo.recomendar(notas, quantidade)
+
+
+_recomendador = None
+_recomendador_lock = threading.Lock()
+
+
+def obter_recomendador():
+    global _recomendador
+    with _recomendador_lock:
+        if _recomendador is None:
+            _recomendador = Recomendador(
+                diretorio_modelo(), float(os.getenv("RECOMENDACOES_VERIFICAR_INTERVALO", "30"))
+            )
+        return _recomendador
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Modelo de recomendações item-item")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    con = sub.add_parser("construir", help="calcula o modelo do zero")
+    con.add_argument("--vizinhos", type=int, default=50, help="vizinhos guardados por filme")
+    con.add_argument("--encolhimento", type=float, default=10.0, help="usuários em comum para meia confiança")
+
+    sub.add_parser("atualizar", help="refaz só os filmes com notas alteradas desde o último modelo")
+
+    rec = sub.add_parser("recomendar")
+    rec.add_argument("--usuario", type=int, required=True)
+    rec.add_argument("--quantidade", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if not disponivel():
+        parser.error("as recomendações precisam de numpy e scipy")
+
+    from dotenv import load_dotenv  # type: ignore
+    load_dotenv()
+
+    if args.comando == "construir":
+        print(f"modelo {construir(args.vizinhos, args.encolhimento)} gravado", file=sys.stderr)
+    elif args.comando == "atualizar":
+        print(f"modelo atual: {atualizar()}", file=sys.stderr)
+    else:
+        with transacao() as cursor:
+            cursor.execute(SQL_NOTAS, (args.usuario,))
+            notas = dict(cursor.fetchall())
+        inicio = time.perf_counter()
+        recomendados = obter_recomendador().recomendar(notas, args.quantidade)
+        ms = (time.perf_counter() - inicio) * 1000
+        if recomendados is None:
+            parser.error("nenhum modelo construído ainda")
+        for tmdb_id, prevista in recomendados:
+            print(f"{tmdb_id}\t{prevista}")
+        print(f"{len(recomendados)} recomendações em {ms:.2f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
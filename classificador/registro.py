@@ -0,0 +1,172 @@
+import os
+import re
+import gzip
+import time
+import queue
+import atexit
+import shutil
+import logging
+import threading
+from collections import defaultdict
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+# Logging do app sem escrita síncrona na thread do script: os registros vão
+# para uma fila e uma thread em segundo plano grava no arquivo, que é girado
+# por tamanho ou por tempo e comprimido com gzip. Segredos em query strings
+# (a api_key da TMDb vai em toda URL) são mascarados antes de entrar na fila.
+#
+#   LOG_NIVEL=INFO  LOG_NIVEIS="urllib3=WARNING,classificador=DEBUG"
+
+FORMATO = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+NIVEIS_PADRAO = "urllib3=WARNING,mysql.connector=WARNING,PIL=INFO"
+
+# Só textos com alguma destas palavras passam pelas expressões abaixo
+PALAVRAS_SEGREDO = ("key", "token", "pass", "senha", "secret", "authorization")
+SEGREDOS = [
+    re.compile(r"((?:api_key|apikey|access_token|token|password|passwd|senha|secret)=)[^&\s'\"]+", re.I),
+    re.compile(r"((?:Authorization|Proxy-Authorization)['\"]?\s*[:=]\s*['\"]?(?:Bearer|Basic)\s+)[^\s'\"]+", re.I),
+    re.compile(r"(['\"](?:password|passwd|senha|senha_hash|api_key|token)['\"]\s*:\s*['\"])[^'\"]*", re.I),
+]
+
+
+def redigir(texto):
+    minusculo = texto.lower()
+    if not any(p in minusculo for p in PALAVRAS_SEGREDO):
+        return texto
+    for padrao in SEGREDOS:
+        texto = padrao.sub(r"\1***", texto)
+    return texto
+
+
+def _comprimir(origem, destino):
+    with open(origem, "rb") as entrada, gzip.open(destino, "wb") as saida:
+        shutil.copyfileobj(entrada, saida)
+    os.remove(origem)
+
+
+# Gira ao passar de max_bytes ou quando o arquivo fica mais velho que
+# `intervalo` segundos; as cópias antigas viram app.log.1.gz, app.log.2.gz...
+class ArquivoRotativo(RotatingFileHandler):
+    def __init__(self, arquivo, max_bytes, intervalo, backups):
+        super().__init__(arquivo, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+        self.intervalo = intervalo
+        self._proxima = time.time() + intervalo if intervalo else None
+        self.namer = lambda nome: nome + ".gz"
+        self.rotator = _comprimir
+
+    def shouldRollover(self, record):
+        if self._proxima is not None and time.time() >= self._proxima:
+            if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+                return 1
+            self._proxima = time.time() + self.intervalo
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.intervalo:
+            self._proxima = time.time() + self.intervalo
+
+
+# Deixa passar 1 de cada `a_cada` registros DEBUG de cada logger
+class AmostragemDebug(logging.Filter):
+    def __init__(self, a_cada):
+        super().__init__()
+        self.a_cada = a_cada
+        self._contagens = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.a_cada <= 1:
+            return True
+        with self._lock:
+            n = self._contagens[record.name]
+            self._contagens[record.name] = n + 1
+        return n % self.a_cada == 0
+
+
+# Monta a mensagem na thread de quem loga (os argumentos podem mudar depois),
+# mascara os segredos e descarta em vez de bloquear se a fila encher. O
+# registro é alterado no lugar: a raiz é o último handler por onde ele passa.
+class FilaRedigida(QueueHandler):
+    def __init__(self, fila):
+        super().__init__(fila)
+        self.descartados = 0
+        self._formatador = logging.Formatter()
+
+    def prepare(self, record):
+        texto = record.getMessage()
+        if record.exc_info:
+            texto += "\n" + self._formatador.formatException(record.exc_info)
+        elif record.exc_text:
+            texto += "\n" + record.exc_text
+        if record.stack_info:
+            texto += "\n" + record.stack_info
+        record.msg = redigir(texto)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def carregar_niveis(texto):
+    niveis = {}
+    for parte in (texto or "").split(","):
+        if "=" in parte:
+            nome, nivel = parte.split("=", 1)
+            niveis[nome.strip()] = nivel.strip().upper()
+    return niveis
+
+
+_ouvinte = None
+_fila_handler = None
+_lock = threading.Lock()
+
+
+# Idempotente: os reruns do Streamlit chamam de novo e nada muda
+def configurar():
+    global _ouvinte, _fila_handler
+    with _lock:
+        if _ouvinte is not None:
+            return _fila_handler
+        arquivo = ArquivoRotativo(
+            os.getenv("LOG_ARQUIVO", "app.log"),
+            max_bytes=int(float(os.getenv("LOG_MAX_MB", "10")) * 1024 * 1024),
+            intervalo=float(os.getenv("LOG_ROTACAO_HORAS", "24")) * 3600,
+            backups=int(os.getenv("LOG_BACKUPS", "7")),
+        )
+        arquivo.setFormatter(logging.Formatter(FORMATO))
+
+        _fila_handler = FilaRedigida(queue.Queue(int(os.getenv("LOG_FILA", "10000"))))
+        _fila_handler.addFilter(AmostragemDebug(int(os.getenv("LOG_AMOSTRA_DEBUG", "1"))))
+
+        raiz = logging.getLogger()
+        raiz.addHandler(_fila_handler)
+        raiz.setLevel(os.getenv("LOG_NIVEL", "INFO").upper())
+        for nome, nivel in carregar_niveis(os.getenv("LOG_NIVEIS", NIVEIS_PADRAO)).items():
+            logging.getLogger(nome).setLevel(nivel)
+
+        _ouvinte = QueueListener(_fila_handler.queue, arquivo, respect_handler_level=True)
+        _ouvinte.start()
+        atexit.register(parar)
+        return _fila_handler
+
+
+# Esvazia a fila e fecha o arquivo
+def parar():
+    global _ouvinte, _fila_handler
+    with _lock:
+        if _ouvinte is None:
+            return
+        _ouvinte.stop()
+        for handler in _ouvinte.handlers:
+            handler.close()
+        logging.getLogger().removeHandler(_fila_handler)
+        _ouvinte = _fila_handler = None
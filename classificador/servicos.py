@@ -0,0 +1,618 @@
+import os
+import copy
+import time
+import atexit
+import hashlib
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+
+from classificador.banco import transacao, obter_pool
+from classificador import tmdb, estatisticas, registro, catalogo, filmes_salvos, recomendacoes, rastreamento, analise
+from classificador.invalidacao import CanalInvalidacao
+from classificador.assistidos import carregar_assistidos, AssistidosComPendentes
+from classificador.busca_biblioteca import carregar_biblioteca, BibliotecaComPendentes
+from classificador.cache import diretorio_cache
+from classificador.fila_gravacao import FilaGravacao
+from classificador.precarga import obter_precarregador
+from classificador.filmes_salvos import ID_PENDENTE, CachePaginas, sobrepor_pendentes
+from classificador.classificacao import classificar_filme
+
+
+# Camada de serviços do app: autenticação, busca, avaliações e as leituras da
+# lista e das estatísticas, sem nada de Streamlit. Importar este módulo não
+# abre conexões nem lê o ambiente; o pool, o cliente da TMDb e os caches são
+# criados uma vez por processo, na primeira chamada, pelos obter_*() de cada
+# módulo.
+#
+# As leituras por usuário (índices de assistidos e de títulos, páginas da
+# lista, anos e estatísticas) ficam num cache do processo, compartilhado pelas sessões do
+# mesmo usuário, e são invalidadas explicitamente por salvar_filme e
+# excluir_filme. Com vários processos (réplicas atrás de um balanceador), o
+# que outro processo gravou aparece pela versão do usuário
+# (estatisticas_usuario.versao, que sobe em toda gravação): antes de usar os
+# caches, cada processo confere a versão no banco, no máximo uma vez por
+# CACHE_CONFERIR_INTERVALO segundos por usuário, e descarta tudo se ela
+# mudou. Com INVALIDACAO_CANAL=1, os processos do mesmo host também avisam
+# uns aos outros logo depois de cada gravação (invalidacao).
+#
+# Com GRAVACAO_ASSINCRONA=1, salvar e excluir só entram na fila de gravação
+# (fila_gravacao) e voltam na hora; as leituras do usuário aplicam por cima
+# as gravações dele que ainda estão na fila.
+
+
+_iniciado = False
+_iniciado_lock = threading.Lock()
+
+
+# Carrega o .env e liga o logging uma vez por processo
+def iniciar():
+    global _iniciado
+    if _iniciado:
+        return
+    with _iniciado_lock:
+        if not _iniciado:
+            from dotenv import load_dotenv  # type: ignore
+            load_dotenv()
+            registro.configurar()
+            # Liga a fila também para gravar o que um processo anterior deixou
+            if gravacao_assincrona() or os.path.exists(arquivo_fila()):
+                obter_fila()
+            if os.getenv("INVALIDACAO_CANAL", "0") == "1":
+                obter_canal()
+            _iniciado = True
+
+
+_verificacao = None  # (instante, erro ou None)
+_verificacao_lock = threading.Lock()
+
+
+# Testa a conexão com o banco no máximo uma vez por DB_VERIFICAR_INTERVALO
+# segundos (falhas são testadas de novo em até 5s). Devolve a mensagem de
+# erro ou None.
+def verificar_conexao():
+    global _verificacao
+    intervalo = float(os.getenv("DB_VERIFICAR_INTERVALO", "60"))
+    with _verificacao_lock:
+        if _verificacao is not None:
+            instante, erro = _verificacao
+            validade = min(intervalo, 5.0) if erro else intervalo
+            if time.monotonic() - instante < validade:
+                return erro
+        try:
+            with transacao() as cursor:
+                cursor.execute("SELECT 1")
+            erro = None
+        except Exception as e:
+            erro = str(e)
+        _verificacao = (time.monotonic(), erro)
+        return erro
+
+
+def hash_senha(senha):
+    return hashlib.sha256(senha.encode()).hexdigest()
+
+
+def autenticar_usuario(email, senha):
+    try:
+        with transacao() as cursor:
+            cursor.execute("SELECT id, senha_hash FROM usuarios WHERE email = %s", (email,))
+            resultado = cursor.fetchone()
+        if resultado and resultado[1] == hash_senha(senha):
+            return resultado[0]
+    except Exception:
+        logging.error("Erro ao autenticar:\n%s", traceback.format_exc())
+    return None
+
+
+def registrar_usuario(email, senha):
+    try:
+        with transacao() as cursor:
+            cursor.execute("INSERT INTO usuarios (email, senha_hash) VALUES (%s, %s)", (email, hash_senha(senha)))
+        return True
+    except Exception:
+        logging.warning("Erro ao cadastrar %s:\n%s", email, traceback.format_exc())
+        return False
+
+
+# Busca na TMDb (com cache); falhas viram lista vazia e vão para o log
+def buscar_filmes(titulo, idioma="pt-BR", pagina=1):
+    try:
+        return tmdb.buscar_filmes(titulo, idioma, pagina)
+    except Exception:
+        logging.error("Erro ao buscar filmes:\n%s", traceback.format_exc())
+        return []
+
+
+# Agenda a pré-carga dos resultados recém-chegados (pôsteres, detalhes e a
+# próxima página), no lugar da pré-carga anterior da mesma sessão.
+# PRECARGA_THREADS=0 desliga.
+def precarregar_busca(sessao, titulo, resultados, pagina=1, idioma="pt-BR"):
+    if int(os.getenv("PRECARGA_THREADS", "4")) <= 0 or not resultados:
+        return
+    try:
+        obter_precarregador().apos_busca(sessao, titulo, resultados, pagina, idioma)
+    except Exception:
+        logging.warning("Erro ao agendar a pré-carga:\n%s", traceback.format_exc())
+
+
+# Duração e gêneros, se a pré-carga (ou uma visita anterior) já os trouxe;
+# a tela nunca espera pela API por eles
+def detalhes_em_cache(tmdb_id, idioma="pt-BR"):
+    try:
+        return tmdb.detalhes_em_cache(tmdb_id, idioma)
+    except Exception:
+        logging.warning("Erro ao ler detalhes do cache:\n%s", traceback.format_exc())
+        return None
+
+
+class LeiturasUsuario:
+    def __init__(self, usuario_id):
+        self.usuario_id = usuario_id
+        self.lock = threading.Lock()
+        self.assistidos = None
+        self.biblioteca = None
+        self.paginas = CachePaginas(usuario_id)
+        self.estatisticas = None
+        self.notas = None
+        self.recomendacoes = None  # (versão do modelo, lista)
+        self.versao = None  # versão do usuário no banco quando os caches foram lidos
+        self.conferido = None  # time.monotonic() da última conferência
+
+    def limpar(self):
+        self.assistidos = None
+        self.biblioteca = None
+        self.paginas.limpar()
+        self.estatisticas = None
+        self.notas = None
+        self.recomendacoes = None
+
+
+class CacheLeituras:
+    def __init__(self, max_usuarios=256, conferir=1.0):
+        self.max_usuarios = max_usuarios
+        self.conferir = conferir
+        self._usuarios = OrderedDict()
+        self._lock = threading.Lock()
+
+    def do_usuario(self, usuario_id):
+        with self._lock:
+            leituras = self._usuarios.get(usuario_id)
+            if leituras is None:
+                leituras = self._usuarios[usuario_id] = LeiturasUsuario(usuario_id)
+                while len(self._usuarios) > self.max_usuarios:
+                    self._usuarios.popitem(last=False)
+            self._usuarios.move_to_end(usuario_id)
+            return leituras
+
+    # Sem versão, sempre; com versão, só se o cache for de uma anterior
+    def invalidar(self, usuario_id, versao=None):
+        with self._lock:
+            leituras = self._usuarios.get(usuario_id)
+            if leituras is not None and (versao is None or leituras.versao is None or leituras.versao < versao):
+                del self._usuarios[usuario_id]
+
+
+_leituras = None
+_leituras_lock = threading.Lock()
+
+
+def obter_leituras():
+    global _leituras
+    with _leituras_lock:
+        if _leituras is None:
+            _leituras = CacheLeituras(
+                int(os.getenv("CACHE_USUARIOS_MAX", "256")),
+                float(os.getenv("CACHE_CONFERIR_INTERVALO", "1")),
+            )
+        return _leituras
+
+
+# Confere a versão do usuário no banco antes de usar os caches dele (com
+# leituras.lock). A versão é lida antes dos dados: um cache carregado depois
+# dela pode ser mais novo que ela (e ser descartado à toa na próxima
+# conferência), nunca mais velho.
+def _conferir(leituras):
+    agora = time.monotonic()
+    if leituras.conferido is not None and agora - leituras.conferido < obter_leituras().conferir:
+        return
+    with rastreamento.trecho("cache", "conferir_versao"):
+        versao = estatisticas.versao(leituras.usuario_id)
+    leituras.conferido = agora
+    if versao != leituras.versao:
+        if leituras.versao is not None:
+            rastreamento.contar("cache_versao_mudou")
+        leituras.limpar()
+        leituras.versao = versao
+
+
+_canal = None
+_canal_lock = threading.Lock()
+
+
+def arquivo_canal():
+    return os.getenv("INVALIDACAO_ARQUIVO") or os.path.join(diretorio_cache(), "invalidacoes.sqlite3")
+
+
+def obter_canal():
+    global _canal
+    with _canal_lock:
+        if _canal is None:
+            _canal = CanalInvalidacao(
+                arquivo_canal(), obter_leituras().invalidar,
+                intervalo=float(os.getenv("INVALIDACAO_INTERVALO", "0.2")),
+            )
+            atexit.register(_canal.parar)
+            _canal.iniciar()
+        return _canal
+
+
+def gravacao_assincrona():
+    return os.getenv("GRAVACAO_ASSINCRONA", "0") == "1"
+
+
+def arquivo_fila():
+    return os.getenv("FILA_GRAVACAO_ARQUIVO") or os.path.join(diretorio_cache(), "fila_gravacao.sqlite3")
+
+
+_fila = None
+_fila_lock = threading.Lock()
+
+
+# O pool é criado antes para que o atexit dele rode depois do da fila, que
+# ainda precisa do banco para gravar o que sobrou
+def obter_fila():
+    global _fila
+    with _fila_lock:
+        if _fila is None:
+            obter_pool()
+            _fila = FilaGravacao(
+                arquivo_fila(), _gravar_lote,
+                lote=int(os.getenv("FILA_GRAVACAO_LOTE", "100")),
+                espera=float(os.getenv("FILA_GRAVACAO_ESPERA", "0.2")),
+            )
+            atexit.register(_fila.parar)
+            _fila.iniciar()
+        return _fila
+
+
+# Gravações do usuário ainda na fila: {tmdb_id: (operacao, dados)}
+def _pendentes(usuario_id):
+    return _fila.pendentes(usuario_id) if _fila is not None else {}
+
+
+# Como estão no banco os filmes com gravação pendente (para as estatísticas
+# descontarem a versão antiga e para as linhas manterem o id)
+def _atuais(usuario_id, tmdb_ids):
+    placeholders = ",".join(["%s"] * len(tmdb_ids))
+    with transacao() as cursor:
+        cursor.execute(
+            f"SELECT tmdb_id, id, nota, classificacao, assistido_em FROM filmes WHERE usuario_id = %s AND tmdb_id IN ({placeholders})",
+            (usuario_id, *tmdb_ids),
+        )
+        return {r[0]: {"id": r[1], "nota": r[2], "classificacao": r[3], "assistido_em": r[4]} for r in cursor.fetchall()}
+
+
+def _linha_pendente(tmdb_id, dados, atual):
+    return dict(dados, id=atual["id"] if atual else ID_PENDENTE, tmdb_id=tmdb_id)
+
+
+# Índice dos filmes já avaliados: uma consulta por usuário e processo
+def assistidos(usuario_id):
+    leituras = obter_leituras().do_usuario(usuario_id)
+    with leituras.lock:
+        _conferir(leituras)
+        if leituras.assistidos is None:
+            leituras.assistidos = carregar_assistidos(usuario_id)
+        indice = leituras.assistidos
+    pendentes = _pendentes(usuario_id)
+    return AssistidosComPendentes(indice, pendentes) if pendentes else indice
+
+
+# Busca por título na biblioteca do usuário, a cada tecla: o índice é
+# carregado uma vez por usuário e processo e as buscas não vão ao banco. A
+# busca roda com o lock, porque _gravou ajusta o índice no lugar.
+def buscar_na_biblioteca(usuario_id, texto, limite=10):
+    leituras = obter_leituras().do_usuario(usuario_id)
+    pendentes = _pendentes(usuario_id)
+    with leituras.lock:
+        _conferir(leituras)
+        if leituras.biblioteca is None:
+            leituras.biblioteca = carregar_biblioteca(usuario_id)
+        indice = BibliotecaComPendentes(leituras.biblioteca, pendentes) if pendentes else leituras.biblioteca
+        with rastreamento.trecho("busca", "biblioteca"):
+            return indice.buscar(texto, limite)
+
+
+def anos_assistidos(usuario_id):
+    leituras = obter_leituras().do_usuario(usuario_id)
+    with leituras.lock:
+        _conferir(leituras)
+        anos = leituras.paginas.anos()
+    novos = {d["assistido_em"] for operacao, d in _pendentes(usuario_id).values()
+             if operacao == "salvar" and d.get("assistido_em")}
+    if novos - set(anos):
+        return sorted(novos | set(anos), reverse=True)
+    return anos
+
+
+def pagina_filmes(usuario_id, filtros, tamanho, apos=None):
+    leituras = obter_leituras().do_usuario(usuario_id)
+    with leituras.lock:
+        _conferir(leituras)
+        linhas, proxima = leituras.paginas.pagina(filtros, tamanho, apos)
+    pendentes = _pendentes(usuario_id)
+    if pendentes:
+        atuais = _atuais(usuario_id, list(pendentes))
+        por_tmdb = {t: _linha_pendente(t, d, atuais.get(t)) if operacao == "salvar" else None
+                    for t, (operacao, d) in pendentes.items()}
+        linhas = sobrepor_pendentes(linhas, apos, proxima, filtros, por_tmdb)
+    return linhas, proxima
+
+
+def ler_estatisticas(usuario_id):
+    leituras = obter_leituras().do_usuario(usuario_id)
+    with leituras.lock:
+        _conferir(leituras)
+        if leituras.estatisticas is None:
+            leituras.estatisticas = estatisticas.ler(usuario_id)
+        dados = leituras.estatisticas
+    pendentes = _pendentes(usuario_id)
+    if pendentes:
+        # Numa cópia; o top não é recarregado e pode ficar curto até a gravação
+        dados = copy.deepcopy(dados)
+        atuais = _atuais(usuario_id, list(pendentes))
+        for tmdb_id, (operacao, d) in pendentes.items():
+            atual = atuais.get(tmdb_id)
+            novo = _linha_pendente(tmdb_id, d, atual) if operacao == "salvar" else None
+            estatisticas.aplicar_delta(dados, antigo=atual, novo=novo)
+    return dados
+
+
+# {tmdb_id: nota} do usuário, com as gravações da fila por cima
+def _notas_usuario(usuario_id, leituras, pendentes):
+    if leituras.notas is None:
+        with transacao() as cursor:
+            cursor.execute(recomendacoes.SQL_NOTAS, (usuario_id,))
+            leituras.notas = {tmdb_id: float(nota) for tmdb_id, nota in cursor.fetchall()}
+    notas = dict(leituras.notas)
+    for tmdb_id, (operacao, d) in pendentes.items():
+        if operacao == "salvar":
+            notas[tmdb_id] = float(d["nota"])
+        else:
+            notas.pop(tmdb_id, None)
+    return notas
+
+
+# "Você pode gostar": [{tmdb_id, titulo, ano, poster_url, nota_prevista}],
+# ou None se não há NumPy/SciPy ou nenhum modelo foi construído ainda. As
+# notas do usuário são as atuais, então uma avaliação nova muda a lista na
+# hora; guardada por usuário até a próxima gravação ou o próximo modelo.
+def recomendacoes_usuario(usuario_id, quantidade=10):
+    if not recomendacoes.disponivel():
+        return None
+    modelo = recomendacoes.obter_recomendador().modelo()
+    if modelo is None:
+        return None
+    leituras = obter_leituras().do_usuario(usuario_id)
+    pendentes = _pendentes(usuario_id)
+    with leituras.lock:
+        _conferir(leituras)
+        if not pendentes and leituras.recomendacoes is not None and leituras.recomendacoes[0] == modelo.versao:
+            return leituras.recomendacoes[1]
+        notas = _notas_usuario(usuario_id, leituras, pendentes)
+    with rastreamento.trecho("recomendacoes", "recomendar"):
+        previstas = modelo.recomendar(notas, quantidade)
+    lista = []
+    if previstas:
+        placeholders = ",".join(["%s"] * len(previstas))
+        with transacao(dictionary=True) as cursor:
+            cursor.execute(
+                f"SELECT tmdb_id, titulo, ano, poster_url FROM catalogo WHERE tmdb_id IN ({placeholders})",
+                tuple(t for t, _ in previstas),
+            )
+            filmes = {f["tmdb_id"]: f for f in cursor.fetchall()}
+        lista = [dict(filmes[t], nota_prevista=nota) for t, nota in previstas if t in filmes]
+    if not pendentes:
+        with leituras.lock:
+            leituras.recomendacoes = (modelo.versao, lista)
+    return lista
+
+
+# Snapshot colunar dos relatórios entre usuários (python -m
+# classificador.analise exportar), ou None se não há pyarrow/pandas ou
+# nenhum snapshot foi exportado ainda. A página de relatórios só lê dele.
+def snapshot_analise():
+    if not analise.disponivel():
+        return None
+    return analise.obter_snapshots().atual()
+
+
+def relatorio(snapshot, nome):
+    with rastreamento.trecho("analise", nome):
+        return snapshot.relatorio(nome)
+
+
+# Depois de uma gravação, com a versão que ela deu ao usuário: os índices de
+# assistidos e de títulos são ajustados no lugar (evita recarregar
+# bibliotecas grandes); páginas, anos e estatísticas são refeitos.
+# `adicionados` traz (id, tmdb_id, título, ano). Se a versão pulou, outro
+# processo gravou no meio e o índice também é descartado.
+def _gravou(usuario_id, versao, adicionados=(), removidos=()):
+    leituras = obter_leituras().do_usuario(usuario_id)
+    with leituras.lock:
+        if leituras.versao is None or versao != leituras.versao + 1:
+            leituras.limpar()
+        else:
+            leituras.paginas.limpar()
+            leituras.estatisticas = None
+            leituras.notas = None
+            leituras.recomendacoes = None
+            if leituras.assistidos is not None:
+                for filme_id, tmdb_id, _, _ in adicionados:
+                    leituras.assistidos.adicionar(filme_id, tmdb_id)
+                for filme_id in removidos:
+                    leituras.assistidos.remover(filme_id)
+            if leituras.biblioteca is not None:
+                for filme_id, tmdb_id, titulo, ano in adicionados:
+                    leituras.biblioteca.adicionar(filme_id, tmdb_id, titulo, ano)
+                for filme_id in removidos:
+                    leituras.biblioteca.remover(filme_id)
+        leituras.versao = versao
+    if _canal is not None:
+        _canal.publicar(usuario_id, versao)
+
+
+# Grava a avaliação e o filme no catálogo, já dentro da transação; devolve
+# (id, versão nova do usuário)
+def _salvar(cursor, usuario_id, tmdb_id, titulo, ano, assistido_em, poster_url, nota, classificacao):
+    # Trava as estatísticas do usuário e traz o registro anterior, se houver
+    dados, antigo = estatisticas.bloquear_para_salvar(cursor, usuario_id, tmdb_id)
+
+    cursor.execute(catalogo.SQL_GRAVAR[cursor.motor], (tmdb_id, titulo, ano, poster_url or ""))
+    filme_id = filmes_salvos.salvar(cursor, usuario_id, tmdb_id, assistido_em, nota, classificacao)
+
+    novo = {"id": filme_id, "titulo": titulo, "ano": ano, "assistido_em": assistido_em,
+            "poster_url": poster_url, "nota": nota, "classificacao": classificacao}
+    return filme_id, estatisticas.atualizar(cursor, usuario_id, dados, antigo=antigo, novo=novo)
+
+
+# Devolve (id excluído, versão nova do usuário), ou (None, None) se o usuário
+# não tinha avaliado o filme
+def _excluir(cursor, usuario_id, tmdb_id):
+    dados, antigo = estatisticas.bloquear_para_excluir(cursor, usuario_id, tmdb_id)
+    if antigo is None:
+        return None, None
+    cursor.execute("DELETE FROM filmes WHERE id = %s AND usuario_id = %s", (antigo["id"], usuario_id))
+    return antigo["id"], estatisticas.atualizar(cursor, usuario_id, dados, antigo=antigo)
+
+
+# Um lote da fila numa transação só, em ordem de (usuário, filme) para que
+# lotes simultâneos travem as linhas na mesma ordem. Os caches do processo
+# são ajustados depois do commit e antes de a fila apagar as entradas: as
+# leituras sempre enxergam uma das duas versões.
+def _gravar_lote(entradas):
+    feitos = []
+    with transacao() as cursor:
+        for usuario_id, tmdb_id, operacao, d in sorted(entradas, key=lambda e: e[:2]):
+            if operacao == "salvar":
+                filme_id, versao = _salvar(cursor, usuario_id, tmdb_id, d["titulo"], d["ano"], d["assistido_em"],
+                                           d["poster_url"], d["nota"], d["classificacao"])
+                feitos.append((usuario_id, versao, [(filme_id, tmdb_id, d["titulo"], d["ano"])], []))
+            else:
+                filme_id, versao = _excluir(cursor, usuario_id, tmdb_id)
+                if filme_id is not None:
+                    feitos.append((usuario_id, versao, [], [filme_id]))
+    # Na ordem das gravações: a versão de cada usuário sobe uma a uma
+    for usuario_id, versao, adicionados, removidos in feitos:
+        _gravou(usuario_id, versao, adicionados, removidos)
+
+
+# Salva (ou atualiza) a avaliação do filme da TMDb e devolve a classificação;
+# título, ano e pôster vão para o catálogo compartilhado. Erros sobem.
+def salvar_filme(usuario_id, tmdb_id, titulo, ano, assistido_em, poster_url, nota):
+    classificacao = classificar_filme(nota)
+    if gravacao_assincrona():
+        obter_fila().enfileirar(usuario_id, tmdb_id, "salvar", {
+            "titulo": titulo, "ano": ano, "assistido_em": assistido_em, "poster_url": poster_url or "",
+            "nota": float(nota), "classificacao": classificacao,
+        })
+        return classificacao
+    with transacao() as cursor:
+        filme_id, versao = _salvar(cursor, usuario_id, tmdb_id, titulo, ano, assistido_em, poster_url, nota, classificacao)
+    _gravou(usuario_id, versao, adicionados=[(filme_id, tmdb_id, titulo, ano)])
+    return classificacao
+
+
+def excluir_filme(usuario_id, tmdb_id):
+    if gravacao_assincrona():
+        obter_fila().enfileirar(usuario_id, tmdb_id, "excluir", {})
+        return
+    with transacao() as cursor:
+        filme_id, versao = _excluir(cursor, usuario_id, tmdb_id)
+    if filme_id is not None:
+        _gravou(usuario_id, versao, removidos=[filme_id])
+
+
+# Aplica um lote da lista de um usuário numa transação: `gravar` é {tmdb_id:
+# {assistido_em, nota, classificacao}} e `excluir`, um conjunto de tmdb_ids.
+# Filmes que o usuário não tem (ex.: excluídos em outra aba) só voltam com
+# inserir=True, e então a entrada traz também titulo, ano e poster_url para
+# o top. Devolve o lote que desfaz este, ou None se nada mudou.
+def _aplicar_lote(usuario_id, gravar, excluir, inserir=False):
+    tmdb_ids = sorted(set(gravar) | set(excluir))
+    if not tmdb_ids:
+        return None
+    # Gravações do usuário ainda na fila iriam por cima do lote (e da cópia
+    # que o desfaz): grava todas antes, inclusive as que estão em andamento
+    if _pendentes(usuario_id):
+        _fila.esvaziar_usuario(usuario_id, float(os.getenv("FILA_GRAVACAO_PRAZO_LOTE", "10")))
+
+    desfazer = {"gravar": {}, "excluir": []}
+    mudancas, edicoes, removidos, adicionados = [], [], [], []
+    with transacao() as cursor:
+        dados, antigos = estatisticas.bloquear_para_lote(cursor, usuario_id, tmdb_ids)
+        for tmdb_id in tmdb_ids:
+            antigo = antigos.get(tmdb_id)
+            if antigo is not None:
+                antigo["nota"] = float(antigo["nota"])
+            if tmdb_id in excluir:
+                if antigo is not None:
+                    removidos.append(antigo["id"])
+                    mudancas.append((antigo, None))
+                    desfazer["gravar"][tmdb_id] = {k: v for k, v in antigo.items() if k != "id"}
+                continue
+            entrada = gravar[tmdb_id]
+            if antigo is None:
+                if not inserir:
+                    continue
+                filme_id = filmes_salvos.salvar(cursor, usuario_id, tmdb_id, entrada["assistido_em"],
+                                                entrada["nota"], entrada["classificacao"])
+                adicionados.append((filme_id, tmdb_id, entrada["titulo"], entrada["ano"]))
+                mudancas.append((None, dict(entrada, id=filme_id)))
+                desfazer["excluir"].append(tmdb_id)
+                continue
+            novo = dict(antigo, assistido_em=entrada["assistido_em"], nota=float(entrada["nota"]),
+                        classificacao=entrada["classificacao"])
+            if novo == antigo:
+                continue
+            edicoes.append((novo["assistido_em"], novo["nota"], novo["classificacao"], antigo["id"]))
+            mudancas.append((antigo, novo))
+            desfazer["gravar"][tmdb_id] = {k: v for k, v in antigo.items() if k != "id"}
+        if edicoes:
+            cursor.executemany(filmes_salvos.SQL_EDITAR, edicoes)
+        if removidos:
+            cursor.execute(
+                f"DELETE FROM filmes WHERE usuario_id = %s AND id IN ({','.join(['%s'] * len(removidos))})",
+                (usuario_id, *removidos),
+            )
+        if not mudancas:
+            return None
+        versao = estatisticas.atualizar_varios(cursor, usuario_id, dados, mudancas)
+    _gravou(usuario_id, versao, adicionados, removidos)
+    return desfazer
+
+
+# Edição em lote da lista de filmes salvos, numa transação: `edicoes` é
+# {tmdb_id: (assistido_em, nota)} (a classificação sai da nota) e
+# `exclusoes`, tmdb_ids. Devolve o que desfazer_lote precisa para voltar
+# atrás, ou None se nada mudou.
+def editar_lote(usuario_id, edicoes, exclusoes=()):
+    exclusoes = set(exclusoes)
+    gravar = {
+        tmdb_id: {"assistido_em": assistido_em, "nota": float(nota), "classificacao": classificar_filme(nota)}
+        for tmdb_id, (assistido_em, nota) in edicoes.items() if tmdb_id not in exclusoes
+    }
+    return _aplicar_lote(usuario_id, gravar, exclusoes)
+
+
+# Volta ao que era antes do lote: as avaliações editadas recebem os valores
+# antigos e as excluídas são salvas de novo (com ids novos). Devolve o lote
+# que refaz a edição.
+def desfazer_lote(usuario_id, desfazer):
+    return _aplicar_lote(usuario_id, desfazer["gravar"], desfazer["excluir"], inserir=True)
+
+
+def sair(usuario_id):
+    obter_leituras().invalidar(usuario_id)
@@ -0,0 +1,236 @@
+import os
+import re
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from classificador import rastreamento
+from classificador.cache import obter_cache, chave_busca
+
+
+class ErroTMDb(Exception):
+    def __init__(self, mensagem, status=None):
+        super().__init__(mensagem)
+        self.status = status
+
+
+# Balde de fichas: até `rajada` requisições de uma vez e `taxa` por segundo
+# em regime. A TMDb derruba com 429 quem passa de ~50 req/s por IP.
+class LimiteTaxa:
+    def __init__(self, taxa, rajada):
+        self.taxa = taxa
+        self.rajada = rajada
+        self._fichas = float(rajada)
+        self._atualizado = time.monotonic()
+        self._lock = threading.Lock()
+
+    def aguardar(self):
+        if self.taxa <= 0:
+            return
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._fichas = min(self.rajada, self._fichas + (agora - self._atualizado) * self.taxa)
+                self._atualizado = agora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                falta = (1 - self._fichas) / self.taxa
+            time.sleep(falta)
+
+
+# Cliente da API v3 com conexões keep-alive reaproveitadas entre chamadas
+class ClienteTMDb:
+    STATUS_REPETIR = {429, 500, 502, 503, 504}
+
+    def __init__(self, api_key, base_url="https://api.themoviedb.org/3", idioma="pt-BR",
+                 timeout=(3.05, 10.0), tentativas=3, backoff=0.5, taxa=40.0, rajada=40, conexoes=10):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.idioma = idioma
+        self.timeout = timeout
+        self.tentativas = tentativas
+        self.backoff = backoff
+        self.conexoes = conexoes
+        self.limite = LimiteTaxa(taxa, rajada)
+
+        self._sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=2, pool_maxsize=conexoes, max_retries=0)
+        self._sessao.mount("https://", adaptador)
+        self._sessao.mount("http://", adaptador)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _espera(self, tentativa, resposta=None):
+        if resposta is not None:
+            retry_after = resposta.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), 30.0)
+                except ValueError:
+                    pass
+        return self.backoff * (2 ** tentativa) * (0.5 + random.random() / 2)
+
+    def get(self, caminho, **params):
+        params = {k: v for k, v in params.items() if v is not None}
+        params["api_key"] = self.api_key
+        url = f"{self.base_url}/{caminho.lstrip('/')}"
+        rota = "tmdb " + re.sub(r"\d+", "{id}", caminho.lstrip("/"))
+        for tentativa in range(self.tentativas + 1):
+            self.limite.aguardar()
+            try:
+                with rastreamento.trecho("http", rota):
+                    resposta = self._sessao.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if tentativa == self.tentativas:
+                    raise ErroTMDb(f"Falha de rede em {caminho}: {e}") from e
+                time.sleep(self._espera(tentativa))
+                continue
+            if resposta.status_code == 200:
+                return resposta.json()
+            if resposta.status_code in self.STATUS_REPETIR and tentativa < self.tentativas:
+                logging.warning("TMDb respondeu %s em %s, tentando de novo.", resposta.status_code, caminho)
+                time.sleep(self._espera(tentativa, resposta))
+                continue
+            raise ErroTMDb(f"TMDb respondeu {resposta.status_code} em {caminho}", resposta.status_code)
+
+    def buscar(self, query, pagina=1, idioma=None):
+        return self.get("search/movie", query=query, page=pagina, language=idioma or self.idioma)
+
+    def detalhes(self, tmdb_id, idioma=None):
+        return self.get(f"movie/{int(tmdb_id)}", language=idioma or self.idioma)
+
+    def _pool_threads(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.conexoes, thread_name_prefix="tmdb")
+            return self._executor
+
+    # Executa as chamadas em paralelo (limitadas pelo balde de fichas) e
+    # devolve os resultados na mesma ordem; falhas viram a própria exceção
+    def em_lote(self, chamadas):
+        futuros = [self._pool_threads().submit(rastreamento.propagar(funcao), *args) for funcao, *args in chamadas]
+        resultados = []
+        for futuro in futuros:
+            try:
+                resultados.append(futuro.result())
+            except Exception as e:
+                resultados.append(e)
+        return resultados
+
+    def buscar_varios(self, queries, idioma=None):
+        return self.em_lote([(self.buscar, q, 1, idioma) for q in queries])
+
+    def buscar_paginas(self, query, paginas, idioma=None):
+        return self.em_lote([(self.buscar, query, p, idioma) for p in paginas])
+
+    def detalhes_varios(self, ids, idioma=None):
+        return self.em_lote([(self.detalhes, i, idioma) for i in ids])
+
+    def fechar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._sessao.close()
+
+
+_cliente = None
+_cliente_lock = threading.Lock()
+
+
+def obter_cliente():
+    global _cliente
+    with _cliente_lock:
+        if _cliente is None:
+            _cliente = ClienteTMDb(
+                os.getenv("TMDB_API_KEY"),
+                base_url=os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3"),
+                timeout=(float(os.getenv("TMDB_TIMEOUT_CONEXAO", "3.05")), float(os.getenv("TMDB_TIMEOUT_LEITURA", "10"))),
+                tentativas=int(os.getenv("TMDB_TENTATIVAS", "3")),
+                taxa=float(os.getenv("TMDB_TAXA", "40")),
+                rajada=int(os.getenv("TMDB_RAJADA", "40")),
+                conexoes=int(os.getenv("TMDB_CONEXOES", "10")),
+            )
+        return _cliente
+
+
+def _chave_pagina(titulo, idioma, pagina):
+    chave = chave_busca(titulo, idioma)
+    return chave if pagina == 1 else f"{chave}|{pagina}"
+
+
+def _buscar_api(titulo, idioma, pagina=1):
+    return obter_cache("busca").obter(
+        _chave_pagina(titulo, idioma, pagina),
+        lambda: obter_cliente().buscar(titulo, pagina, idioma).get("results", [])
+    )
+
+
+# TMDB_BUSCA escolhe de onde vêm as buscas (erros sobem):
+#   api      sempre a API, passando pelo cache de buscas (memória + disco)
+#   local    o catálogo local primeiro; a API só quando ele não tem o filme
+#            detalhado, e a resposta é gravada no catálogo
+#   offline  só o catálogo local
+# O catálogo local só responde a primeira página; as seguintes vêm da API
+# (no modo offline, não há).
+def buscar_filmes(titulo, idioma="pt-BR", pagina=1):
+    modo = os.getenv("TMDB_BUSCA", "api")
+    if modo == "api" or (pagina > 1 and modo == "local"):
+        return _buscar_api(titulo, idioma, pagina)
+    if pagina > 1:
+        return []
+
+    from classificador.catalogo_local import obter_catalogo
+    catalogo = obter_catalogo()
+    locais = catalogo.buscar(titulo, somente_detalhados=True)
+    if locais:
+        rastreamento.contar("catalogo_hits")
+        return locais
+    rastreamento.contar("catalogo_misses")
+    if modo != "offline":
+        try:
+            resultados = _buscar_api(titulo, idioma)
+        except ErroTMDb:
+            # API fora do ar: melhor os títulos originais do export que nada
+            resultados = catalogo.buscar(titulo)
+            if not resultados:
+                raise
+            return resultados
+        catalogo.gravar(resultados)
+        return resultados
+    return catalogo.buscar(titulo)
+
+
+def _cache_detalhes():
+    return obter_cache("detalhes", ttl=7 * 86400, ttl_obsoleto=30 * 86400)
+
+
+def _chave_detalhes(tmdb_id, idioma):
+    return f"{idioma}|{int(tmdb_id)}"
+
+
+# Detalhes de um filme (duração, gêneros...), pelo cache "detalhes"; fora do
+# modo api a resposta também vai para o catálogo local
+def detalhes_filme(tmdb_id, idioma="pt-BR"):
+    def carregar():
+        dados = obter_cliente().detalhes(tmdb_id, idioma)
+        if os.getenv("TMDB_BUSCA", "api") != "api":
+            from classificador.catalogo_local import obter_catalogo
+            obter_catalogo().gravar([dados])
+        return dados
+    return _cache_detalhes().obter(_chave_detalhes(tmdb_id, idioma), carregar)
+
+
+# Detalhes só se já estiverem no cache, sem ir à API
+def detalhes_em_cache(tmdb_id, idioma="pt-BR"):
+    return _cache_detalhes().espiar(_chave_detalhes(tmdb_id, idioma))
+
+
+def url_poster(poster_path):
+    if not poster_path:
+        return ""
+    return os.getenv("TMDB_IMG_BASE", "https://image.tmdb.org/t/p/w500") + poster_path
@@ -0,0 +1,184 @@
+import re
+import sys
+import json
+import zlib
+import struct
+import time
+import random
+import argparse
+import threading
+import unicodedata
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# Servidor local que imita as rotas da TMDb usadas pelo app, para testes e
+# benchmarks sem rede: TMDB_BASE_URL=http://127.0.0.1:<porta>/3
+
+PALAVRAS = [
+    "Duna", "Avatar", "Senhor", "dos", "Anéis", "Troia", "Thor", "Matrix", "Cidade", "de", "Deus",
+    "O", "Poderoso", "Chefão", "Batman", "Guerra", "nas", "Estrelas", "Titanic", "Vingadores",
+    "Interestelar", "Coringa", "Parasita", "Central", "do", "Brasil", "Tropa", "Elite",
+]
+
+
+def _sem_acento(texto):
+    return "".join(c for c in unicodedata.normalize("NFKD", texto.casefold()) if not unicodedata.combining(c))
+
+
+def gerar_catalogo(quantidade=5000, semente=42):
+    aleatorio = random.Random(semente)
+    catalogo = []
+    for tmdb_id in range(1, quantidade + 1):
+        titulo = " ".join(aleatorio.sample(PALAVRAS, aleatorio.randint(1, 4)))
+        ano = aleatorio.randint(1950, 2025)
+        catalogo.append({
+            "id": tmdb_id,
+            "title": titulo,
+            "original_title": titulo,
+            "release_date": f"{ano}-{aleatorio.randint(1, 12):02d}-{aleatorio.randint(1, 28):02d}",
+            "poster_path": f"/poster{tmdb_id}.jpg",
+            "popularity": round(aleatorio.uniform(0, 100), 3),
+            "vote_average": round(aleatorio.uniform(0, 10), 1),
+            "overview": f"Sinopse do filme {titulo}.",
+        })
+    return catalogo
+
+
+# PNG listrado gerado sem dependências, com o tamanho de um pôster w500
+def gerar_poster(semente, largura=500, altura=750):
+    cor = [(semente * 37) % 256, (semente * 91) % 256, (semente * 53) % 256]
+    linhas = bytearray()
+    for y in range(altura):
+        linhas.append(0)
+        tom = (y * 255 // altura + semente) % 256
+        for x in range(largura):
+            linhas += bytes((cor[0] ^ tom, cor[1] ^ (x % 256), (cor[2] + x * y) % 256))
+
+    def bloco(tipo, dados):
+        return struct.pack(">I", len(dados)) + tipo + dados + struct.pack(">I", zlib.crc32(tipo + dados))
+
+    cabecalho = struct.pack(">IIBBBBB", largura, altura, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + bloco(b"IHDR", cabecalho) + bloco(b"IDAT", zlib.compress(bytes(linhas), 6)) + bloco(b"IEND", b"")
+
+
+class ServidorTMDbFalso:
+    def __init__(self, porta=0, latencia=0.0, falhar_a_cada=0, catalogo=None):
+        self.latencia = latencia
+        self.falhar_a_cada = falhar_a_cada
+        self.catalogo = catalogo if catalogo is not None else gerar_catalogo()
+        self._por_id = {f["id"]: f for f in self.catalogo}
+        self._indice = [(_sem_acento(f["title"]), f) for f in self.catalogo]
+        self._lock = threading.Lock()
+        self.requisicoes = 0
+        self.por_rota = {}
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", porta), self._handler())
+        self._servidor.daemon_threads = True
+        self._thread = None
+        self._posters = {}
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._servidor.server_address[1]}/3"
+
+    # Equivalente a IMG_BASE (https://image.tmdb.org/t/p/w500)
+    @property
+    def url_imagens(self):
+        return f"http://127.0.0.1:{self._servidor.server_address[1]}/t/p/w500"
+
+    # Arquivos com a mesma semente dão o mesmo PNG: o cache é pela semente
+    def poster(self, arquivo):
+        semente = sum(arquivo.encode())
+        with self._lock:
+            if semente not in self._posters:
+                self._posters[semente] = gerar_poster(semente)
+            return self._posters[semente]
+
+    def _contar(self, rota):
+        with self._lock:
+            self.requisicoes += 1
+            self.por_rota[rota] = self.por_rota.get(rota, 0) + 1
+            return self.requisicoes
+
+    def buscar(self, query, pagina):
+        termos = _sem_acento(query).split()
+        achados = [f for texto, f in self._indice if all(t in texto for t in termos)]
+        achados.sort(key=lambda f: -f["popularity"])
+        inicio = (pagina - 1) * 20
+        return {
+            "page": pagina,
+            "results": achados[inicio:inicio + 20],
+            "total_results": len(achados),
+            "total_pages": max(1, (len(achados) + 19) // 20),
+        }
+
+    def _handler(self):
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, status, corpo, tipo="application/json"):
+                dados = corpo if isinstance(corpo, bytes) else json.dumps(corpo).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(dados)))
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                n = servidor._contar(url.path)
+                if servidor.latencia:
+                    time.sleep(servidor.latencia)
+                if servidor.falhar_a_cada and n % servidor.falhar_a_cada == 0:
+                    return self._responder(503 if (n // servidor.falhar_a_cada) % 2 else 429, {"status_message": "falha simulada"})
+                if url.path.startswith("/3/") and "api_key" not in params:
+                    return self._responder(401, {"status_message": "Invalid API key"})
+                if url.path == "/3/search/movie":
+                    return self._responder(200, servidor.buscar(params.get("query", ""), int(params.get("page", "1"))))
+                m = re.fullmatch(r"/t/p/\w+/(\w+\.jpg)", url.path)
+                if m:
+                    return self._responder(200, servidor.poster(m.group(1)), "image/png")
+                m = re.fullmatch(r"/3/movie/(\d+)", url.path)
+                if m and int(m.group(1)) in servidor._por_id:
+                    detalhes = dict(servidor._por_id[int(m.group(1))], runtime=120, genres=[{"id": 18, "name": "Drama"}])
+                    return self._responder(200, detalhes)
+                return self._responder(404, {"status_message": "not found"})
+
+        return Handler
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._servidor.serve_forever, name="tmdb-falso", daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor TMDb falso para testes locais")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos de atraso por requisição")
+    parser.add_argument("--falhar-a-cada", type=int, default=0, help="responde 503/429 a cada N requisições")
+    args = parser.parse_args()
+    servidor = ServidorTMDbFalso(args.porta, args.latencia, args.falhar_a_cada)
+    print(f"TMDb falso em {servidor.url}", file=sys.stderr)
+    try:
+        servidor._servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,50 @@
+import streamlit as st
+import logging
+import time
+import traceback
+
+from classificador import servicos
+
+# Relatórios entre usuários, lidos do snapshot colunar (python -m
+# classificador.analise exportar): nenhuma consulta ao banco
+servicos.iniciar()
+
+st.title("📈 Relatórios")
+
+if "usuario_id" not in st.session_state:
+    st.warning("Faça login na página principal para ver os relatórios.")
+    st.stop()
+
+try:
+    snapshot = servicos.snapshot_analise()
+    if snapshot is None:
+        st.info("Relatórios indisponíveis: nenhum snapshot de análise foi exportado ainda.")
+        st.stop()
+
+    criado_em = time.strftime("%d/%m/%Y %H:%M", time.localtime(snapshot.meta["criado_em"]))
+    st.caption(f"Dados de {criado_em} (snapshot {snapshot.versao})")
+
+    resumo = servicos.relatorio(snapshot, "resumo")
+    cols = st.columns(4)
+    cols[0].metric("Avaliações", resumo["avaliacoes"])
+    cols[1].metric("Usuários", resumo["usuarios"])
+    cols[2].metric("Filmes", resumo["filmes"])
+    cols[3].metric("Nota média", resumo["nota_media"])
+
+    st.subheader("🏅 Mais avaliados")
+    st.dataframe(servicos.relatorio(snapshot, "mais_avaliados"), hide_index=True)
+
+    st.subheader("🗓️ Notas por ano de lançamento")
+    por_lancamento = servicos.relatorio(snapshot, "notas_por_lancamento")
+    st.line_chart(por_lancamento[["nota_media", "nota_mediana"]])
+    st.bar_chart(por_lancamento["avaliacoes"])
+
+    st.subheader("📊 Notas por década de lançamento")
+    st.bar_chart(servicos.relatorio(snapshot, "histograma_por_decada"))
+
+    st.subheader("🏷️ Classificações por ano assistido")
+    st.bar_chart(servicos.relatorio(snapshot, "classificacoes_por_ano"))
+
+except Exception as e:
+    st.error("Erro ao carregar relatórios.")
+    logging.error("Erro nos relatórios:\n%s", traceback.format_exc())